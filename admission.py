@@ -0,0 +1,390 @@
+"""Admission control for expensive routes.
+
+Login and signup spend most of their time in bcrypt, bulk routes
+(history import and export) walk whole histories, and /batch fans out into
+many sub-requests. Left alone, a burst of them occupies every worker thread
+and cheap reads queue behind it. Routes wrapped in
+``AdmissionControl.limit(route_class)`` are admitted in three steps, each of
+which can shed the request with ``AdmissionRejected`` (answered 429 with
+``Retry-After``):
+
+* a token bucket per user (the email being logged in or signed up, or the
+  authenticated user) and, where enabled, one per client IP, refilled at a
+  steady rate;
+* a concurrency limit per route class. Requests over the limit wait in a
+  FIFO queue, but only while the expected wait - the recent service time of
+  that class times the requests ahead, divided by the limit - fits within
+  the class's latency budget. Otherwise they are shed at once rather than
+  after timing out;
+* giving up once the budget has elapsed without a slot.
+
+Routes without a limit never touch any of this, so they keep their latency
+while the limited classes are saturated.
+
+Buckets and slots live in a ``SQLiteStore`` when ``ADMISSION_STORE`` is set
+to a file path (environment: ``PHASE_ADMISSION_STORE``), so every worker
+process shares the same limits. Otherwise they live in a ``MemoryStore``
+and each process enforces them separately. Slots are leases, so a worker
+that dies mid-request frees its slot after ``ADMISSION_LEASE`` seconds. If
+the shared store itself fails, requests are admitted rather than turned
+away.
+
+Per-class settings (``ADMISSION_POLICIES``, merged over ``DEFAULT_POLICIES``):
+
+* ``concurrency`` - requests of the class running at once, in this process
+  or, with a shared store, across all of them. For ``auth`` it defaults to
+  the password hashing workers (``BCRYPT_POOL_SIZE``) times the processes
+  sharing the store; with ``ADMISSION_STORE`` set that count must be given
+  as ``ADMISSION_PROCESSES`` (environment: ``PHASE_ADMISSION_PROCESSES``,
+  else ``WEB_CONCURRENCY``) unless the concurrency is set explicitly
+* ``budget`` - seconds a request may wait for a slot
+* ``ip_rate``/``ip_burst`` and ``user_rate``/``user_burst`` - tokens per
+  second and bucket size; a rate of ``None`` disables that bucket
+
+Per-IP buckets are off by default: the Streamlit frontend calls the API for
+all of its users from one server address, so a per-IP limit would cap the
+whole site. Enable them only where ``request.remote_addr`` is the end
+client's - clients calling the API directly, or behind a proxy the app
+trusts through ``werkzeug.middleware.proxy_fix.ProxyFix``.
+"""
+import logging
+import math
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import Response, request
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POLICIES = {
+    'auth': {'concurrency': None, 'budget': 1.0,  # concurrency None: one per password hashing worker, see above
+             'ip_rate': None, 'ip_burst': None, 'user_rate': 0.1, 'user_burst': 5},
+    'bulk': {'concurrency': 2, 'budget': 2.0,
+             'ip_rate': None, 'ip_burst': None, 'user_rate': 0.5, 'user_burst': 5},
+    # /batch runs up to MAX_BATCH_REQUESTS sub-requests, and every dashboard load is one. Limited sub-requests
+    # still pass their own class's buckets, so the batch itself is only bounded in concurrency
+    'batch': {'concurrency': 8, 'budget': 1.0,
+              'ip_rate': None, 'ip_burst': None, 'user_rate': None, 'user_burst': None},
+}
+
+POLL_INTERVAL = 0.01
+
+
+class AdmissionRejected(Exception):
+    """The request was shed; retry after ``retry_after`` seconds."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class Policy:
+    def __init__(self, name, concurrency, budget, ip_rate=None, ip_burst=None, user_rate=None, user_burst=None):
+        self.name = name
+        self.concurrency = max(int(concurrency), 1)
+        self.budget = budget
+        self.ip_rate = ip_rate
+        self.ip_burst = ip_burst
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+
+
+# Stores: token buckets keyed by string, and per-class FIFO queues of tickets that are either waiting or admitted
+
+class MemoryStore:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}  # key -> (tokens, updated, full_at)
+        self._queues = {}  # route class -> OrderedDict(ticket -> [admitted, expires])
+        self._tickets = 0
+
+    def take(self, key, rate, burst, now):
+        with self._lock:
+            tokens, updated, _ = self._buckets.get(key, (burst, now, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            wait = (1 - tokens) / rate if tokens < 1 else 0.0
+            if not wait:
+                tokens -= 1
+            self._buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+            if len(self._buckets) > 100000:
+                # Drop buckets that have refilled completely, each at its own rate; they are the same as absent ones
+                self._buckets = {k: v for k, v in self._buckets.items() if v[2] > now}
+            return wait
+
+    def join(self, route, deadline):
+        with self._lock:
+            self._tickets += 1
+            self._queues.setdefault(route, OrderedDict())[self._tickets] = [False, deadline]
+            return self._tickets
+
+    def try_admit(self, route, ticket, limit, lease, now):
+        with self._lock:
+            queue = self._queues[route]
+            for expired in [t for t, (_, expires) in queue.items() if expires < now and t != ticket]:
+                del queue[expired]
+            running = sum(1 for admitted, _ in queue.values() if admitted)
+            ahead = 0
+            if ticket not in queue:
+                return False, 0
+            for other, (admitted, _) in queue.items():
+                if other == ticket:
+                    break
+                ahead += not admitted
+            if running < limit and ahead < limit - running:
+                queue[ticket] = [True, now + lease]
+                return True, 0
+            return False, ahead
+
+    def release(self, route, ticket):
+        with self._lock:
+            self._queues.get(route, {}).pop(ticket, None)
+
+
+class SQLiteStore:
+    """``MemoryStore`` semantics in a SQLite file shared by every worker process."""
+
+    def __init__(self, path):
+        self.path = path
+        # One connection per process, opened lazily so forked workers never share one; the lock
+        # keeps this process's threads from contending with each other for SQLite's write lock
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=OFF')  # Counters, not records: losing them on a crash is fine
+        connection.executescript(
+            'CREATE TABLE IF NOT EXISTS admission_bucket '
+            '(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, full_at REAL NOT NULL);'
+            'CREATE TABLE IF NOT EXISTS admission_ticket '
+            '(id INTEGER PRIMARY KEY, route TEXT NOT NULL, admitted INTEGER NOT NULL, expires REAL NOT NULL);'
+            'CREATE INDEX IF NOT EXISTS ix_admission_ticket_route ON admission_ticket (route, admitted, id);'
+        )
+        if 'full_at' not in {column[1] for column in connection.execute('PRAGMA table_info(admission_bucket)')}:
+            # Store created before buckets recorded when they refill; treat its buckets as full
+            connection.execute('ALTER TABLE admission_bucket ADD COLUMN full_at REAL NOT NULL DEFAULT 0')
+        return connection
+
+    @contextmanager
+    def _transaction(self):
+        # Every operation is one short BEGIN IMMEDIATE transaction
+        with self._lock:
+            if self._pid != os.getpid():
+                self._connection, self._pid = self._connect(), os.getpid()
+            connection = self._connection
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield connection
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+            connection.execute('COMMIT')
+
+    def take(self, key, rate, burst, now):
+        with self._transaction() as connection:
+            row = connection.execute('SELECT tokens, updated FROM admission_bucket WHERE key = ?', (key,)).fetchone()
+            tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+            wait = (1 - tokens) / rate if tokens < 1 else 0.0
+            if not wait:
+                tokens -= 1
+            connection.execute(
+                'INSERT INTO admission_bucket (key, tokens, updated, full_at) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated, '
+                'full_at = excluded.full_at',
+                (key, tokens, now, now + (burst - tokens) / rate),
+            )
+            if row is None and random.random() < 0.001:
+                # Occasionally drop buckets that have refilled completely, each at its own rate
+                connection.execute('DELETE FROM admission_bucket WHERE full_at <= ?', (now,))
+            return wait
+
+    def join(self, route, deadline):
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                'INSERT INTO admission_ticket (route, admitted, expires) VALUES (?, 0, ?)', (route, deadline)
+            )
+            return cursor.lastrowid
+
+    def try_admit(self, route, ticket, limit, lease, now):
+        with self._transaction() as connection:
+            connection.execute('DELETE FROM admission_ticket WHERE route = ? AND expires < ? AND id != ?',
+                               (route, now, ticket))
+            running, = connection.execute(
+                'SELECT count(*) FROM admission_ticket WHERE route = ? AND admitted = 1', (route,)
+            ).fetchone()
+            ahead, = connection.execute(
+                'SELECT count(*) FROM admission_ticket WHERE route = ? AND admitted = 0 AND id < ?', (route, ticket)
+            ).fetchone()
+            if running < limit and ahead < limit - running:
+                cursor = connection.execute('UPDATE admission_ticket SET admitted = 1, expires = ? WHERE id = ?',
+                                            (now + lease, ticket))
+                return cursor.rowcount == 1, ahead
+            return False, ahead
+
+    def release(self, route, ticket):
+        with self._transaction() as connection:
+            connection.execute('DELETE FROM admission_ticket WHERE id = ?', (ticket,))
+
+
+def _finishing(iterable, finish):
+    try:
+        yield from iterable
+    finally:
+        finish()
+
+
+class AdmissionControl:
+    def __init__(self, app=None):
+        self.store = MemoryStore()
+        self.lease = 30.0
+        self.policies = {}
+        self._lock = threading.Lock()
+        self._service_time = {}  # route class -> moving average of seconds per admitted request, this process
+        self._stats = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if 'PHASE_ADMISSION_STORE' in os.environ:
+            app.config['ADMISSION_STORE'] = os.environ['PHASE_ADMISSION_STORE']
+        path = app.config.setdefault('ADMISSION_STORE', None)
+        self.store = SQLiteStore(path) if path else MemoryStore()
+        # Longer than any request should run, so a live request never loses its slot
+        self.lease = app.config.setdefault('ADMISSION_LEASE', 30.0)
+
+        for env_name in ('PHASE_ADMISSION_PROCESSES', 'WEB_CONCURRENCY'):
+            if env_name in os.environ:
+                app.config['ADMISSION_PROCESSES'] = int(os.environ[env_name])
+                break
+        processes = app.config.setdefault('ADMISSION_PROCESSES', None)
+
+        overrides = app.config.setdefault('ADMISSION_POLICIES', {})
+        hashing_workers = app.config.get('BCRYPT_POOL_SIZE') or 1
+        for name, settings in DEFAULT_POLICIES.items():
+            settings = dict(settings, **overrides.get(name, {}))
+            if settings['concurrency'] is None:
+                if path and processes is None:
+                    # A shared store limits every process together; one process's pool size would throttle them
+                    raise RuntimeError(
+                        f"ADMISSION_STORE is shared by every worker process: set ADMISSION_PROCESSES "
+                        f"(or WEB_CONCURRENCY) or ADMISSION_POLICIES['{name}']['concurrency']")
+                settings['concurrency'] = hashing_workers * (processes if path else 1)
+            self.policies[name] = Policy(name, **settings)
+            self._stats[name] = dict.fromkeys(
+                ('admitted', 'shed_rate', 'shed_queue', 'shed_timeout', 'store_errors'), 0)
+            self._stats[name]['queue_wait_seconds_total'] = 0.0
+        app.extensions['admission'] = self
+
+    # Public API
+
+    def limit(self, route_class, user=None):
+        """Decorator admitting the view under ``route_class``'s policy.
+
+        ``user`` returns the key for the per-user bucket, or ``None`` to skip it.
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                policy = self.policies[route_class]
+                ticket = self._admit(policy, request.remote_addr, user() if user is not None else None)
+                started = time.monotonic()
+                finished = []
+
+                def finish():
+                    if finished:
+                        return
+                    finished.append(True)
+                    self._observe(policy, time.monotonic() - started)
+                    if ticket is not None:
+                        self._store_call(policy, self.store.release, policy.name, ticket)
+
+                try:
+                    result = view(*args, **kwargs)
+                except BaseException:
+                    finish()
+                    raise
+                if isinstance(result, Response) and result.is_streamed:
+                    # The work happens while the body is sent; hold the slot until it is sent or abandoned
+                    result.response = _finishing(result.response, finish)
+                    result.call_on_close(finish)
+                else:
+                    finish()
+                return result
+            return wrapper
+        return decorator
+
+    def metrics(self):
+        """Per-class counters for this process."""
+        with self._lock:
+            return {name: dict(stats) for name, stats in self._stats.items()}
+
+    # Internals
+
+    def _admit(self, policy, ip, user_key):
+        now = time.time()
+        for scope, key, rate, burst in (('ip', ip, policy.ip_rate, policy.ip_burst),
+                                        ('user', user_key, policy.user_rate, policy.user_burst)):
+            if rate is None or key is None:
+                continue
+            wait = self._store_call(policy, self.store.take, f'{policy.name}:{scope}:{key}', rate, burst, now)
+            if wait:
+                self._count(policy, 'shed_rate')
+                raise AdmissionRejected("Too many requests, slow down", wait)
+
+        deadline = now + policy.budget
+        ticket = self._store_call(policy, self.store.join, policy.name, deadline)
+        if ticket is None:
+            return None
+        while True:
+            result = self._store_call(policy, self.store.try_admit, policy.name, ticket, policy.concurrency,
+                                      self.lease, time.time())
+            if result is None:
+                return ticket
+            admitted, ahead = result
+            if admitted:
+                self._count(policy, 'admitted', queue_wait_seconds_total=time.time() - now)
+                return ticket
+
+            expected_wait = self._expected_wait(policy, ahead)
+            if time.time() + expected_wait > deadline:
+                self._store_call(policy, self.store.release, policy.name, ticket)
+                self._count(policy, 'shed_queue' if time.time() + POLL_INTERVAL < deadline else 'shed_timeout')
+                raise AdmissionRejected("Server busy, try again shortly", max(expected_wait, policy.budget))
+            # Check back about when the request ahead should finish
+            time.sleep(min(max(expected_wait / (ahead + 1), POLL_INTERVAL), max(deadline - time.time(), 0.0)))
+
+    def _expected_wait(self, policy, ahead):
+        service_time = self._service_time.get(policy.name)
+        if service_time is None:
+            # Nothing measured yet: wait out the budget rather than guess
+            return POLL_INTERVAL
+        return service_time * (ahead + 1) / policy.concurrency
+
+    def _observe(self, policy, seconds):
+        with self._lock:
+            previous = self._service_time.get(policy.name)
+            self._service_time[policy.name] = seconds if previous is None else previous + 0.2 * (seconds - previous)
+
+    def _count(self, policy, counter, **totals):
+        with self._lock:
+            stats = self._stats[policy.name]
+            stats[counter] += 1
+            for key, value in totals.items():
+                stats[key] += value
+
+    def _store_call(self, policy, method, *args):
+        # A broken or locked shared store must not take logins down with it: admit and count it
+        try:
+            return method(*args)
+        except sqlite3.Error:
+            logger.exception("Admission store unavailable; admitting request")
+            self._count(policy, 'store_errors')
+            return None
@@ -0,0 +1,276 @@
+"""Population statistics: cycle lengths, period lengths and today's phases.
+
+Rows are read as plain column tuples in keyset-paginated chunks - cycles in
+``(user_id, period_start)`` order straight off the history index, one
+``CycleStats`` row per user for today's phase - with dates left as ISO
+strings for NumPy to parse, so memory is bounded by the chunk size however
+many rows there are. Each chunk is folded into a ``Summary`` of fixed-size
+histograms, and summaries merge by addition, so ``--workers`` can split the
+user id range across a process pool and combine the results.
+
+Today's phase follows the /menstrual-phase rules for each user's latest
+cycle: the recorded cycle while it lasts, then the late-cycle prediction.
+
+    python analytics.py [--date YYYY-MM-DD] [--chunk-size 50000] [--workers 4] [--json]
+"""
+import argparse
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+import numpy as np
+from sqlalchemy import String, func, select, tuple_, type_coerce
+
+from models import db, CycleData, CycleStats
+from phase_engine import (DEFAULT_CYCLE_LENGTH, FOLLICULAR_LENGTH, OVULATION_LENGTH, PHASES,
+                          LATE, RECORDED, SLIGHTLY_LATE, VERY_LATE)
+
+DEFAULT_CHUNK_SIZE = 50000
+MAX_CYCLE_DAYS = 120  # Longer gaps share the last histogram bin
+MAX_PERIOD_DAYS = 31
+RULES = (RECORDED, LATE, SLIGHTLY_LATE, VERY_LATE)
+
+
+class Histogram:
+    """Counts of non-negative integer values; values above ``size`` land in the overflow bin."""
+
+    def __init__(self, size):
+        self.size = size
+        self.counts = np.zeros(size + 2, dtype=np.int64)  # 0..size, then overflow
+        self.total = 0
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.int64)
+        self.counts += np.bincount(np.clip(values, 0, self.size + 1), minlength=self.size + 2)
+        self.total += int(values.sum())
+
+    def merge(self, other):
+        self.counts += other.counts
+        self.total += other.total
+
+    @property
+    def count(self):
+        return int(self.counts.sum())
+
+    def percentile(self, q):
+        cumulative = np.cumsum(self.counts)
+        if not cumulative[-1]:
+            return None
+        return int(np.searchsorted(cumulative, q / 100 * cumulative[-1]))
+
+    def report(self):
+        count = self.count
+        return {
+            "count": count,
+            "mean": self.total / count if count else None,
+            "p10": self.percentile(10),
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "overflow": int(self.counts[-1]),
+            "histogram": {str(value): int(n) for value, n in enumerate(self.counts[:-1]) if n},
+        }
+
+
+class Summary:
+    def __init__(self):
+        self.cycle_lengths = Histogram(MAX_CYCLE_DAYS)
+        self.period_lengths = Histogram(MAX_PERIOD_DAYS)
+        self.phases = np.zeros(len(PHASES), dtype=np.int64)
+        self.rules = np.zeros(len(RULES), dtype=np.int64)
+
+    def merge(self, other):
+        self.cycle_lengths.merge(other.cycle_lengths)
+        self.period_lengths.merge(other.period_lengths)
+        self.phases += other.phases
+        self.rules += other.rules
+        return self
+
+    def report(self):
+        users = int(self.phases.sum())
+        return {
+            "cycles": self.period_lengths.count,
+            "users_with_cycles": users,
+            "cycle_length_days": self.cycle_lengths.report(),
+            "period_length_days": self.period_lengths.report(),
+            "phase_share_today": {phase: int(n) / users if users else 0.0 for phase, n in zip(PHASES, self.phases)},
+            "prediction_share_today": {rule: int(n) / users if users else 0.0 for rule, n in zip(RULES, self.rules)},
+        }
+
+
+def expected_cycle_lengths(length_count, mean_length, median_length):
+    """Vectorized ``CycleStats.expected_cycle_length``."""
+    with np.errstate(invalid='ignore'):
+        lengths = np.where(length_count < 3, np.rint(mean_length), np.rint(median_length))
+    lengths = np.where(length_count == 0, CycleStats.DEFAULT_CYCLE_LENGTH, lengths)
+    return np.maximum(lengths, 1).astype(np.int64)
+
+
+def _dates(values):
+    return np.array(values, dtype='datetime64[D]')
+
+
+def _phase_index(offset, menstrual_length):
+    # Vectorized phase_engine.phase_table lookup for offsets inside the cycle
+    follicular_end = menstrual_length + FOLLICULAR_LENGTH
+    return ((offset >= menstrual_length).astype(np.int8) + (offset >= follicular_end)
+            + (offset >= follicular_end + OVULATION_LENGTH))
+
+
+def phases_today(period_start, period_end, cycle_length, today):
+    """Vectorized /menstrual-phase answer for each user's latest cycle: ``(phase index, rule index)``."""
+    today = np.datetime64(today, 'D')
+    period_days = (period_end - period_start).astype(np.int64) + 1
+
+    # Inside the recorded cycle, read against the default length as determine_phase does
+    offset = (today - period_start).astype(np.int64)
+    recorded = (offset >= 0) & (offset < DEFAULT_CYCLE_LENGTH)
+    recorded_phase = _phase_index(offset, np.clip(period_days, 1, DEFAULT_CYCLE_LENGTH))
+
+    # Otherwise predicted_phase_on's rules, relative to the predicted next period
+    next_start = period_end + cycle_length.astype('timedelta64[D]')
+    days_from_next = (today - next_start).astype(np.int64)
+    slightly_late = np.abs(days_from_next) <= 7
+    very_late = days_from_next >= 30
+    late_phase = _phase_index(days_from_next % cycle_length, np.clip(period_days, 1, cycle_length))
+
+    phase = np.select([recorded, slightly_late, very_late], [recorded_phase, 1, 0], late_phase)
+    rule = np.select([recorded, slightly_late, very_late], [0, 2, 3], 1)
+    return phase, rule
+
+
+def summarize_cycles(summary, session, first_id, last_id, chunk_size):
+    table = CycleData.__table__
+    key = tuple_(table.c.user_id, table.c.period_start)
+    query = select(
+        table.c.user_id,
+        type_coerce(table.c.period_start, String),
+        type_coerce(table.c.period_end, String),
+    ).where(table.c.user_id.between(first_id, last_id)).order_by(table.c.user_id, table.c.period_start)
+
+    previous = None  # (user_id, period_start) of the row before this chunk
+    while True:
+        page = query if previous is None else query.where(key > tuple_(*previous))
+        rows = session.execute(page.limit(chunk_size)).all()
+        if not rows:
+            return summary
+
+        user_ids, starts, ends = zip(*rows)
+        user_ids = np.array(user_ids, dtype=np.int64)
+        starts, ends = _dates(starts), _dates(ends)
+        summary.period_lengths.add((ends - starts).astype(np.int64) + 1)
+
+        # Gaps between consecutive starts of the same user, including across the chunk boundary
+        if previous is not None:
+            user_ids = np.concatenate([[previous[0]], user_ids])
+            starts = np.concatenate([_dates([previous[1]]), starts])
+        same_user = user_ids[1:] == user_ids[:-1]
+        summary.cycle_lengths.add((starts[1:] - starts[:-1]).astype(np.int64)[same_user])
+
+        previous = (rows[-1][0], rows[-1][1])
+
+
+def summarize_phases(summary, session, first_id, last_id, today, chunk_size):
+    table = CycleStats.__table__
+    query = select(
+        table.c.user_id,
+        type_coerce(table.c.last_period_start, String),
+        type_coerce(table.c.last_period_end, String),
+        table.c.length_count, table.c.mean_length, table.c.median_length,
+    ).where(
+        table.c.user_id.between(first_id, last_id), table.c.last_period_start.isnot(None)
+    ).order_by(table.c.user_id).limit(chunk_size)
+
+    after = first_id - 1
+    while True:
+        rows = session.execute(query.where(table.c.user_id > after)).all()
+        if not rows:
+            return summary
+
+        _, starts, ends, counts, means, medians = zip(*rows)
+        cycle_length = expected_cycle_lengths(
+            np.array(counts, dtype=np.float64),
+            np.array(means, dtype=np.float64),
+            np.array(medians, dtype=np.float64),
+        )
+        phase, rule = phases_today(_dates(starts), _dates(ends), cycle_length, today)
+        summary.phases += np.bincount(phase, minlength=len(PHASES))
+        summary.rules += np.bincount(rule, minlength=len(RULES))
+        after = rows[-1][0]
+
+
+def summarize_range(first_id, last_id, today, chunk_size):
+    """``Summary`` of the users with ids in ``[first_id, last_id]``; needs an app context."""
+    summary = Summary()
+    summarize_cycles(summary, db.session, first_id, last_id, chunk_size)
+    summarize_phases(summary, db.session, first_id, last_id, today, chunk_size)
+    db.session.remove()
+    return summary
+
+
+# Process pool workers: each imports the app once and keeps an app context pushed
+def _init_worker():
+    from app import app
+    app.app_context().push()
+
+
+def _summarize_range_task(args):
+    return summarize_range(*args)
+
+
+def summarize(today=None, chunk_size=DEFAULT_CHUNK_SIZE, workers=0):
+    """Population ``Summary``; with ``workers`` the user id range is split across a process pool."""
+    today = today or date.today()
+    first_id, last_id = db.session.query(func.min(CycleData.user_id), func.max(CycleData.user_id)).one()
+    if first_id is None:
+        return Summary()
+    if not workers:
+        return summarize_range(first_id, last_id, today, chunk_size)
+
+    # A few ranges per worker so one dense range does not leave the others idle
+    bounds = np.linspace(first_id, last_id + 1, workers * 4 + 1).astype(np.int64)
+    ranges = [(int(lo), int(hi) - 1, today, chunk_size) for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker) as pool:
+        summary = Summary()
+        for part in pool.map(_summarize_range_task, ranges):
+            summary.merge(part)
+    return summary
+
+
+def print_report(report):
+    print(f"Cycles: {report['cycles']:,}  Users with cycles: {report['users_with_cycles']:,}")
+    for name in ('cycle_length_days', 'period_length_days'):
+        stats = report[name]
+        mean = f"{stats['mean']:.2f}" if stats['mean'] is not None else "-"
+        print(f"{name:20s} n={stats['count']:,}  mean={mean}  p10={stats['p10']}  p50={stats['p50']}  "
+              f"p90={stats['p90']}  overflow={stats['overflow']:,}")
+    print("Phase today:")
+    for phase, share in report['phase_share_today'].items():
+        print(f"  {phase:20s} {share:7.2%}")
+    print("Answered by:")
+    for rule, share in report['prediction_share_today'].items():
+        print(f"  {rule:20s} {share:7.2%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--date', type=date.fromisoformat, help='compute phases as of this date')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--workers', type=int, default=0, help='processes to split the user range over')
+    parser.add_argument('--json', action='store_true', help='print the full report, histograms included, as JSON')
+    args = parser.parse_args()
+
+    from app import app
+
+    with app.app_context():
+        report = summarize(args.date, args.chunk_size, args.workers).report()
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main()
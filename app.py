@@ -1,29 +1,184 @@
-from flask import Flask, request, jsonify
-from flask_bcrypt import Bcrypt
-from flask_jwt_extended import JWTManager, jwt_required, get_jwt_identity, create_access_token
-from datetime import datetime, timedelta
+import os
+from flask import Flask, Response, request, jsonify, stream_with_context, url_for
+from flask_jwt_extended import JWTManager, create_access_token, get_jwt, jwt_required
+from datetime import date, datetime
+import numpy as np
 from sqlalchemy.exc import IntegrityError
-from models import db, User, CycleData
+from models import db, User, CycleData, CycleStats, load_phase_timeline, rebuild_cycle_stats, record_cycle
+from hashing import HashingService, HashingUnavailable
+from admission import AdmissionControl, AdmissionRejected
+from refresh_tokens import RefreshTokenInvalid, issue_refresh_token, revoke_refresh_token, rotate_refresh_token
+from cycle_import import ImportFormatError, import_cycles
+from cycle_export import CONTENT_TYPES, EXPORTERS, iter_cycles
+from storage import Storage, configure_storage
+from batch import BatchError, run_batch
+from principal_cache import Principal, PrincipalCache, current_principal, principal_required
+from phase_engine import (PHASES, RECORDED, LATE, SLIGHTLY_LATE, VERY_LATE, parse_date, phase_on, phase_indices,
+                          predicted_phase_on, selected_date_phase, timeline_lookup)
+from payloads import build_payloads, payload_response
+from metrics import Metrics, timed_segment
+from calendar_feed import FEED_CYCLES, MAX_FEED_CYCLES, FeedCache, calendar_user, issue_calendar_token
+from recommendations import CATALOGUE_VERSION, compact_document, phase_document, recommendations
+from migrations import migrate
 
 # Initialize Flask App
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///app.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['JWT_SECRET_KEY'] = 'your_jwt_secret'
+app.config['CYCLE_IMPORT_BATCH_SIZE'] = 1000
+app.config['MIGRATION_BATCH_SIZE'] = 1000
+app.config['MIGRATION_BATCH_PAUSE'] = 0.0
+# Large databases can be migrated ahead of a deploy with `python migrations.py` instead
+app.config['MIGRATE_ON_STARTUP'] = os.environ.get('PHASE_MIGRATE_ON_STARTUP', '1') != '0'
+
+# Password hashing pool and cost settings; unset values fall back to HashingService defaults
+for key, cast in (('BCRYPT_POOL_SIZE', int), ('BCRYPT_QUEUE_DEPTH', int), ('BCRYPT_TIMEOUT', float),
+                  ('BCRYPT_LOG_ROUNDS', int), ('BCRYPT_TARGET_SECONDS', float)):
+    if key in os.environ:
+        app.config[key] = cast(os.environ[key])
+
+# Database URI, SQLite pragmas and connection pools (see storage.py)
+configure_storage(app)
 
 # Initialize Extensions
 db.init_app(app)
-bcrypt = Bcrypt(app)
+storage = Storage(app, db)
+hasher = HashingService(app)
+admission = AdmissionControl(app)
 jwt = JWTManager(app)
+principal_cache = PrincipalCache(app)
+metrics = Metrics(app)
+feed_cache = FeedCache(app)
+
+
+# Load the cached identity/profile for an authenticated user
+@principal_cache.user_loader
+def load_user_principal(user_id):
+    # One read transaction, so the stats and the timeline come from the same side of any concurrent write
+    with storage.snapshot() as reads:
+        user = reads.query(User).get(user_id)
+        if user is None:
+            return None
+        stats = reads.query(CycleStats).get(user_id)
+        timeline = load_phase_timeline(reads, user_id)
+
+    if stats is None:
+        stats = cycle_stats(user_id)
+        if stats is not None:
+            timeline = load_phase_timeline(db.session, user_id)
+    return Principal(
+        user.id, user.email, user.name, user.age, user.height, user.weight,
+        period_start=stats.last_period_start if stats else None,
+        period_end=stats.last_period_end if stats else None,
+        average_cycle_length=stats.expected_cycle_length if stats else CycleStats.DEFAULT_CYCLE_LENGTH,
+        timeline=timeline
+    )
+
+
+# Password hashing pool counters on /metrics
+@metrics.add_collector
+def hashing_metrics():
+    snapshot = hasher.metrics()
+    return {
+        "bcrypt_operations_total": ("Password hash and check calls completed.", snapshot["completed"]),
+        "bcrypt_rejected_total": ("Password calls rejected because the queue was full.", snapshot["rejected"]),
+        "bcrypt_timeouts_total": ("Password calls that timed out waiting for a worker.", snapshot["timeouts"]),
+        "bcrypt_failures_total": ("Password calls that raised or lost their worker.", snapshot["failures"]),
+        "bcrypt_queue_wait_seconds_total": ("Time password calls waited for a worker.",
+                                            snapshot["queue_wait_seconds_total"]),
+        "bcrypt_hash_seconds_total": ("Time workers spent hashing.", snapshot["hash_seconds_total"]),
+        "bcrypt_in_flight": ("Password calls queued or running.", snapshot["in_flight"]),
+        "bcrypt_stale_hashes_total": ("Logins whose stored hash had an outdated cost.", snapshot["stale_hashes"]),
+    }
+
+
+# Admission control counters on /metrics
+@metrics.add_collector
+def admission_metrics():
+    counters = {}
+    for route_class, snapshot in admission.metrics().items():
+        counters.update({
+            f"admission_{route_class}_admitted_total": (f"{route_class} requests admitted.", snapshot["admitted"]),
+            f"admission_{route_class}_shed_rate_total": (f"{route_class} requests shed by a per-IP or per-user limit.",
+                                                         snapshot["shed_rate"]),
+            f"admission_{route_class}_shed_queue_total": (f"{route_class} requests shed because the expected wait "
+                                                          "exceeded the latency budget.", snapshot["shed_queue"]),
+            f"admission_{route_class}_shed_timeout_total": (f"{route_class} requests shed after waiting out the "
+                                                            "latency budget.", snapshot["shed_timeout"]),
+            f"admission_{route_class}_queue_wait_seconds_total": (f"Time admitted {route_class} requests waited "
+                                                                  "for a slot.", snapshot["queue_wait_seconds_total"]),
+            f"admission_{route_class}_store_errors_total": (f"{route_class} requests admitted because the shared "
+                                                            "admission store failed.", snapshot["store_errors"]),
+        })
+    return counters
+
+
+# Pre-serialized Recommendation Payloads (full, and compact ones naming only the phase and catalogue version)
+catalogue_payload = build_payloads({
+    "catalogue": {"recommendations": recommendations, "version": CATALOGUE_VERSION}
+})["catalogue"]
+phase_payloads = build_payloads({phase: phase_document(phase) for phase in recommendations})
+record_payloads = build_payloads({
+    phase: dict(phase_document(phase), message="User data and cycle records updated successfully.")
+    for phase in recommendations
+})
+select_date_payloads = build_payloads({phase: {"phase": phase_document(phase)} for phase in recommendations})
+compact_phase_payloads = build_payloads({phase: compact_document(phase) for phase in recommendations})
+compact_record_payloads = build_payloads({
+    phase: dict(compact_document(phase), message="User data and cycle records updated successfully.")
+    for phase in recommendations
+})
+compact_select_date_payloads = build_payloads({phase: {"phase": compact_document(phase)} for phase in recommendations})
+
+
+# Password hashing pool is saturated or too slow: ask the client to retry
+@app.errorhandler(HashingUnavailable)
+def hashing_unavailable(e):
+    response = jsonify({"error": str(e)})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+
+# Admission control shed the request: too many from this client, or the route class is saturated
+@app.errorhandler(AdmissionRejected)
+def admission_rejected(e):
+    response = jsonify({"error": str(e)})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 429
+
+
+# Helper Function: Admission Keys (per-user buckets; see admission.py)
+def credential_email():
+    data = request.get_json(silent=True)
+    email = data.get('email') if isinstance(data, dict) else None
+    return email.strip().lower() if isinstance(email, str) else None
+
+def principal_user_id():
+    return current_principal().user_id
+
+
+# Helper Function: Rehash a Password at the Current bcrypt Cost (best effort; the login succeeds either way)
+def rehash_password(user, password):
+    try:
+        with timed_segment('bcrypt'):
+            new_hash = hasher.generate_password_hash(password)
+    except HashingUnavailable:
+        return
+    # Only replaces the hash that was just checked, so a concurrent password change wins
+    User.query.filter_by(id=user.id, password=user.password).update(
+        {'password': new_hash}, synchronize_session=False
+    )
 
 
 # Routes
 
 # User Signup
 @app.route('/signup', methods=['POST'])
+@admission.limit('auth', user=credential_email)
 def signup():
     data = request.json
-    hashed_password = bcrypt.generate_password_hash(data['password']).decode('utf-8')
+    with timed_segment('bcrypt'):
+        hashed_password = hasher.generate_password_hash(data['password'])
 
     user = User(
         email=data['email'],
@@ -47,40 +202,65 @@ def signup():
 
 # User Login
 @app.route('/login', methods=['POST'])
+@admission.limit('auth', user=credential_email)
 def login():
     data = request.json
     user = User.query.filter_by(email=data['email']).first()
 
-    if user and bcrypt.check_password_hash(user.password, data['password']):
+    with timed_segment('bcrypt'):
+        authenticated = user is not None and hasher.check_password_hash(user.password, data['password'])
+
+    if authenticated:
+        if hasher.needs_rehash(user.password):
+            rehash_password(user, data['password'])
         access_token = create_access_token(identity=user.id)
-        return jsonify({"access_token": access_token}), 200
+        refresh_token = issue_refresh_token(user.id)
+        db.session.commit()
+        return jsonify({"access_token": access_token, "refresh_token": refresh_token}), 200
     else:
         return jsonify({"error": "Invalid credentials"}), 401
 
 
-# Add or Update Cycle Data
+# Route: Exchange a Refresh Token for New Tokens (signature check and one row update; no password hashing)
+@app.route('/token/refresh', methods=['POST'])
+@jwt_required(refresh=True)
+def refresh_access_token():
+    try:
+        user_id, refresh_token = rotate_refresh_token(get_jwt())
+    except RefreshTokenInvalid as e:
+        # Keep the family revocation a replayed token triggers
+        db.session.commit()
+        return jsonify({"error": str(e)}), 401
+
+    access_token = create_access_token(identity=user_id)
+    db.session.commit()
+    return jsonify({"access_token": access_token, "refresh_token": refresh_token}), 200
+
+
+# Route: Log Out (revokes the refresh token and every token refreshed from the same login)
+@app.route('/logout', methods=['POST'])
+@jwt_required(refresh=True)
+def logout():
+    revoke_refresh_token(get_jwt())
+    db.session.commit()
+    return jsonify({"message": "Logged out"}), 200
+
+
+# Add Cycle Data
 @app.route('/cycle-data', methods=['POST'])
-@jwt_required()
+@principal_required
 def add_cycle_data():
-    user_id = get_jwt_identity()
+    user_id = current_principal().user_id
     data = request.json
 
     try:
-        period_start = datetime.strptime(data['period_start'], '%Y-%m-%d').date()
-        period_end = datetime.strptime(data['period_end'], '%Y-%m-%d').date()
-
-        cycle_data = CycleData.query.filter_by(user_id=user_id).first()
-
-        if cycle_data:
-            # Update existing cycle data
-            cycle_data.period_start = period_start
-            cycle_data.period_end = period_end
-        else:
-            # Create new cycle data
-            cycle_data = CycleData(user_id=user_id, period_start=period_start, period_end=period_end)
-            db.session.add(cycle_data)
+        period_start = date.fromisoformat(data['period_start'])
+        period_end = date.fromisoformat(data['period_end'])
 
+        # Append to the user's cycle history
+        record_cycle(user_id, period_start, period_end)
         db.session.commit()
+        principal_cache.invalidate(user_id)
         return jsonify({"message": "Cycle data saved successfully"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -88,57 +268,106 @@ def add_cycle_data():
 
 # Get Cycle Data
 @app.route('/cycle-data', methods=['GET'])
-@jwt_required()
+@principal_required
 def get_cycle_data():
-    user_id = get_jwt_identity()
-    cycle_data = CycleData.query.filter_by(user_id=user_id).first()
+    principal = current_principal()
 
-    if cycle_data:
+    if principal.has_cycle:
         return jsonify({
-            "period_start": cycle_data.period_start.strftime('%Y-%m-%d'),
-            "period_end": cycle_data.period_end.strftime('%Y-%m-%d')
+            "period_start": principal.period_start.strftime('%Y-%m-%d'),
+            "period_end": principal.period_end.strftime('%Y-%m-%d')
         }), 200
     else:
         return jsonify({"message": "No cycle data found"}), 404
+
+
+# Bulk Import Cycle History (streamed NDJSON or CSV body)
+@app.route('/cycle-data/import', methods=['POST'])
+@principal_required
+@admission.limit('bulk', user=principal_user_id)
+def import_cycle_data():
+    user_id = current_principal().user_id
+
+    try:
+        report = import_cycles(user_id, request.stream, request.content_type,
+                               batch_size=app.config['CYCLE_IMPORT_BATCH_SIZE'])
+    except ImportFormatError as e:
+        return jsonify({"error": str(e)}), 415
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+    finally:
+        principal_cache.invalidate(user_id)
+
+    return jsonify(report), 200
+
+
+# Export Cycle History with Per-Day Phases (streamed NDJSON or CSV)
+@app.route('/cycle-data/export', methods=['GET'])
+@principal_required
+@admission.limit('bulk', user=principal_user_id)
+def export_cycle_data():
+    principal = current_principal()
+    export_format = request.args.get('format', 'ndjson').lower()
+
+    if export_format not in EXPORTERS:
+        return jsonify({"error": f"Unsupported format '{export_format}'; use one of {', '.join(EXPORTERS)}"}), 400
+
+    cycles = iter_cycles(storage.read_session(), principal.user_id, principal.average_cycle_length)
+    response = Response(stream_with_context(EXPORTERS[export_format](cycles)), mimetype=CONTENT_TYPES[export_format])
+    response.headers['Content-Disposition'] = f'attachment; filename="phase-export.{export_format}"'
+    return response
     
     
 # Route: Get Menstrual Phase
 @app.route('/menstrual-phase', methods=['POST'])
-@jwt_required()
+@principal_required
 def get_menstrual_phase():
-    user_id = get_jwt_identity()
-    data = request.json
+    principal = current_principal()
+    data = request.json or {}
 
-    # Inputs from request
-    period_start = data['period_start']
-    period_end = data['period_end']
+    # Inputs from request, defaulting to the user's latest recorded cycle
+    period_start = data.get('period_start') or principal.period_start
+    period_end = data.get('period_end') or principal.period_end
     today_date = data.get('today_date', datetime.now().strftime('%Y-%m-%d'))
 
+    if period_start is None or period_end is None:
+        with timed_segment('phase'):
+            response = predict_phase(principal, today_date)
+        return jsonify(response), 200
+
+    payloads = compact_phase_payloads if compact_requested() else phase_payloads
+
+    # The latest cycle's answers are materialized on write: look today up instead of computing it
+    if parse_date(period_start) == principal.period_start and parse_date(period_end) == principal.period_end:
+        with timed_segment('phase'):
+            interval = timeline_lookup(principal.timeline, parse_date(today_date))
+        if interval is not None:
+            _, _, phase, rule = interval
+            if rule == RECORDED:
+                return payload_response(payloads[phase])
+            return jsonify(prediction_response(phase, rule)), 200
+
     # Try to determine the phase
-    phase = determine_phase(period_start, period_end, today_date)
+    with timed_segment('phase'):
+        phase = determine_phase(period_start, period_end, today_date)
 
     if phase in recommendations:
-        # If phase is determined, provide recommendations
-        phase_data = recommendations[phase]
-        response = {
-            "phase": phase,
-            "food_recommendations": phase_data.get("Food", {}),
-            "exercise_recommendations": phase_data.get("Exercise", {}),
-            "lifestyle_tip": phase_data.get("Lifestyle Tip", {})
-        }
-    else:
-        # If determination fails, predict the phase
-        response = predict_phase(user_id, today_date)
+        # If phase is determined, serve the pre-serialized recommendations
+        return payload_response(payloads[phase])
 
+    # If determination fails, predict the phase
+    with timed_segment('phase'):
+        response = predict_phase(principal, today_date)
     return jsonify(response), 200
 
     
 
 # Route: Record Data and Get Phase
 @app.route('/record', methods=['POST'])
-@jwt_required()
+@principal_required
 def record_user_data():
-    user_id = get_jwt_identity()
+    user_id = current_principal().user_id
     data = request.json
 
     try:
@@ -151,34 +380,23 @@ def record_user_data():
         user.height = data.get('height', user.height)
         user.weight = data.get('weight', user.weight)
 
-        # Update or Create Cycle Data
-        period_start = datetime.strptime(data['period_start'], '%Y-%m-%d').date()
-        period_end = datetime.strptime(data['period_end'], '%Y-%m-%d').date()
-
-        cycle_data = CycleData.query.filter_by(user_id=user_id).first()
-        if cycle_data:
-            cycle_data.period_start = period_start
-            cycle_data.period_end = period_end
-        else:
-            cycle_data = CycleData(user_id=user_id, period_start=period_start, period_end=period_end)
-            db.session.add(cycle_data)
+        # Append Cycle Data
+        period_start = date.fromisoformat(data['period_start'])
+        period_end = date.fromisoformat(data['period_end'])
+        record_cycle(user_id, period_start, period_end)
 
         db.session.commit()
+        principal_cache.invalidate(user_id)
 
         # Determine Menstrual Phase
-        today_date = datetime.now().strftime('%Y-%m-%d')
-        phase = determine_phase(period_start.strftime('%Y-%m-%d'), period_end.strftime('%Y-%m-%d'), today_date)
+        with timed_segment('phase'):
+            phase = determine_phase(period_start, period_end, date.today())
 
         # Validate phase in recommendations
         if phase in recommendations:
-            phase_data = recommendations[phase]
-            response = {
-                "message": "User data and cycle records updated successfully.",
-                "phase": phase,
-                "food_recommendations": phase_data.get("Food", {}),
-                "exercise_recommendations": phase_data.get("Exercise", {}),
-                "lifestyle_tip": phase_data.get("Lifestyle Tip", {})
-            }
+            # The write has happened, so always send the body rather than a 304
+            payloads = compact_record_payloads if compact_requested() else record_payloads
+            return payload_response(payloads[phase], conditional=False)
         else:
             response = {
                 "message": "User data updated successfully, but phase could not be determined.",
@@ -195,64 +413,25 @@ def record_user_data():
     
 # Route: Predict Phase for Selected Date
 @app.route('/select-date', methods=['POST'])
-@jwt_required()
+@principal_required
 def select_date_phase():
-    user_id = get_jwt_identity()
     data = request.json
 
     # Inputs from request
-    period_start = datetime.strptime(data['period_start'], "%Y-%m-%d").date()
-    period_end = datetime.strptime(data['period_end'], "%Y-%m-%d").date()
-    selected_date = datetime.strptime(data['selected_date'], "%Y-%m-%d").date()
-    today_date = datetime.now().date()
-
-    # Determine the phase for today's date
-    today_phase = determine_phase(period_start.strftime("%Y-%m-%d"),
-                                  period_end.strftime("%Y-%m-%d"),
-                                  today_date.strftime("%Y-%m-%d"))
-
-    # If today's phase is determinable, proceed to calculate the selected date's phase
-    if today_phase in recommendations:
-        # Predict phase for the selected date
-        cycle_length = 28  # Default cycle length
-        menstrual_length = (period_end - period_start).days + 1
-        follicular_length = 6
-        ovulation_length = 5
-        luteal_length = cycle_length - (menstrual_length + follicular_length + ovulation_length)
-
-        days_since_start = (selected_date - period_start).days
-
-        # Adjust to fit into a valid cycle
-        if days_since_start < 0:
-            full_cycles_back = (-days_since_start) // cycle_length + 1
-            adjusted_start = period_start - timedelta(days=full_cycles_back * cycle_length)
-            days_since_start = (selected_date - adjusted_start).days
-        elif days_since_start >= cycle_length:
-            full_cycles_forward = days_since_start // cycle_length
-            adjusted_start = period_start + timedelta(days=full_cycles_forward * cycle_length)
-            days_since_start = (selected_date - adjusted_start).days
-
-        # Determine the phase within the cycle
-        if 0 <= days_since_start < menstrual_length:
-            predicted_phase = "Menstrual Phase"
-        elif menstrual_length <= days_since_start < menstrual_length + follicular_length:
-            predicted_phase = "Follicular Phase"
-        elif menstrual_length + follicular_length <= days_since_start < menstrual_length + follicular_length + ovulation_length:
-            predicted_phase = "Ovulation Phase"
-        else:
-            predicted_phase = "Luteal Phase"
+    period_start = date.fromisoformat(data['period_start'])
+    period_end = date.fromisoformat(data['period_end'])
+    selected_date = date.fromisoformat(data['selected_date'])
+    today_date = date.today()
+
+    # Predict the selected date's phase, provided today's phase is determinable
+    with timed_segment('phase'):
+        predicted_phase = selected_date_phase(period_start, period_end, selected_date, today_date)
 
+    if predicted_phase is not None:
         # Fetch recommendations for the predicted phase
         if predicted_phase in recommendations:
-            phase_data = recommendations[predicted_phase]
-            response = {
-                "phase": {
-                    "phase": predicted_phase,
-                    "food_recommendations": phase_data.get("Food", {}),
-                    "exercise_recommendations": phase_data.get("Exercise", {}),
-                    "lifestyle_tip": phase_data.get("Lifestyle Tip", {})
-                }
-            }
+            payloads = compact_select_date_payloads if compact_requested() else select_date_payloads
+            return payload_response(payloads[predicted_phase])
         else:
             response = {
                 "phase": {
@@ -270,267 +449,168 @@ def select_date_phase():
     return jsonify(response), 200
     
 
-# Helper Function: Determine Phase
-def determine_phase(period_start, period_end, today_date):
-    period_start_date = datetime.strptime(period_start, "%Y-%m-%d")
-    period_end_date = datetime.strptime(period_end, "%Y-%m-%d")
-    today_date_obj = datetime.strptime(today_date, "%Y-%m-%d")
-
-    follicular_start = period_end_date + timedelta(days=1)
-    follicular_end = follicular_start + timedelta(days=6)
-
-    ovulation_start = follicular_end + timedelta(days=1)
-    ovulation_end = ovulation_start + timedelta(days=5)
-
-    luteal_start = ovulation_end + timedelta(days=1)
-    next_period_start = luteal_start + timedelta(days=13)
-
-    if period_start_date <= today_date_obj <= period_end_date:
-        phase = "Menstrual Phase"
-    elif follicular_start <= today_date_obj <= follicular_end:
-        phase = "Follicular Phase"
-    elif ovulation_start <= today_date_obj <= ovulation_end:
-        phase = "Ovulation Phase"
-    elif luteal_start <= today_date_obj < next_period_start:
-        phase = "Luteal Phase"
+# Route: Full Recommendation Catalogue, versioned by content hash
+@app.route('/catalogue', methods=['GET'])
+def get_catalogue():
+    response = payload_response(catalogue_payload)
+    response.cache_control.public = True
+    if request.args.get('version') == CATALOGUE_VERSION:
+        # A versioned URL names exact content, so clients may keep it indefinitely
+        response.cache_control.max_age = 365 * 24 * 3600
+        response.cache_control.immutable = True
     else:
-        phase = "Unknown Phase (possibly irregular cycle)"
+        response.cache_control.no_cache = True
+    return response
+
+
+# Route: Phase Calendar for a Date Range
+MAX_CALENDAR_DAYS = 366
+
+
+@app.route('/phase-calendar', methods=['POST'])
+@principal_required
+def phase_calendar():
+    data = request.json
+
+    try:
+        period_start = datetime.strptime(data['period_start'], "%Y-%m-%d").date()
+        period_end = datetime.strptime(data['period_end'], "%Y-%m-%d").date()
+        start_date = datetime.strptime(data['start_date'], "%Y-%m-%d").date()
+        end_date = datetime.strptime(data['end_date'], "%Y-%m-%d").date()
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid or missing date: {e}"}), 400
+
+    if end_date < start_date:
+        return jsonify({"error": "end_date must not be before start_date"}), 400
+    if (end_date - start_date).days + 1 > MAX_CALENDAR_DAYS:
+        return jsonify({"error": f"Date range is limited to {MAX_CALENDAR_DAYS} days"}), 400
+
+    with timed_segment('phase'):
+        days = np.arange(np.datetime64(start_date), np.datetime64(end_date) + 1, dtype='datetime64[D]')
+        phases = phase_indices(days, period_start, period_end)
+
+    calendar = [
+        {
+            "date": str(day),
+            "phase": PHASES[index],
+            "recommendation_key": PHASES[index] if PHASES[index] in recommendations else None
+        }
+        for day, index in zip(days, phases.tolist())
+    ]
+    return jsonify({"days": calendar}), 200
+
+
+# Route: Issue a Calendar Feed Token (replaces, and so revokes, any earlier feed URL)
+@app.route('/calendar/token', methods=['POST'])
+@principal_required
+def calendar_token():
+    token = issue_calendar_token(current_principal().user_id)
+    db.session.commit()
+    return jsonify({"token": token, "url": url_for('calendar_feed', token=token, _external=True)}), 201
+
+
+# Route: iCalendar Feed of Predicted Phases (authenticated by the feed token, for calendar apps)
+@app.route('/calendar.ics', methods=['GET'])
+def calendar_feed():
+    user_id = calendar_user(storage.read_session(), request.args.get('token'))
+    if user_id is None:
+        return jsonify({"error": "Invalid calendar token"}), 401
+
+    principal = principal_cache.principal(user_id)
+    if principal is None or not principal.has_cycle:
+        return jsonify({"message": "No cycle data found"}), 404
+
+    cycles = min(max(request.args.get('cycles', FEED_CYCLES, type=int), 1), MAX_FEED_CYCLES)
+    # No 'phase' segment: the feed is generated while the body streams, after the request's metrics are recorded
+    return feed_cache.response(principal, date.today(), cycles)
+
+
+# Route: Run Several Sub-requests with One Token Verification and DB Session
+@app.route('/batch', methods=['POST'])
+@principal_required
+@admission.limit('batch', user=principal_user_id)
+def batch():
+    data = request.json
+    items = data.get('requests') if isinstance(data, dict) else data
+
+    try:
+        responses = run_batch(items)
+    except BatchError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({"responses": responses}), 200
 
-    print(f"[DEBUG] Phase determined: {phase}")  # Debugging output
-    return phase
 
-def predict_phase(user_id, today_date):
-    # Fetch user cycle data
-    cycles = CycleData.query.filter_by(user_id=user_id).order_by(CycleData.period_start).all()
-    if not cycles:
+# Helper Function: Compact Phase Responses (?view=compact; the client renders from its cached catalogue)
+def compact_requested():
+    return request.args.get('view') == 'compact'
+
+
+# Helper Function: Determine Phase
+def determine_phase(period_start, period_end, today_date):
+    # Only the cycle starting at period_start is considered; later dates are left to predict_phase
+    return phase_on(period_start, period_end, today_date, wrap=False)
+
+def predict_phase(principal, today_date):
+    # Latest cycle and average length come from the cached principal
+    if not principal.has_cycle:
         return {
             "phase": "Unknown",
             "message": "We don't have enough data to make a prediction. Please update your cycle data."
         }
 
-    last_cycle = cycles[-1]
-    last_period_end = last_cycle.period_end
-    average_cycle_length = calculate_average_cycle_length(user_id)
-
-    # Predict the next cycle
-    next_period_start = last_period_end + timedelta(days=average_cycle_length)
-    next_period_end = next_period_start + timedelta(days=(last_cycle.period_end - last_cycle.period_start).days)
-
-    # Prediction logic
-    today_date_obj = datetime.strptime(today_date, "%Y-%m-%d")
-    next_period_start_datetime = datetime.combine(next_period_start, datetime.min.time())
-
-    if next_period_start_datetime - timedelta(days=7) <= today_date_obj <= next_period_start_datetime + timedelta(days=7):
-        predicted_phase = "Follicular Phase"
-        message = (
-            f"In our prediction, you should be in the {predicted_phase}. "
-            "Your cycle is slightly late but not unusual. Please update your data to help improve our predictions."
-        )
-    elif today_date_obj >= next_period_start_datetime + timedelta(days=30):
-        predicted_phase = "Menstrual Phase"
-        message = (
-            f"In our prediction, you should be in the {predicted_phase}. "
-            "Your cycle is significantly late, which may indicate a menstrual disorder. "
-            "We recommend consulting a doctor. Here’s some advice to help regulate your body."
-        )
-    else:
-        # Dynamically map today_date_obj into predicted phases
-        days_from_start = (today_date_obj - next_period_start_datetime).days
-        if 0 <= days_from_start <= 6:
-            predicted_phase = "Follicular Phase"
-        elif 7 <= days_from_start <= 12:
-            predicted_phase = "Ovulation Phase"
-        elif 13 <= days_from_start <= 27:
-            predicted_phase = "Luteal Phase"
-        else:
-            predicted_phase = "Menstrual Phase"
-        
-        message = (
-            f"In our prediction, you should be in the {predicted_phase}. "
-            "Your cycle is late, but it's important to care for your health. "
-            "Regulate your diet and mood."
-        )
+    predicted_phase, rule = predicted_phase_on(
+        principal.period_start, principal.period_end, principal.average_cycle_length, today_date
+    )
+    return prediction_response(predicted_phase, rule)
+
+# Prediction messages, by the prediction rule that applied
+PREDICTION_MESSAGES = {
+    SLIGHTLY_LATE: (
+        "In our prediction, you should be in the {phase}. "
+        "Your cycle is slightly late but not unusual. Please update your data to help improve our predictions."
+    ),
+    VERY_LATE: (
+        "In our prediction, you should be in the {phase}. "
+        "Your cycle is significantly late, which may indicate a menstrual disorder. "
+        "We recommend consulting a doctor. Here’s some advice to help regulate your body."
+    ),
+    LATE: (
+        "In our prediction, you should be in the {phase}. "
+        "Your cycle is late, but it's important to care for your health. "
+        "Regulate your diet and mood."
+    ),
+}
 
+def prediction_response(predicted_phase, rule):
     return {
         "phase": "Prediction",
         "predicted_phase": predicted_phase,
-        "message": message
+        "message": PREDICTION_MESSAGES[rule].format(phase=predicted_phase)
     }
 
 def calculate_average_cycle_length(user_id):
-    cycles = CycleData.query.filter_by(user_id=user_id).order_by(CycleData.period_start).all()
-    if len(cycles) < 2:
-        return 28  # Default to 28 days if insufficient data
-    lengths = [
-        (cycles[i + 1].period_start - cycles[i].period_start).days
-        for i in range(len(cycles) - 1)
-    ]
-    return sum(lengths) // len(lengths)
-
-
-
-# Recommendations
-recommendations = {
-    "Menstrual Phase": {
-        "Food": {
-            "Iron-rich Foods": {
-                "description": "To replenish iron lost during menstruation and prevent anemia.",
-                "items": ["Leafy greens like spinach and kale", "Lean meats such as beef or turkey", "Legumes like lentils and chickpeas"]
-            },
-            "B Vitamin-rich Foods": {
-                "description": "To support energy levels and mood.",
-                "items": ["Whole grains like quinoa or whole wheat bread", "Eggs", "Dairy products like milk and cheese"]
-            },
-            "Omega-3 Fatty Acids": {
-                "description": "To help with menstrual cramping and inflammation.",
-                "items": ["Fatty fish like salmon or mackerel", "Nuts, especially walnuts", "Seeds like chia seeds and flaxseeds"]
-            },
-            "Magnesium-rich Foods": {
-                "description": "To help with menstrual cramping and sleep.",
-                "items": ["Dark chocolate", "Avocado", "Bananas"]
-            },
-            "Fiber-rich Foods": {
-                "description": "To support digestive health.",
-                "items": ["Whole grains", "Vegetables like broccoli and carrots", "Fruits like berries and apples"]
-            }
-        },
-        "Exercise": {
-            "description": "You have less energy, so this is the time for low-intensity activities, such as walking, stretching, or Pilates. You may not feel like exercising at all, and that’s OK.",
-            "activities": ["Walking", "Stretching", "Pilates"]
-        }
-    },
-    "Luteal Phase": {
-        "Food": {
-            "Healthy Fats & Vitamin B6": {
-                "description": "These nutrients help support overall hormonal balance and healthy skin.",
-                "food_sources": ["Avocado", "Wild salmon", "Walnuts"]
-            },
-            "Serotonin-Boosting Foods": {
-                "description": "These foods help to improve mood by increasing serotonin levels in the body.",
-                "food_sources": ["Quinoa", "Buckwheat"]
-            },
-            "Support for Progesterone Levels": {
-                "description": "These foods help promote healthy progesterone levels, which support the luteal phase.",
-                "food_sources": ["Sesame seeds", "Sunflower seeds"]
-            },
-            "Magnesium-Rich Foods": {
-                "description": "Magnesium helps to regulate mood and prevent cramping.",
-                "food_sources": ["Spinach", "Bananas", "Dark chocolate"]
-            },
-            "General Mood and Skin Health": {
-                "description": "These foods help with overall mood and skin health during this phase.",
-                "food_sources": ["Red meat", "Carrots", "Sweet potato", "Lentils", "Oats"]
-            }
-        },
-        "Exercise": {
-            "description": "Take advantage of your peak energy levels with high-intensity workouts",
-            "activities": ["Kickboxing", "Cycling", "Sprints"]
-        },
-        "Lifestyle Tip": {
-            "description": "Remember to reduce intake of caffeine, alcohol, added salt, and carbonated drinks to minimize stress on the liver during this phase."
-        }
-    },
-    "Follicular Phase": {
-        "Food": {
-            "Hormonal Balance": {
-                "description": "Supports overall hormonal balance and prepares the body for ovulation.",
-                "food_sources": [
-                    "Fresh vegetables (artichokes, broccoli, carrots, parsley, green peas, string beans, zucchini)",
-                    "Fresh fruits (berries, citrus fruits, apples)",
-                    "Lean proteins (poultry, fish, legumes, tofu)",
-                    "Healthy fats (avocados, nuts, seeds, olive oil)"
-                ]
-            },
-            "Energy Levels": {
-                "description": "Boosts energy and supports daily activities.",
-                "food_sources": [
-                    "Whole grains (quinoa, brown rice, whole wheat)",
-                    "Lean proteins (poultry, fish, legumes, tofu)"
-                ]
-            },
-            "Digestive Health": {
-                "description": "Supports a healthy gut and digestion.",
-                "food_sources": [
-                    "Fermented foods (kimchi, sauerkraut, kefir)",
-                    "Fiber-rich foods (squash, green peas, sweet potatoes)",
-                    "Sprouted grains and seeds"
-                ]
-            },
-            "Iron": {
-                "description": "Replenishes iron levels after menstruation.",
-                "food_sources": [
-                    "Lean meats",
-                    "Plant-based sources (legumes, tofu)",
-                    "Dark leafy greens",
-                    "Fortified cereals"
-                ]
-            },
-            "Zinc": {
-                "description": "Supports immune function and cellular repair.",
-                "food_sources": [
-                    "Shellfish (oysters, crab)",
-                    "Legumes (chickpeas, lentils)",
-                    "Seeds (pumpkin, sesame)",
-                    "Whole grains (quinoa, oats)"
-                ]
-            },
-            "Vitamin D": {
-                "description": "Promotes calcium absorption and supports bone health.",
-                "food_sources": [
-                    "Fatty fish (salmon, mackerel)",
-                    "Fortified foods (milk, orange juice)",
-                    "Egg yolks"
-                ]
-            }
-        },
-        "Exercise": {
-            "description": "As your energy levels increase, start adding in cardio-based workouts.",
-            "activities": ["Running", "Swimming", "Biking"]
-        }
-    },
-    "Ovulation Phase": {
-        "Food": {
-            "Healthy Fats": {
-                "description": "Supports hormone production and overall health.",
-                "food_sources": ["Organic salmon", "Sardines", "Organic eggs", "Almonds"]
-            },
-            "Vitamin B6": {
-                "description": "Essential for hormonal balance and neurotransmitter function.",
-                "food_sources": ["Sunflower seeds", "Sesame seeds", "Organic red meat"]
-            },
-            "Folate": {
-                "description": "Supports cellular repair and DNA synthesis.",
-                "food_sources": [
-                    "Leafy green vegetables (spinach, kale)",
-                    "Peas",
-                    "Kidney beans",
-                    "High-quality folate supplement"
-                ]
-            },
-            "Choline": {
-                "description": "Supports brain function and liver health.",
-                "food_sources": ["Organic eggs", "Seafood (oysters)"]
-            },
-            "Liver-Supporting Foods": {
-                "description": "Supports detoxification and hormone metabolism.",
-                "food_sources": ["Pumpkin", "Ginger"]
-            },
-            "Anti-Inflammatory Foods": {
-                "description": "Reduces inflammation and supports overall health.",
-                "food_sources": ["Berries", "Dark chocolate", "Garlic", "Vegetables", "Fatty fish"]
-            }
-        },
-        "Exercise": {
-            "description": "Take advantage of your peak energy levels with high-intensity workouts.",
-            "activities": ["Kickboxing", "Cycling HIIT", "Sprints"]
-        }
-    }
-}
-    
+    stats = cycle_stats(user_id)
+    if stats is None:
+        return CycleStats.DEFAULT_CYCLE_LENGTH  # Default to 28 days if there is no data
+    return stats.average_cycle_length
+
+
+def cycle_stats(user_id):
+    # Single primary-key read; histories recorded before CycleStats existed are summarized once
+    stats = CycleStats.query.get(user_id)
+    if stats is None and CycleData.query.filter_by(user_id=user_id).first() is not None:
+        stats = rebuild_cycle_stats(user_id)
+        db.session.commit()
+    return stats
+
+
 
 # Initialize Database
-with app.app_context():
-    db.create_all()
+if app.config['MIGRATE_ON_STARTUP']:
+    with app.app_context():
+        # Bring new and pre-existing databases up to the current schema (see migrations.py)
+        migrate()
 
 if __name__ == '__main__':
     app.run(host='129.133.72.121', port=8080, debug=True)
@@ -0,0 +1,67 @@
+"""Dispatch of /batch sub-requests inside the outer request's app context.
+
+Each sub-request gets its own request context, but the app context - and
+with it ``g`` (holding the already verified principal) and the scoped DB
+session - is shared with the outer request, so the token is verified once
+and every sub-request reuses the same session. Sub-requests carry the
+outer request's client address, so per-IP admission buckets still apply,
+and credential routes are refused: a batch must not multiply password
+guesses or signups behind one admitted request.
+"""
+import json
+
+from flask import current_app, jsonify, request
+
+from models import db
+
+MAX_BATCH_REQUESTS = 20
+ALLOWED_METHODS = ('GET', 'POST')
+CREDENTIAL_ROUTES = ('/login', '/signup')
+CREDENTIAL_PREFIXES = ('/token/',)
+
+
+class BatchError(ValueError):
+    """The batch document itself is malformed."""
+
+
+def run_batch(items):
+    if not isinstance(items, list):
+        raise BatchError("Expected a list of sub-requests")
+    if len(items) > MAX_BATCH_REQUESTS:
+        raise BatchError(f"A batch may contain at most {MAX_BATCH_REQUESTS} sub-requests")
+    return [run_subrequest(item) for item in items]
+
+
+def run_subrequest(item):
+    if not isinstance(item, dict) or not isinstance(item.get('route'), str):
+        return {"status": 400, "body": {"error": "Each sub-request needs a 'route'"}}
+
+    route = item['route']
+    method = str(item.get('method') or 'GET').upper()
+    result = {"route": route, "method": method}
+
+    path = route.split('?')[0].rstrip('/')
+    if not route.startswith('/') or path == '/batch':
+        return dict(result, status=400, body={"error": "Invalid sub-request route"})
+    if path in CREDENTIAL_ROUTES or (path + '/').startswith(CREDENTIAL_PREFIXES):
+        return dict(result, status=400, body={"error": f"{path} is not allowed in a batch"})
+    if method not in ALLOWED_METHODS:
+        return dict(result, status=405, body={"error": f"Method {method} is not allowed in a batch"})
+
+    app = current_app._get_current_object()
+    headers = {'Authorization': request.headers.get('Authorization', '')}
+    environ = {'REMOTE_ADDR': request.remote_addr}
+    with app.test_request_context(route, method=method, json=item.get('body'), headers=headers,
+                                  environ_base=environ):
+        try:
+            response = app.full_dispatch_request()
+        except Exception as e:
+            db.session.rollback()
+            response = app.make_response((jsonify({"error": str(e)}), 500))
+        data = response.get_data()
+
+    if response.is_json and data:
+        body = json.loads(data)
+    else:
+        body = data.decode('utf-8', 'replace')
+    return dict(result, status=response.status_code, body=body)
@@ -0,0 +1,78 @@
+"""Micro-benchmark: table-driven phase engine vs. the original determine_phase.
+
+Run from the repository root:
+
+    python benchmarks/bench_phase_engine.py [--iterations N]
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from phase_engine import phase_on  # noqa: E402
+
+
+# The pre-engine implementation, kept verbatim (minus its print) as the baseline
+def legacy_determine_phase(period_start, period_end, today_date):
+    period_start_date = datetime.strptime(period_start, "%Y-%m-%d")
+    period_end_date = datetime.strptime(period_end, "%Y-%m-%d")
+    today_date_obj = datetime.strptime(today_date, "%Y-%m-%d")
+
+    follicular_start = period_end_date + timedelta(days=1)
+    follicular_end = follicular_start + timedelta(days=6)
+
+    ovulation_start = follicular_end + timedelta(days=1)
+    ovulation_end = ovulation_start + timedelta(days=5)
+
+    luteal_start = ovulation_end + timedelta(days=1)
+    next_period_start = luteal_start + timedelta(days=13)
+
+    if period_start_date <= today_date_obj <= period_end_date:
+        phase = "Menstrual Phase"
+    elif follicular_start <= today_date_obj <= follicular_end:
+        phase = "Follicular Phase"
+    elif ovulation_start <= today_date_obj <= ovulation_end:
+        phase = "Ovulation Phase"
+    elif luteal_start <= today_date_obj < next_period_start:
+        phase = "Luteal Phase"
+    else:
+        phase = "Unknown Phase (possibly irregular cycle)"
+    return phase
+
+
+def lookups_per_second(func, args_list, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for args in args_list:
+            func(*args)
+    elapsed = time.perf_counter() - start
+    return iterations * len(args_list) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    period_start = date(2024, 1, 1)
+    period_end = date(2024, 1, 5)
+    days = [period_start + timedelta(days=offset) for offset in range(28)]
+
+    as_strings = [(str(period_start), str(period_end), str(day)) for day in days]
+    as_dates = [(period_start, period_end, day, 28, False) for day in days]
+
+    results = [
+        ("legacy determine_phase (str)", lookups_per_second(legacy_determine_phase, as_strings, args.iterations)),
+        ("phase_engine.phase_on (str)", lookups_per_second(phase_on, as_strings, args.iterations)),
+        ("phase_engine.phase_on (date)", lookups_per_second(phase_on, as_dates, args.iterations)),
+    ]
+    baseline = results[0][1]
+    for name, rate in results:
+        print(f"{name:32s} {rate:14,.0f} lookups/s  ({rate / baseline:5.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""Per-route latency and throughput through the Flask test client.
+
+Seeds a fresh temporary database with users and cycle histories, then drives
+every route in app.py sequentially, reporting throughput and p50/p95/p99
+latency per route, plus micro-benchmarks of the phase helpers. Results can be
+saved as JSON and compared against a saved baseline; the run exits non-zero
+when any route or helper regresses by more than the threshold.
+
+    python benchmarks/bench_routes.py [--requests 200] [--output results.json]
+    python benchmarks/bench_routes.py --baseline results.json [--threshold 0.2]
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PERCENTILES = (50, 95, 99)
+
+
+def seed(phase_app, users, cycles_per_user):
+    from flask_jwt_extended import create_access_token
+    from models import User, db, record_cycle
+
+    with phase_app.app.app_context():
+        password = phase_app.hasher.generate_password_hash("bench-password")
+        accounts = [
+            User(email=f"seed{i}@example.com", password=password, name="Bench", age=30, height=165, weight=60)
+            for i in range(users)
+        ]
+        db.session.add_all(accounts)
+        db.session.flush()
+
+        today = date.today()
+        for account in accounts:
+            period_start = today - timedelta(days=28 * cycles_per_user - 3)
+            for _ in range(cycles_per_user):
+                record_cycle(account.id, period_start, period_start + timedelta(days=4))
+                period_start += timedelta(days=28)
+        db.session.commit()
+        return [(account.id, account.email, create_access_token(identity=account.id)) for account in accounts]
+
+
+def issue_refresh_tokens(phase_app, accounts, count):
+    # Each refresh token can be exchanged once, so every request gets its own
+    from models import db
+    from refresh_tokens import issue_refresh_token
+
+    with phase_app.app.app_context():
+        tokens = [issue_refresh_token(accounts[i % len(accounts)][0]) for i in range(count)]
+        db.session.commit()
+        return tokens
+
+
+def route_requests(accounts, count, refresh_tokens):
+    """``{route name: [(method, path, kwargs), ...]}`` with ``count`` requests per route."""
+    today = date.today()
+    period_start = today - timedelta(days=3)
+    cycle = {"period_start": str(period_start), "period_end": str(period_start + timedelta(days=4))}
+
+    def auth(i):
+        return {"Authorization": f"Bearer {accounts[i % len(accounts)][2]}"}
+
+    def future_cycle(i):
+        # A new, later cycle per request so every write appends
+        start = today + timedelta(days=28 * (i // len(accounts) + 1))
+        return {"period_start": str(start), "period_end": str(start + timedelta(days=4))}
+
+    def plan(build):
+        return [build(i) for i in range(count)]
+
+    return {
+        "POST /signup": plan(lambda i: ("POST", "/signup", {"json": {
+            "email": f"new{i}@example.com", "password": "bench-password",
+            "name": "Bench", "age": 30, "height": 165, "weight": 60}})),
+        "POST /login": plan(lambda i: ("POST", "/login", {"json": {
+            "email": accounts[i % len(accounts)][1], "password": "bench-password"}})),
+        "POST /token/refresh": plan(lambda i: ("POST", "/token/refresh", {"headers": {
+            "Authorization": f"Bearer {refresh_tokens[i]}"}})),
+        "GET /cycle-data": plan(lambda i: ("GET", "/cycle-data", {"headers": auth(i)})),
+        "POST /cycle-data": plan(lambda i: ("POST", "/cycle-data", {"headers": auth(i), "json": future_cycle(i)})),
+        "POST /menstrual-phase": plan(lambda i: ("POST", "/menstrual-phase", {"headers": auth(i), "json": cycle})),
+        "POST /record": plan(lambda i: ("POST", "/record", {"headers": auth(i), "json": dict(
+            future_cycle(i + count), age=31, height=165, weight=61)})),
+        "POST /select-date": plan(lambda i: ("POST", "/select-date", {"headers": auth(i), "json": dict(
+            cycle, selected_date=str(today + timedelta(days=i % 60)))})),
+        "GET /catalogue": plan(lambda i: ("GET", "/catalogue", {})),
+        "POST /phase-calendar": plan(lambda i: ("POST", "/phase-calendar", {"headers": auth(i), "json": dict(
+            cycle, start_date=str(today), end_date=str(today + timedelta(days=89)))})),
+        "GET /cycle-data/export": plan(lambda i: ("GET", "/cycle-data/export?format=ndjson", {"headers": auth(i)})),
+        "POST /batch": plan(lambda i: ("POST", "/batch", {"headers": auth(i), "json": [
+            {"route": "/cycle-data"}, {"route": "/menstrual-phase", "method": "POST", "body": {}},
+            {"route": "/catalogue"}]})),
+        # A write then reads of the same user in one batch; the reads must see the write
+        "POST /batch write+read": plan(lambda i: ("POST", "/batch", {"headers": auth(i), "json": [
+            {"route": "/cycle-data", "method": "POST", "body": future_cycle(i + 2 * count)},
+            {"route": "/cycle-data"}, {"route": "/menstrual-phase", "method": "POST", "body": {}}]})),
+    }
+
+
+def batch_reads_own_write(kwargs, response):
+    written = kwargs["json"][0]["body"]
+    write, read, phase = response.get_json()["responses"]
+    return (write["status"] == 200 and read["status"] == 200 and phase["status"] == 200
+            and read["body"]["period_start"] == written["period_start"])
+
+
+# Route name -> check(request kwargs, response); a response failing its check counts as an error
+CHECKS = {"POST /batch write+read": batch_reads_own_write}
+
+
+def run_route(client, requests, check=None):
+    latencies = []
+    errors = 0
+    started = time.perf_counter()
+    for method, path, kwargs in requests:
+        request_started = time.perf_counter()
+        response = client.open(path, method=method, **kwargs)
+        response.get_data()
+        latencies.append(time.perf_counter() - request_started)
+        if response.status_code >= 400 or (check is not None and not check(kwargs, response)):
+            errors += 1
+    elapsed = time.perf_counter() - started
+
+    latencies_ms = np.array(latencies) * 1000
+    result = {"requests": len(requests), "errors": errors, "requests_per_second": len(requests) / elapsed}
+    for percentile, value in zip(PERCENTILES, np.percentile(latencies_ms, PERCENTILES)):
+        result[f"p{percentile}_ms"] = float(value)
+    return result
+
+
+def calls_per_second(func, args_list, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        for args in args_list:
+            func(*args)
+    return iterations * len(args_list) / (time.perf_counter() - started)
+
+
+def run_micro(phase_app, accounts, iterations):
+    from principal_cache import Principal
+
+    today = date.today()
+    period_start = today - timedelta(days=3)
+    period_end = period_start + timedelta(days=4)
+    days = [today + timedelta(days=offset) for offset in range(-10, 40)]
+    late = Principal(0, "bench@example.com", "Bench", 30, 165, 60,
+                     period_start=today - timedelta(days=60), period_end=today - timedelta(days=56))
+
+    with phase_app.app.app_context():
+        user_ids = [(user_id,) for user_id, _, _ in accounts]
+        return {
+            "determine_phase": {"calls_per_second": calls_per_second(
+                phase_app.determine_phase, [(period_start, period_end, day) for day in days], iterations)},
+            "predict_phase": {"calls_per_second": calls_per_second(
+                phase_app.predict_phase, [(late, day) for day in days], iterations)},
+            "calculate_average_cycle_length": {"calls_per_second": calls_per_second(
+                phase_app.calculate_average_cycle_length, user_ids, max(iterations // 10, 1))},
+        }
+
+
+def compare(results, baseline, threshold):
+    """Human-readable regressions of ``results`` against ``baseline``."""
+    regressions = []
+    for route, base in baseline.get("routes", {}).items():
+        current = results["routes"].get(route)
+        if current is None:
+            continue
+        if current["p95_ms"] > base["p95_ms"] * (1 + threshold):
+            regressions.append(f"{route}: p95 {base['p95_ms']:.2f} -> {current['p95_ms']:.2f} ms")
+        if current["requests_per_second"] < base["requests_per_second"] * (1 - threshold):
+            regressions.append(f"{route}: throughput {base['requests_per_second']:.0f} -> "
+                               f"{current['requests_per_second']:.0f} req/s")
+    for name, base in baseline.get("micro", {}).items():
+        current = results["micro"].get(name)
+        if current is not None and current["calls_per_second"] < base["calls_per_second"] * (1 - threshold):
+            regressions.append(f"{name}: {base['calls_per_second']:,.0f} -> {current['calls_per_second']:,.0f} calls/s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200, help="requests per route")
+    parser.add_argument("--users", type=int, default=50, help="seeded users")
+    parser.add_argument("--cycles", type=int, default=12, help="seeded cycles per user")
+    parser.add_argument("--iterations", type=int, default=200, help="micro-benchmark iterations")
+    parser.add_argument("--bcrypt-rounds", type=int, help="bcrypt cost for signup/login (default: app setting)")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--baseline", help="compare against this JSON results file")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed relative regression")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Storage settings are read when app.py is imported
+        os.environ["PHASE_DATABASE_URI"] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        os.environ.setdefault("BCRYPT_POOL_SIZE", "0")
+        sys.path.insert(0, ROOT)
+        import app as phase_app
+
+        if args.bcrypt_rounds is not None:
+            phase_app.hasher.rounds = args.bcrypt_rounds
+        # Every request comes from one client; measure the routes, not the per-client rate limits
+        for policy in phase_app.admission.policies.values():
+            policy.ip_rate = policy.user_rate = None
+
+        accounts = seed(phase_app, args.users, args.cycles)
+        client = phase_app.app.test_client()
+        routes = {
+            route: run_route(client, requests, CHECKS.get(route))
+            for route, requests in route_requests(
+                accounts, args.requests, issue_refresh_tokens(phase_app, accounts, args.requests)).items()
+        }
+        results = {
+            "meta": {"python": platform.python_version(), "requests": args.requests, "users": args.users,
+                     "cycles": args.cycles, "bcrypt_rounds": phase_app.hasher.rounds},
+            "routes": routes,
+            "micro": run_micro(phase_app, accounts, args.iterations),
+        }
+        phase_app.hasher.shutdown()
+
+    print(f"{'route':24s} {'req/s':>9s} {'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s} {'errors':>7s}")
+    for route, result in results["routes"].items():
+        print(f"{route:24s} {result['requests_per_second']:9.1f} {result['p50_ms']:8.2f} "
+              f"{result['p95_ms']:8.2f} {result['p99_ms']:8.2f} {result['errors']:7d}")
+    print()
+    for name, result in results["micro"].items():
+        print(f"{name:32s} {result['calls_per_second']:14,.0f} calls/s")
+
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump(results, handle, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as handle:
+            regressions = compare(results, json.load(handle), args.threshold)
+        if regressions:
+            print(f"\nRegressions beyond {args.threshold:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"\nNo regressions beyond {args.threshold:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
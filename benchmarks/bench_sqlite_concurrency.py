@@ -0,0 +1,119 @@
+"""Concurrent read/write throughput of the SQLite storage profiles.
+
+Runs the same workload once per storage profile, each in a fresh process
+against a fresh database: writer threads POST new cycles to /cycle-data
+while reader threads stream /cycle-data/export for the same users.
+
+    python benchmarks/bench_sqlite_concurrency.py [--writers 4] [--readers 8] [--seconds 5]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROFILES = ("baseline", "production")
+
+
+def run_workload(args):
+    # Runs inside the child process; storage settings come from the environment
+    sys.path.insert(0, ROOT)
+    from flask_jwt_extended import create_access_token
+
+    import app as phase_app
+    from models import User, db
+
+    flask_app = phase_app.app
+    with flask_app.app_context():
+        users = [
+            User(email=f"bench{i}@example.com", password="x", name="Bench", age=30, height=165, weight=60)
+            for i in range(args.writers)
+        ]
+        db.session.add_all(users)
+        db.session.commit()
+        tokens = [create_access_token(identity=user.id) for user in users]
+
+    stop = threading.Event()
+    counts = {"writes": 0, "reads": 0, "errors": 0}
+    lock = threading.Lock()
+
+    def writer(token):
+        client = flask_app.test_client()
+        headers = {"Authorization": f"Bearer {token}"}
+        period_start = date(2000, 1, 1)
+        while not stop.is_set():
+            response = client.post("/cycle-data", headers=headers, json={
+                "period_start": period_start.isoformat(),
+                "period_end": (period_start + timedelta(days=4)).isoformat(),
+            })
+            period_start += timedelta(days=28)
+            with lock:
+                counts["writes" if response.status_code == 200 else "errors"] += 1
+
+    def reader(token):
+        client = flask_app.test_client()
+        headers = {"Authorization": f"Bearer {token}"}
+        while not stop.is_set():
+            response = client.get("/cycle-data/export?format=ndjson", headers=headers)
+            response.get_data()
+            with lock:
+                counts["reads" if response.status_code == 200 else "errors"] += 1
+
+    threads = [threading.Thread(target=writer, args=(token,)) for token in tokens]
+    threads += [threading.Thread(target=reader, args=(tokens[i % len(tokens)],)) for i in range(args.readers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    print(json.dumps({
+        "writes_per_second": counts["writes"] / elapsed,
+        "reads_per_second": counts["reads"] / elapsed,
+        "errors": counts["errors"],
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_workload(args)
+        return
+
+    results = {}
+    for profile in PROFILES:
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(
+                os.environ,
+                PHASE_DATABASE_URI=f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+                PHASE_STORAGE_PROFILE=profile,
+                BCRYPT_POOL_SIZE="0",
+            )
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--child",
+                 "--writers", str(args.writers), "--readers", str(args.readers), "--seconds", str(args.seconds)],
+                env=env, check=True, capture_output=True, text=True,
+            ).stdout
+            results[profile] = json.loads(output.strip().splitlines()[-1])
+
+    print(f"{'profile':12s} {'writes/s':>10s} {'reads/s':>10s} {'errors':>8s}")
+    for profile, result in results.items():
+        print(f"{profile:12s} {result['writes_per_second']:10.1f} {result['reads_per_second']:10.1f} {result['errors']:8d}")
+
+
+if __name__ == "__main__":
+    main()
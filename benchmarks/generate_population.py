@@ -0,0 +1,149 @@
+"""Fill a database with synthetic users and cycle histories for capacity testing.
+
+Users get a personal cycle length (mostly 24-35 days), some are irregular,
+periods last 3-7 days and the odd cycle goes unlogged. Every account shares
+one password, hashed once, so generation is bound by inserts rather than
+bcrypt. Each user also gets the CycleStats summary and materialized phase
+timeline the app maintains on write. Rows go in through bulk ``executemany``
+inserts, committed per batch.
+
+    python benchmarks/generate_population.py --users 200000 \\
+        [--database-uri sqlite:////tmp/population.db] [--password load-test]
+
+Accounts are ``<prefix><n>@example.com``; benchmarks/load_driver.py logs in
+with the same prefix and password.
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IRREGULAR_SHARE = 0.15
+SKIPPED_CYCLE_RATE = 0.03
+
+
+class _Summary:
+    """Plain-attribute stand-in running CycleStats' own update methods.
+
+    Skips ORM attribute instrumentation, which otherwise dominates generation.
+    """
+    def __init__(self, model):
+        self.EWMA_ALPHA = model.EWMA_ALPHA
+        self.DEFAULT_CYCLE_LENGTH = model.DEFAULT_CYCLE_LENGTH
+        self.RECENT_LENGTHS = model.RECENT_LENGTHS
+        self._add_period = model.add_period
+        self._add_length = model.add_length
+        self._expected_cycle_length = model.expected_cycle_length.fget
+        self.columns = [column.name for column in model.__table__.columns]
+        for name in self.columns:
+            setattr(self, name, None)
+
+    def add_period(self, period_start, period_end):
+        self._add_period(self, period_start, period_end)
+
+    def add_length(self, length):
+        self._add_length(self, length)
+
+    @property
+    def expected_cycle_length(self):
+        return self._expected_cycle_length(self)
+
+    def row(self):
+        return {name: getattr(self, name) for name in self.columns}
+
+
+def user_histories(rng, count, mean_cycles, today):
+    """Yield ``(cycle dates, period lengths)`` arrays for ``count`` users."""
+    base_lengths = np.clip(rng.normal(28.5, 2.5, count), 22, 38)
+    spreads = np.where(rng.random(count) < IRREGULAR_SHARE, rng.uniform(4, 9, count), rng.uniform(0.5, 2, count))
+    cycle_counts = np.maximum(rng.poisson(mean_cycles, count), 1)
+    period_lengths = rng.integers(3, 8, count)
+
+    for base, spread, cycles, period_length in zip(base_lengths, spreads, cycle_counts, period_lengths):
+        gaps = np.clip(np.rint(rng.normal(base, spread, cycles)), 18, 60).astype(np.int64)
+        # An unlogged period shows up as one double-length gap
+        skipped = rng.random(cycles) < SKIPPED_CYCLE_RATE
+        gaps[skipped] *= 2
+
+        # Most recent period started somewhere within the last cycle
+        offsets = np.cumsum(gaps[::-1])[::-1] - gaps[-1] + rng.integers(0, gaps[-1])
+        starts = [today - timedelta(days=int(offset)) for offset in offsets]
+        lengths = np.clip(period_length + rng.integers(-1, 2, cycles), 2, 9)
+        yield starts, lengths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--cycles", type=float, default=12, help="mean cycles of history per user")
+    parser.add_argument("--batch-size", type=int, default=5000, help="users per commit")
+    parser.add_argument("--database-uri", help="target database (default: PHASE_DATABASE_URI or the app default)")
+    parser.add_argument("--password", default="load-test")
+    parser.add_argument("--email-prefix", default="load")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.database_uri:
+        os.environ["PHASE_DATABASE_URI"] = args.database_uri
+    os.environ.setdefault("BCRYPT_POOL_SIZE", "0")
+    sys.path.insert(0, ROOT)
+    import app as phase_app
+    from models import CycleData, CycleStats, PhaseInterval, User, db
+    from phase_engine import phase_timeline
+
+    rng = np.random.default_rng(args.seed)
+    today = date.today()
+    started = time.perf_counter()
+    cycles_written = 0
+
+    with phase_app.app.app_context():
+        password = phase_app.hasher.generate_password_hash(args.password)
+        next_id = (db.session.query(db.func.max(User.id)).scalar() or 0) + 1
+
+        for batch_start in range(0, args.users, args.batch_size):
+            batch_count = min(args.batch_size, args.users - batch_start)
+            users, cycles, stats, intervals = [], [], [], []
+
+            for offset, (starts, lengths) in enumerate(user_histories(rng, batch_count, args.cycles, today)):
+                user_id = next_id + batch_start + offset
+                number = batch_start + offset
+                users.append({
+                    "id": user_id, "email": f"{args.email_prefix}{number}@example.com", "password": password,
+                    "name": f"Load {number}", "age": int(rng.integers(14, 55)),
+                    "height": round(float(rng.normal(165, 7)), 1), "weight": round(float(rng.normal(63, 9)), 1),
+                })
+
+                # Summarize with the same running statistics the app maintains on write
+                summary = _Summary(CycleStats)
+                summary.user_id, summary.cycle_count, summary.length_count = user_id, 0, 0
+                for period_start, length in zip(starts, lengths):
+                    period_end = period_start + timedelta(days=int(length) - 1)
+                    cycles.append({"user_id": user_id, "period_start": period_start, "period_end": period_end})
+                    summary.add_period(period_start, period_end)
+                stats.append(summary.row())
+                for starts_on, ends_on, phase, rule in phase_timeline(
+                        summary.last_period_start, summary.last_period_end, summary.expected_cycle_length):
+                    intervals.append({"user_id": user_id, "starts_on": starts_on, "ends_on": ends_on,
+                                      "phase": phase, "rule": rule})
+
+            db.session.execute(User.__table__.insert(), users)
+            db.session.execute(CycleData.__table__.insert(), cycles)
+            db.session.execute(CycleStats.__table__.insert(), stats)
+            db.session.execute(PhaseInterval.__table__.insert(), intervals)
+            db.session.commit()
+
+            cycles_written += len(cycles)
+            done = batch_start + batch_count
+            elapsed = time.perf_counter() - started
+            print(f"{done:>9,d} users  {cycles_written:>11,d} cycles  {done / elapsed:9,.0f} users/s", flush=True)
+
+    phase_app.hasher.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""Mixed-workload load driver for a running Phase server.
+
+Each worker thread holds one keep-alive connection, signs in as one of the
+accounts made by benchmarks/generate_population.py and then replays a
+weighted mix of operations until the duration is up:
+
+* ``login`` - POST /login (bcrypt-bound)
+* ``dashboard`` - the Streamlit dashboard load: one POST /batch of
+  GET /cycle-data, POST /menstrual-phase and GET /catalogue
+* ``record`` - POST /record with a fresh cycle for the worker's user
+* ``refresh`` - POST /token/refresh; also how a worker whose access token
+  expired gets a new one, falling back to ``login`` only if that fails
+
+    python benchmarks/load_driver.py --base-url http://127.0.0.1:8080 --users 200000 \\
+        [--concurrency 32] [--duration 60] [--mix login=1,dashboard=8,record=1]
+
+Reports throughput, error rate and p50/p95/p99 latency per operation.
+"""
+import argparse
+import http.client
+import json
+import random
+import threading
+import time
+from datetime import date, timedelta
+from urllib.parse import urlsplit
+
+import numpy as np
+
+PERCENTILES = (50, 95, 99)
+OPERATIONS = ("login", "dashboard", "record", "refresh")
+
+
+class Client:
+    """One keep-alive HTTP connection that reconnects after errors."""
+
+    def __init__(self, base_url, timeout):
+        url = urlsplit(base_url)
+        self.host = url.hostname
+        self.port = url.port or (443 if url.scheme == "https" else 80)
+        self.connection_class = http.client.HTTPSConnection if url.scheme == "https" else http.client.HTTPConnection
+        self.timeout = timeout
+        self.connection = None
+        self.token = None
+
+    def request(self, method, path, body=None):
+        if self.connection is None:
+            self.connection = self.connection_class(self.host, self.port, timeout=self.timeout)
+        headers = {"Content-Type": "application/json"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        try:
+            self.connection.request(method, path, body=json.dumps(body) if body is not None else None,
+                                    headers=headers)
+            response = self.connection.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            self.connection = None
+            raise
+        return response.status, data
+
+
+def parse_mix(text):
+    weights = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"unknown operation '{name}'; use {', '.join(OPERATIONS)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+class Worker(threading.Thread):
+    def __init__(self, args, stop, rng):
+        super().__init__(daemon=True)
+        self.args = args
+        self.stop = stop
+        self.rng = rng
+        self.client = Client(args.base_url, args.timeout)
+        self.email = f"{args.email_prefix}{rng.randrange(args.users)}@example.com"
+        self.refresh_token = None
+        self.period_start = date.today() - timedelta(days=rng.randrange(28))
+        self.operations, self.weights = zip(*args.mix.items())
+        self.latencies = {name: [] for name in OPERATIONS}
+        self.errors = {name: 0 for name in OPERATIONS}
+
+    def login(self):
+        status, data = self.client.request("POST", "/login", {"email": self.email, "password": self.args.password})
+        if status == 200:
+            self.store_tokens(data)
+        return status
+
+    def refresh(self):
+        access_token, self.client.token = self.client.token, self.refresh_token
+        try:
+            status, data = self.client.request("POST", "/token/refresh")
+        finally:
+            self.client.token = access_token
+        if status == 200:
+            self.store_tokens(data)
+        return status
+
+    def store_tokens(self, data):
+        body = json.loads(data)
+        self.client.token = body["access_token"]
+        self.refresh_token = body["refresh_token"]
+
+    def dashboard(self):
+        status, _ = self.client.request("POST", "/batch", [
+            {"route": "/cycle-data", "method": "GET"},
+            {"route": "/menstrual-phase", "method": "POST", "body": {}},
+            {"route": "/catalogue", "method": "GET"},
+        ])
+        return status
+
+    def record(self):
+        # Re-recording the same start updates that cycle; move on now and then to append one
+        if self.rng.random() < 0.2:
+            self.period_start += timedelta(days=28)
+        status, _ = self.client.request("POST", "/record", {
+            "period_start": str(self.period_start),
+            "period_end": str(self.period_start + timedelta(days=4)),
+            "age": 30, "height": 165, "weight": 60,
+        })
+        return status
+
+    def timed(self, name):
+        started = time.perf_counter()
+        try:
+            status = getattr(self, name)()
+        except (OSError, http.client.HTTPException):
+            status = None
+        self.latencies[name].append(time.perf_counter() - started)
+        if status is None or status >= 400:
+            self.errors[name] += 1
+        return status
+
+    def run(self):
+        while not self.stop.is_set():
+            if self.client.token is None:
+                # Sign in first; back off while the server sheds logins (503/429)
+                if self.timed("login") != 200:
+                    self.stop.wait(1.0)
+                continue
+            name = self.rng.choices(self.operations, self.weights)[0]
+            if self.timed(name) == 401 and (self.refresh_token is None or self.timed("refresh") != 200):
+                self.client.token = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default="http://127.0.0.1:8080")
+    parser.add_argument("--users", type=int, default=100000, help="accounts available (generator --users)")
+    parser.add_argument("--email-prefix", default="load")
+    parser.add_argument("--password", default="load-test")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("login=1,dashboard=8,record=1"))
+    parser.add_argument("--timeout", type=float, default=30.0, help="per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write results to this JSON file")
+    args = parser.parse_args()
+
+    stop = threading.Event()
+    workers = [Worker(args, stop, random.Random(args.seed + number)) for number in range(args.concurrency)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    time.sleep(args.duration)
+    stop.set()
+    for worker in workers:
+        worker.join(args.timeout)
+    elapsed = time.perf_counter() - started
+
+    results = {}
+    for name in OPERATIONS:
+        latencies = [value for worker in workers for value in worker.latencies[name]]
+        errors = sum(worker.errors[name] for worker in workers)
+        if not latencies:
+            continue
+        latencies_ms = np.array(latencies) * 1000
+        result = {"requests": len(latencies), "errors": errors, "error_rate": errors / len(latencies),
+                  "requests_per_second": len(latencies) / elapsed}
+        for percentile, value in zip(PERCENTILES, np.percentile(latencies_ms, PERCENTILES)):
+            result[f"p{percentile}_ms"] = float(value)
+        results[name] = result
+
+    print(f"{'operation':10s} {'requests':>9s} {'req/s':>9s} {'errors':>7s} {'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s}")
+    for name, result in results.items():
+        print(f"{name:10s} {result['requests']:9d} {result['requests_per_second']:9.1f} {result['error_rate']:7.2%} "
+              f"{result['p50_ms']:8.2f} {result['p95_ms']:8.2f} {result['p99_ms']:8.2f}")
+
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump({"concurrency": args.concurrency, "duration": elapsed, "mix": args.mix,
+                       "operations": results}, handle, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""iCalendar feed of predicted phases.
+
+Calendar clients poll feed URLs often and carry no bearer token, so the feed
+is authenticated by a long-lived secret in its query string (see
+``CalendarToken``) and built from the cached principal's phase timeline -
+the materialized ``PhaseInterval`` runs that ``/menstrual-phase`` answers
+from - so the calendar shows the same phases as the app, late-cycle
+predictions included. The timeline's inputs (the latest cycle and the
+expected cycle length), plus the window the feed covers, form the feed's
+data version, which names its ETag - so a poll with an unchanged version is
+answered 304 without generating anything, even by a worker that has never
+built the feed. The window starts at the run containing today and spans
+``cycles`` expected cycle lengths.
+
+Feeds are generated lazily as a streamed response and the finished bytes are
+kept in a small per-user cache keyed by version, with the time they were
+built as ``Last-Modified`` for clients that only send ``If-Modified-Since``.
+"""
+import hashlib
+import secrets
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta, timezone
+
+from flask import Response, request
+
+from models import db, CalendarToken
+from phase_engine import PHASES, RECORDED, timeline_lookup
+
+FEED_CYCLES = 6
+MAX_FEED_CYCLES = 24
+
+# Bump when the generated document changes shape, so clients refetch
+FEED_FORMAT = 2
+
+
+def hash_token(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def issue_calendar_token(user_id):
+    """Create or replace the user's feed token; returns the plaintext token. Caller commits."""
+    token = secrets.token_urlsafe(32)
+    entry = CalendarToken.query.get(user_id)
+    if entry is None:
+        entry = CalendarToken(user_id=user_id)
+        db.session.add(entry)
+    entry.token_hash = hash_token(token)
+    entry.created_at = datetime.utcnow()
+    return token
+
+
+def calendar_user(session, token):
+    """User id owning ``token``, or ``None``."""
+    if not token:
+        return None
+    return session.query(CalendarToken.user_id).filter_by(token_hash=hash_token(token)).scalar()
+
+
+def feed_version(principal, today, cycles):
+    """Everything the feed's content depends on."""
+    timeline = principal.timeline
+    run = timeline_lookup(timeline, today)
+    # Start at the run containing today (so the version only changes with the phase), never before the latest cycle
+    window_start = run[0] if run is not None else (timeline[0][0] if timeline else principal.period_start)
+    window_end = window_start + timedelta(days=cycles * principal.average_cycle_length)
+    return (FEED_FORMAT, principal.period_start.isoformat(), principal.period_end.isoformat(),
+            principal.average_cycle_length, window_start.isoformat(), window_end.isoformat())
+
+
+def _escape(text):
+    return text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def _phase_runs(timeline):
+    # Timeline runs differ by phase or rule; a calendar shows one event per phase, predicted if any of it is
+    runs = []
+    for starts, ends, phase, rule in timeline:
+        if runs and runs[-1][2] == phase:
+            runs[-1][1] = ends
+            runs[-1][3] = runs[-1][3] and rule == RECORDED
+        else:
+            runs.append([starts, ends, phase, rule == RECORDED])
+    return runs
+
+
+def iter_ics(user_id, version, timeline):
+    """Yield the feed document in chunks, one per event; ``timeline`` is the one ``version`` was taken from."""
+    _, period_start, _, _, window_start, window_end = version
+    period_start = date.fromisoformat(period_start)
+    window_start, window_end = date.fromisoformat(window_start), date.fromisoformat(window_end)
+    # Fixed per version so the same version always yields the same bytes
+    stamp = datetime.combine(period_start, datetime.min.time()).strftime('%Y%m%dT%H%M%SZ')
+
+    yield ('BEGIN:VCALENDAR\r\n'
+           'VERSION:2.0\r\n'
+           'PRODID:-//Phase//Cycle Phases//EN\r\n'
+           'CALSCALE:GREGORIAN\r\n'
+           'METHOD:PUBLISH\r\n'
+           'X-WR-CALNAME:Phase\r\n'
+           'REFRESH-INTERVAL;VALUE=DURATION:PT12H\r\n')
+
+    for starts, ends, phase, recorded in _phase_runs(timeline):
+        if starts >= window_end:
+            break
+        if ends is not None and ends <= window_start:
+            continue
+        # The last run lasts indefinitely; show it up to the end of the window
+        ends = window_end if ends is None else min(ends, window_end)
+        description = "From your logged cycle" if recorded else "Predicted from your logged cycles"
+        yield ('BEGIN:VEVENT\r\n'
+               f'UID:{user_id}-{starts:%Y%m%d}-{PHASES.index(phase)}@phase\r\n'
+               f'DTSTAMP:{stamp}\r\n'
+               f'DTSTART;VALUE=DATE:{starts:%Y%m%d}\r\n'
+               f'DTEND;VALUE=DATE:{ends:%Y%m%d}\r\n'
+               f'SUMMARY:{_escape(phase)}\r\n'
+               f'DESCRIPTION:{_escape(description)}\r\n'
+               'TRANSP:TRANSPARENT\r\n'
+               'END:VEVENT\r\n')
+
+    yield 'END:VCALENDAR\r\n'
+
+
+class FeedCache:
+    def __init__(self, app=None):
+        self.maxsize = 1024
+        self._lock = threading.Lock()
+        self._feeds = OrderedDict()  # user_id -> (version, body, last_modified)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.maxsize = app.config.setdefault('CALENDAR_CACHE_SIZE', 1024)
+        app.extensions['calendar_feed'] = self
+
+    def _get(self, user_id, version):
+        with self._lock:
+            entry = self._feeds.get(user_id)
+            if entry is None or entry[0] != version:
+                return None
+            self._feeds.move_to_end(user_id)
+            return entry
+
+    def _put(self, user_id, version, body, last_modified):
+        with self._lock:
+            # Only the newest version per user is worth keeping
+            self._feeds[user_id] = (version, body, last_modified)
+            self._feeds.move_to_end(user_id)
+            while len(self._feeds) > self.maxsize:
+                self._feeds.popitem(last=False)
+
+    def _recording(self, user_id, version, chunks, last_modified):
+        # Stream while keeping a copy; cache it only if the client read to the end
+        parts = []
+        for chunk in chunks:
+            data = chunk.encode('utf-8')
+            parts.append(data)
+            yield data
+        self._put(user_id, version, b''.join(parts), last_modified)
+
+    def response(self, principal, today, cycles=FEED_CYCLES):
+        """Feed response for ``principal``, honouring If-None-Match and If-Modified-Since."""
+        version = feed_version(principal, today, cycles)
+        etag = hashlib.sha256(repr((principal.user_id, version)).encode('utf-8')).hexdigest()[:32]
+
+        cached = self._get(principal.user_id, version)
+        if cached is not None:
+            response = Response(cached[1], mimetype='text/calendar')
+            last_modified = cached[2]
+        else:
+            last_modified = datetime.now(timezone.utc).replace(microsecond=0)
+            if request.if_none_match.contains(etag):
+                body = None
+            else:
+                chunks = iter_ics(principal.user_id, version, principal.timeline)
+                body = self._recording(principal.user_id, version, chunks, last_modified)
+            response = Response(body, mimetype='text/calendar')
+
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        response.headers['Content-Disposition'] = 'inline; filename="phase.ics"'
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
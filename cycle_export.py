@@ -0,0 +1,79 @@
+"""Streaming export of a user's cycle history and per-day phases.
+
+Rows are read with ``yield_per`` and serialized one cycle at a time, so
+memory stays flat however long the history is. Each cycle runs until the
+day before the next recorded period; the latest cycle runs for the user's
+expected cycle length.
+"""
+import csv
+import io
+import json
+from datetime import timedelta
+
+from models import CycleData
+from phase_engine import PHASES, phase_table
+
+CONTENT_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def iter_cycles(session, user_id, expected_cycle_length, chunk_size=500):
+    """Yield ``(period_start, period_end, cycle_length)`` oldest first."""
+    rows = (session.query(CycleData.period_start, CycleData.period_end)
+            .filter_by(user_id=user_id)
+            .order_by(CycleData.period_start)
+            .yield_per(chunk_size))
+
+    previous = None
+    for period_start, period_end in rows:
+        if previous is not None:
+            yield previous[0], previous[1], (period_start - previous[0]).days
+        previous = (period_start, period_end)
+    if previous is not None:
+        yield previous[0], previous[1], expected_cycle_length
+
+
+def iter_days(period_start, period_end, cycle_length):
+    table = phase_table((period_end - period_start).days + 1, max(cycle_length, 1))
+    for offset, phase_index in enumerate(table):
+        yield period_start + timedelta(days=offset), PHASES[phase_index]
+
+
+def export_ndjson(cycles):
+    # One line per cycle, with its days nested
+    for period_start, period_end, cycle_length in cycles:
+        record = {
+            "period_start": period_start.isoformat(),
+            "period_end": period_end.isoformat(),
+            "cycle_length": cycle_length,
+            "days": [
+                {"date": day.isoformat(), "phase": phase}
+                for day, phase in iter_days(period_start, period_end, cycle_length)
+            ],
+        }
+        yield json.dumps(record, separators=(",", ":")) + "\n"
+
+
+def export_csv(cycles):
+    # One row per day
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["period_start", "period_end", "cycle_length", "date", "phase"])
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+
+    for period_start, period_end, cycle_length in cycles:
+        for day, phase in iter_days(period_start, period_end, cycle_length):
+            writer.writerow([period_start.isoformat(), period_end.isoformat(), cycle_length, day.isoformat(), phase])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+EXPORTERS = {
+    "ndjson": export_ndjson,
+    "csv": export_csv,
+}
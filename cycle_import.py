@@ -0,0 +1,176 @@
+"""Streaming bulk import of historical cycle data.
+
+The request body is read incrementally as NDJSON (one
+``{"period_start": ..., "period_end": ...}`` object per line) or CSV (a
+header row naming ``period_start`` and ``period_end``), so memory use does
+not grow with upload size: lines longer than ``MAX_LINE_LENGTH`` are never
+buffered whole, but skipped to the next newline and reported. Valid rows are written in batched ``executemany``
+upserts with one commit per batch; invalid rows are reported by row number.
+"""
+import codecs
+import csv
+import json
+from datetime import date
+
+from models import db, cycle_upsert, rebuild_cycle_stats
+
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+CSV_TYPES = ("text/csv", "application/csv")
+
+# Errors listed individually in the report; the rest are only counted
+MAX_REPORTED_ERRORS = 1000
+
+# Far beyond any real row; longer lines are reported as errors rather than held in memory
+MAX_LINE_LENGTH = 64 * 1024
+# Yielded by iter_lines in place of an over-long line; a Unicode noncharacter, so no valid row consists of it
+OVERLONG_LINE = "\ufffe"
+
+
+class ImportFormatError(ValueError):
+    """The upload's content type is not one of the supported formats."""
+
+
+def iter_lines(stream, chunk_size=64 * 1024, max_length=MAX_LINE_LENGTH):
+    # Decode incrementally so multi-byte characters split across chunks survive
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    pending = ""
+    skipping = False  # Inside an over-long line, discarding up to its newline
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        text = decoder.decode(chunk)
+        if skipping:
+            newline = text.find("\n")
+            if newline < 0:
+                continue
+            yield OVERLONG_LINE
+            skipping = False
+            text = text[newline + 1:]
+        pending += text
+        lines = pending.split("\n")
+        pending = lines.pop()
+        for line in lines:
+            yield OVERLONG_LINE if len(line) > max_length else line.rstrip("\r")
+        if len(pending) > max_length:
+            pending = ""
+            skipping = True
+    pending += decoder.decode(b"", final=True)
+    if skipping or len(pending) > max_length:
+        yield OVERLONG_LINE
+    elif pending:
+        yield pending.rstrip("\r")
+
+
+def iter_ndjson(lines):
+    for row_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        if line == OVERLONG_LINE:
+            yield row_number, None, f"Line longer than {MAX_LINE_LENGTH} characters"
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield row_number, None, f"Invalid JSON: {e}"
+            continue
+        if not isinstance(record, dict):
+            yield row_number, None, "Expected a JSON object"
+            continue
+        yield row_number, record, None
+
+
+def iter_csv(lines):
+    # Row numbers count data rows, so the header is row 0
+    reader = csv.DictReader(lines)
+    row_number = 0
+    while True:
+        row_number += 1
+        try:
+            record = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            # e.g. a field over the csv module's size limit; the reader carries on with the next line
+            yield row_number, None, f"Invalid CSV: {e}"
+            continue
+        if OVERLONG_LINE in record.values():
+            yield row_number, None, f"Line longer than {MAX_LINE_LENGTH} characters"
+            continue
+        yield row_number, record, None
+
+
+def parse_cycle(record):
+    try:
+        period_start = date.fromisoformat(str(record["period_start"]).strip())
+        period_end = date.fromisoformat(str(record["period_end"]).strip())
+    except KeyError as e:
+        raise ValueError(f"Missing field {e}")
+    except (TypeError, ValueError):
+        raise ValueError("Dates must be formatted as YYYY-MM-DD")
+
+    if period_end < period_start:
+        raise ValueError("period_end is before period_start")
+    return period_start, period_end
+
+
+def import_cycles(user_id, stream, content_type, batch_size=1000):
+    """Import every row in ``stream`` for ``user_id`` and return a report dict."""
+    mimetype = (content_type or "").split(";")[0].strip().lower()
+    if mimetype in NDJSON_TYPES:
+        rows = iter_ndjson(iter_lines(stream))
+    elif mimetype in CSV_TYPES:
+        rows = iter_csv(iter_lines(stream))
+    else:
+        raise ImportFormatError(
+            f"Unsupported content type '{mimetype}'; use one of {', '.join(NDJSON_TYPES + CSV_TYPES)}"
+        )
+
+    statement = cycle_upsert()
+    imported = 0
+    failed = 0
+    errors = []
+    batch = []
+    committed = []
+
+    def flush():
+        db.session.execute(statement, batch)
+        db.session.commit()
+        committed.append(len(batch))
+        batch.clear()
+
+    try:
+        for row_number, record, error in rows:
+            if error is None:
+                try:
+                    period_start, period_end = parse_cycle(record)
+                except ValueError as e:
+                    error = str(e)
+
+            if error is not None:
+                failed += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append({"row": row_number, "error": error})
+                continue
+
+            batch.append({"user_id": user_id, "period_start": period_start, "period_end": period_end})
+            imported += 1
+            if len(batch) >= batch_size:
+                flush()
+
+        if batch:
+            flush()
+    finally:
+        if committed:
+            # Batches already committed stay, even if the upload broke off; the summary must cover them.
+            # One ordered pass over the index instead of an update per imported row
+            db.session.rollback()
+            rebuild_cycle_stats(user_id)
+            db.session.commit()
+
+    return {
+        "imported": imported,
+        "failed": failed,
+        "errors": errors,
+        "errors_truncated": failed > len(errors),
+    }
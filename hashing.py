@@ -0,0 +1,250 @@
+"""Password hashing offloaded to a bounded process pool.
+
+bcrypt is deliberately CPU-bound, so running it on the request thread pins a
+WSGI worker for the whole round and caps a process at one core. The
+``HashingService`` hands hashing and verification to a ``ProcessPoolExecutor``
+instead, bounding how many calls may wait for a worker and how long a caller
+waits, and tracks queue wait separately from time spent hashing. Calls that
+fail, including every call in flight when a worker process dies, raise
+``HashingUnavailable``; a pool broken by a dead worker is replaced on the
+next call.
+
+Configuration (read from ``app.config`` by ``init_app``):
+
+* ``BCRYPT_POOL_SIZE`` - worker processes; ``0`` hashes inline on the caller
+  thread (default: ``os.cpu_count()``)
+* ``BCRYPT_QUEUE_DEPTH`` - calls allowed in flight before new ones are
+  rejected (default: four per worker)
+* ``BCRYPT_TIMEOUT`` - seconds a caller waits for its result (default: 5)
+* ``BCRYPT_LOG_ROUNDS`` - bcrypt cost for new hashes; unset, it is calibrated
+  at startup so one hash takes about ``BCRYPT_TARGET_SECONDS`` (default:
+  0.25) on this machine, within ``BCRYPT_MIN_ROUNDS``..``BCRYPT_MAX_ROUNDS``
+  (default: 10..16)
+
+Every bcrypt hash embeds its cost (``$2b$12$...``). ``needs_rehash`` tells
+the caller, after a successful check, that a stored hash was made at a cost
+other than the current one, so it can be replaced while the password is at
+hand. Each cost step doubles the work, so calibration times a cheap probe
+cost and extrapolates. Workers calibrate independently and may round to
+neighbouring costs; a hash is only considered stale when its cost is more
+than ``REHASH_TOLERANCE`` steps from the measured optimum, so they do not
+keep rehashing each other's hashes.
+"""
+import math
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+import flask_bcrypt
+
+
+CALIBRATION_ROUNDS = 8
+CALIBRATION_SAMPLES = 3
+REHASH_TOLERANCE = 0.75
+
+
+class HashingUnavailable(Exception):
+    """The hashing pool cannot take or finish this call right now."""
+
+
+class HashingQueueFull(HashingUnavailable):
+    pass
+
+
+class HashingTimeout(HashingUnavailable):
+    pass
+
+
+class HashingFailed(HashingUnavailable):
+    pass
+
+
+# Worker functions: module level so the pool can pickle them by reference
+def _generate(password, rounds):
+    started = time.time()
+    pw_hash = flask_bcrypt.generate_password_hash(password, rounds).decode('utf-8')
+    return pw_hash, started, time.time() - started
+
+
+def _check(pw_hash, password):
+    started = time.time()
+    try:
+        matches = flask_bcrypt.check_password_hash(pw_hash, password)
+    except ValueError:
+        # Malformed stored hash
+        matches = False
+    return matches, started, time.time() - started
+
+
+def hash_cost(pw_hash):
+    """The bcrypt cost embedded in ``pw_hash``, or ``None`` if it is not a bcrypt hash."""
+    parts = pw_hash.split('$') if isinstance(pw_hash, str) else ()
+    if len(parts) != 4 or not parts[2].isdigit():
+        return None
+    return int(parts[2])
+
+
+def calibrate_rounds(target_seconds, min_rounds, max_rounds):
+    """Fractional bcrypt cost at which one hash takes ``target_seconds`` here, within the bounds."""
+    elapsed = []
+    for _ in range(CALIBRATION_SAMPLES):
+        started = time.perf_counter()
+        flask_bcrypt.generate_password_hash('calibration', CALIBRATION_ROUNDS)
+        elapsed.append(time.perf_counter() - started)
+    # The fastest sample is the least disturbed by whatever else the machine is doing
+    rounds = CALIBRATION_ROUNDS + math.log2(target_seconds / max(min(elapsed), 1e-6))
+    return min(max(rounds, min_rounds), max_rounds)
+
+
+class HashingService:
+    def __init__(self, app=None):
+        self.pool_size = os.cpu_count() or 1
+        self.queue_depth = self.pool_size * 4
+        self.timeout = 5.0
+        self.rounds = 12
+        self.optimal_rounds = 12.0  # Calibrated, unrounded cost; equals rounds when the cost is configured
+
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(self.queue_depth)
+        self._lock = threading.Lock()
+        self._stats = {
+            "submitted": 0,
+            "completed": 0,
+            "rejected": 0,
+            "timeouts": 0,
+            "failures": 0,
+            "stale_hashes": 0,
+            "queue_wait_seconds_total": 0.0,
+            "queue_wait_seconds_max": 0.0,
+            "hash_seconds_total": 0.0,
+            "hash_seconds_max": 0.0,
+        }
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.pool_size = app.config.setdefault('BCRYPT_POOL_SIZE', os.cpu_count() or 1)
+        self.queue_depth = app.config.setdefault('BCRYPT_QUEUE_DEPTH', max(self.pool_size, 1) * 4)
+        self.timeout = app.config.setdefault('BCRYPT_TIMEOUT', 5.0)
+        if app.config.get('BCRYPT_LOG_ROUNDS') is None:
+            self.optimal_rounds = calibrate_rounds(
+                app.config.setdefault('BCRYPT_TARGET_SECONDS', 0.25),
+                app.config.setdefault('BCRYPT_MIN_ROUNDS', 10),
+                app.config.setdefault('BCRYPT_MAX_ROUNDS', 16),
+            )
+            app.config['BCRYPT_LOG_ROUNDS'] = int(round(self.optimal_rounds))
+        else:
+            self.optimal_rounds = float(app.config['BCRYPT_LOG_ROUNDS'])
+        self.rounds = app.config['BCRYPT_LOG_ROUNDS']
+        self._slots = threading.BoundedSemaphore(self.queue_depth)
+        app.extensions['hashing'] = self
+
+    # Public API
+
+    def generate_password_hash(self, password):
+        return self._run(_generate, password, self.rounds)
+
+    def check_password_hash(self, pw_hash, password):
+        return self._run(_check, pw_hash, password)
+
+    def needs_rehash(self, pw_hash):
+        """Whether ``pw_hash`` should be replaced by a hash at the current cost."""
+        cost = hash_cost(pw_hash)
+        if cost is None or cost == self.rounds or abs(cost - self.optimal_rounds) <= REHASH_TOLERANCE:
+            return False
+        self._record(stale_hashes=1)
+        return True
+
+    def metrics(self):
+        """Snapshot of pool counters; wait and hash times are in seconds."""
+        with self._lock:
+            snapshot = dict(self._stats)
+        snapshot["in_flight"] = (snapshot["submitted"] - snapshot["completed"] - snapshot["timeouts"]
+                                 - snapshot["failures"])
+        snapshot["pool_size"] = self.pool_size
+        snapshot["queue_depth"] = self.queue_depth
+        snapshot["rounds"] = self.rounds
+        return snapshot
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    # Internals
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.pool_size)
+            return self._executor
+
+    def _discard_pool(self, executor):
+        # A worker died (killed, out of memory); the executor refuses further work, so start a new one
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _fail(self, error, executor=None):
+        self._record(failures=1)
+        if executor is not None and isinstance(error, BrokenProcessPool):
+            self._discard_pool(executor)
+        raise HashingFailed("Password operation failed") from error
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            self._record(rejected=1)
+            raise HashingQueueFull("Too many password operations in progress")
+
+        submitted = time.time()
+        self._record(submitted=1)
+
+        if not self.pool_size:
+            try:
+                result, started, hash_seconds = func(*args)
+            except Exception as e:
+                self._fail(e)
+            finally:
+                self._slots.release()
+            self._record_done(started - submitted, hash_seconds)
+            return result
+
+        executor = self._pool()
+        try:
+            future = executor.submit(func, *args)
+        except Exception as e:
+            self._slots.release()
+            self._fail(e, executor)
+        # Free the slot when the worker finishes, even if the caller gave up
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            result, started, hash_seconds = future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            self._record(timeouts=1)
+            raise HashingTimeout("Password operation timed out")
+        except Exception as e:
+            self._fail(e, executor)
+
+        self._record_done(max(started - submitted, 0.0), hash_seconds)
+        return result
+
+    def _record(self, **counts):
+        with self._lock:
+            for key, value in counts.items():
+                self._stats[key] += value
+
+    def _record_done(self, queue_wait, hash_seconds):
+        with self._lock:
+            stats = self._stats
+            stats["completed"] += 1
+            stats["queue_wait_seconds_total"] += queue_wait
+            stats["hash_seconds_total"] += hash_seconds
+            stats["queue_wait_seconds_max"] = max(stats["queue_wait_seconds_max"], queue_wait)
+            stats["hash_seconds_max"] = max(stats["hash_seconds_max"], hash_seconds)
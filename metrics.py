@@ -0,0 +1,371 @@
+"""Request metrics in Prometheus text format.
+
+``Metrics`` records, per route, request counts by status and a latency
+histogram, plus histograms for the time each request spent in named
+segments: ``db`` (every SQL statement, timed by SQLAlchemy engine events),
+and whatever the app wraps in ``timed_segment`` (``bcrypt``, ``phase``).
+
+Each process keeps its own counters. With ``METRICS_DIR`` set (environment:
+``PHASE_METRICS_DIR``), every process periodically writes a snapshot to
+``<dir>/metrics-<pid>.json`` and ``/metrics`` sums the snapshots of all
+processes, so any worker can serve the scrape. When a process has exited
+(found at a scrape, or when a new process reuses its pid) its counters and
+histograms are folded into ``<dir>/metrics-archive.json`` and only its
+gauges are dropped - as ``prometheus_client``'s ``mark_process_dead`` does -
+so the summed totals never go backwards when workers are recycled. Gauges
+are also left out for snapshots older than ``METRICS_STALE_AFTER`` seconds
+(default three flush intervals), since an idle process no longer knows how
+many requests are in flight. Without a directory only the serving process
+is reported.
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from flask import Response, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PREFIX = 'phase'
+ARCHIVE_NAME = 'metrics-archive.json'
+_ENVIRON_KEY = 'phase.metrics'
+
+
+class _Histogram:
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self, counts=None, total=0.0, count=0):
+        # counts[i] is the number of observations <= LATENCY_BUCKETS[i] and above the previous bound
+        self.counts = counts or [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = total
+        self.count = count
+
+    def observe(self, value):
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                break
+        else:
+            index = len(LATENCY_BUCKETS)
+        self.counts[index] += 1
+        self.total += value
+        self.count += 1
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.total += other.total
+        self.count += other.count
+
+    def to_json(self):
+        return [self.counts, self.total, self.count]
+
+    @classmethod
+    def from_json(cls, data):
+        counts, total, count = data
+        return cls(list(counts), total, count)
+
+
+class _Registry:
+    def __init__(self):
+        self.requests = {}  # (route, method, status) -> count
+        self.latency = {}  # (route, method) -> _Histogram
+        self.segments = {}  # (route, segment) -> _Histogram
+        self.counters = {}  # name -> (help, value)
+
+    def to_json(self):
+        return {
+            'requests': [[list(key), value] for key, value in self.requests.items()],
+            'latency': [[list(key), hist.to_json()] for key, hist in self.latency.items()],
+            'segments': [[list(key), hist.to_json()] for key, hist in self.segments.items()],
+            'counters': {name: list(entry) for name, entry in self.counters.items()},
+        }
+
+    def merge_json(self, data, gauges=True):
+        for key, value in data.get('requests', []):
+            key = tuple(key)
+            self.requests[key] = self.requests.get(key, 0) + value
+        for field in ('latency', 'segments'):
+            target = getattr(self, field)
+            for key, hist in data.get(field, []):
+                key = tuple(key)
+                target.setdefault(key, _Histogram()).merge(_Histogram.from_json(hist))
+        for name, (help_text, value) in data.get('counters', {}).items():
+            if not gauges and not name.endswith('_total'):
+                continue
+            previous = self.counters.get(name, (help_text, 0))[1]
+            self.counters[name] = (help_text, previous + value)
+
+
+def _request_state():
+    return request.environ.get(_ENVIRON_KEY) if has_request_context() else None
+
+
+@contextmanager
+def timed_segment(name):
+    """Add the block's wall time to the current request's ``name`` segment."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        state = _request_state()
+        if state is not None:
+            segments = state['segments']
+            segments[name] = segments.get(name, 0.0) + time.perf_counter() - started
+
+
+# The start time lives on the statement's execution context, which is discarded with it if the statement
+# raises (after_cursor_execute is skipped then), rather than on the pooled connection
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.phase_query_start = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    _record_query(context)
+
+
+@event.listens_for(Engine, 'handle_error')
+def _handle_error(exception_context):
+    # Failed statements (e.g. a unique violation) still spent their time in the database
+    _record_query(exception_context.execution_context)
+
+
+def _record_query(context):
+    started = getattr(context, 'phase_query_start', None)
+    state = _request_state()
+    if started is not None and state is not None:
+        context.phase_query_start = None
+        segments = state['segments']
+        segments['db'] = segments.get('db', 0.0) + time.perf_counter() - started
+
+
+class Metrics:
+    def __init__(self, app=None):
+        self.directory = None
+        self.flush_interval = 5.0
+        self.stale_after = 15.0
+        self._collectors = []
+        self._lock = threading.Lock()
+        self._registry = _Registry()
+        self._last_flush = 0.0
+        self._flush_pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if 'PHASE_METRICS_DIR' in os.environ:
+            app.config['METRICS_DIR'] = os.environ['PHASE_METRICS_DIR']
+        self.directory = app.config.setdefault('METRICS_DIR', None)
+        self.flush_interval = app.config.setdefault('METRICS_FLUSH_INTERVAL', 5.0)
+        self.stale_after = app.config.setdefault('METRICS_STALE_AFTER', 3 * self.flush_interval)
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        app.teardown_request(self._teardown_request)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view, methods=['GET'])
+        app.extensions['metrics'] = self
+
+    def add_collector(self, collector):
+        """Register ``collector() -> {name: (help, value)}`` for process-level counters."""
+        self._collectors.append(collector)
+        return collector
+
+    # Request hooks
+
+    def _start_request(self):
+        request.environ[_ENVIRON_KEY] = {'started': time.perf_counter(), 'segments': {}}
+
+    def _finish_request(self, response):
+        self._record(response.status_code)
+        return response
+
+    def _teardown_request(self, exception=None):
+        # after_request is skipped when a view raises past the error handlers
+        if exception is not None:
+            self._record(500)
+
+    def _record(self, status):
+        state = request.environ.pop(_ENVIRON_KEY, None)
+        if state is None:
+            return
+        elapsed = time.perf_counter() - state['started']
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        method = request.method
+
+        with self._lock:
+            registry = self._registry
+            key = (route, method, str(status))
+            registry.requests[key] = registry.requests.get(key, 0) + 1
+            registry.latency.setdefault((route, method), _Histogram()).observe(elapsed)
+            for segment, seconds in state['segments'].items():
+                registry.segments.setdefault((route, segment), _Histogram()).observe(seconds)
+
+        if self.directory and time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    # Aggregation
+
+    def _snapshot(self):
+        with self._lock:
+            data = self._registry.to_json()
+        counters = {}
+        for collector in self._collectors:
+            counters.update({name: list(entry) for name, entry in collector().items()})
+        data['counters'] = counters
+        return data
+
+    def flush(self):
+        """Write this process's snapshot where other workers can read it."""
+        self._last_flush = time.monotonic()
+        path = os.path.join(self.directory, f'metrics-{os.getpid()}.json')
+        if self._flush_pid != os.getpid():
+            # First flush in this process: a snapshot already under this pid belongs to an exited process
+            self._flush_pid = os.getpid()
+            with _file_lock(self._archive_path() + '.lock'):
+                if os.path.exists(path):
+                    self._retire(path)
+        temporary = f'{path}.{threading.get_ident()}.tmp'
+        with open(temporary, 'w') as handle:
+            json.dump(self._snapshot(), handle)
+        os.replace(temporary, path)
+
+    def collect(self):
+        """Merged registry for every process (or just this one without a directory)."""
+        merged = _Registry()
+        if not self.directory:
+            merged.merge_json(self._snapshot())
+            return merged
+
+        self.flush()
+        # Under the archive lock no snapshot moves into the archive mid-scrape, to be counted twice or not at all
+        with _file_lock(self._archive_path() + '.lock'):
+            snapshots = []
+            for name in os.listdir(self.directory):
+                if not (name.startswith('metrics-') and name.endswith('.json')):
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    pid = int(name[len('metrics-'):-len('.json')])
+                except ValueError:
+                    pid = None
+                if pid is not None and not _process_alive(pid):
+                    self._retire(path)
+                elif pid is not None:
+                    snapshots.append(path)
+
+            now = time.time()
+            for path in snapshots + [self._archive_path()]:
+                try:
+                    # The archive holds no gauges
+                    fresh = path in snapshots and now - os.path.getmtime(path) <= self.stale_after
+                    with open(path) as handle:
+                        merged.merge_json(json.load(handle), gauges=fresh)
+                except (OSError, ValueError):
+                    # Snapshot removed or replaced mid-read; it will be complete next scrape
+                    continue
+        return merged
+
+    def _archive_path(self):
+        return os.path.join(self.directory, ARCHIVE_NAME)
+
+    def _retire(self, path):
+        """Fold the snapshot at ``path``, of an exited process, into the archive; caller holds the archive lock."""
+        archive = _Registry()
+        for source in (self._archive_path(), path):
+            try:
+                with open(source) as handle:
+                    archive.merge_json(json.load(handle), gauges=False)
+            except (OSError, ValueError):
+                continue
+        temporary = f'{self._archive_path()}.{os.getpid()}.tmp'
+        with open(temporary, 'w') as handle:
+            json.dump(archive.to_json(), handle)
+        os.replace(temporary, self._archive_path())
+        os.remove(path)
+
+    def metrics_view(self):
+        return Response(render(self.collect()), mimetype='text/plain; version=0.0.4')
+
+
+@contextmanager
+def _file_lock(path):
+    if fcntl is None:
+        yield
+        return
+    with open(path, 'a') as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def _process_alive(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Exists, under another user
+        return True
+    return True
+
+
+# Prometheus text exposition
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _render_histograms(lines, name, help_text, histograms, label_names):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} histogram')
+    for key, hist in sorted(histograms.items()):
+        labels = dict(zip(label_names, key))
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, hist.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{_labels(**labels, le=bound)} {cumulative}')
+        lines.append(f'{name}_bucket{_labels(**labels, le="+Inf")} {hist.count}')
+        lines.append(f'{name}_sum{_labels(**labels)} {hist.total}')
+        lines.append(f'{name}_count{_labels(**labels)} {hist.count}')
+
+
+def render(registry):
+    lines = [
+        f'# HELP {PREFIX}_http_requests_total Requests handled, by route, method and status.',
+        f'# TYPE {PREFIX}_http_requests_total counter',
+    ]
+    for (route, method, status), count in sorted(registry.requests.items()):
+        lines.append(f'{PREFIX}_http_requests_total{_labels(route=route, method=method, status=status)} {count}')
+
+    _render_histograms(lines, f'{PREFIX}_http_request_duration_seconds',
+                       'Request latency, by route and method.', registry.latency, ('route', 'method'))
+    _render_histograms(lines, f'{PREFIX}_segment_duration_seconds',
+                       'Time a request spent in the db, bcrypt or phase segment.', registry.segments,
+                       ('route', 'segment'))
+
+    for name, (help_text, value) in sorted(registry.counters.items()):
+        lines.append(f'# HELP {PREFIX}_{name} {help_text}')
+        lines.append(f'# TYPE {PREFIX}_{name} {"counter" if name.endswith("_total") else "gauge"}')
+        lines.append(f'{PREFIX}_{name} {value}')
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,344 @@
+"""Versioned schema migrations.
+
+Each migration has an integer version and runs at most once per database;
+applied versions are recorded in ``schema_version``. ``migrate`` applies the
+pending ones in order. Every worker calls it at startup, so callers take an
+exclusive lock on ``<database>.migrate.lock`` and read the applied versions
+only once they hold it: one process migrates while the others wait, then
+find nothing left to do. (The lock needs ``fcntl``; elsewhere, run
+``python migrations.py`` before starting several workers.)
+
+pysqlite runs DDL outside any transaction unless one has been begun
+explicitly, so each DDL migration runs inside ``BEGIN IMMEDIATE`` together
+with the row recording its version; a failed step leaves neither behind.
+Backfills commit batch by batch and record their version last. They only
+touch rows that still need them, so an interrupted one resumes where it
+stopped.
+
+Backfills run in batches of ``MIGRATION_BATCH_SIZE`` users, each in its own
+short transaction with an optional ``MIGRATION_BATCH_PAUSE`` between them,
+so a large table is never locked for the whole backfill and live writes
+interleave with it. (SQLite builds an index in one statement; with WAL
+journaling readers carry on meanwhile, and writers wait only for the build.)
+
+Databases created before migrations existed start at version 0; every step
+checks for what is already there, so they are brought up to date in place.
+The app migrates on startup unless ``PHASE_MIGRATE_ON_STARTUP=0``.
+
+    python migrations.py [--status] [--target N] [--batch-size 1000] [--pause 0.05]
+"""
+import argparse
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from sqlalchemy import bindparam, inspect, select, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from models import (db, User, CycleData, CycleStats, PhaseInterval, PhaseReminder, CalendarToken, RefreshToken,
+                    SchemaVersion)
+from phase_engine import phase_timeline
+from storage import is_sqlite_file, sqlite_path
+
+MIGRATIONS = []
+
+
+class Migration:
+    def __init__(self, version, description, func, batched):
+        self.version = version
+        self.description = description
+        self.func = func
+        self.batched = batched
+
+
+def migration(version, description, batched=False):
+    """Register ``func`` as migration ``version``.
+
+    Plain migrations get a connection inside a transaction that also records
+    the version; ``batched`` ones get a ``Backfill`` and manage their own
+    transactions through ``db.session``.
+    """
+    def register(func):
+        assert not MIGRATIONS or version > MIGRATIONS[-1].version, "migrations must be registered in order"
+        MIGRATIONS.append(Migration(version, description, func, batched))
+        return func
+    return register
+
+
+class Backfill:
+    def __init__(self, batch_size, pause):
+        self.batch_size = batch_size
+        self.pause = pause
+
+    def batches(self, query):
+        """Yield lists of ids from ``query(after_id, limit)`` until it returns none; commits after each."""
+        after = 0
+        while True:
+            ids = [row[0] for row in db.session.execute(query(after, self.batch_size))]
+            if not ids:
+                return
+            yield ids
+            db.session.commit()
+            after = ids[-1]
+            if self.pause:
+                time.sleep(self.pause)
+
+
+# Helpers
+
+def has_index(connection, table, name):
+    return any(index['name'] == name for index in inspect(connection).get_indexes(table))
+
+
+def create_table(connection, model):
+    model.__table__.create(connection, checkfirst=True)
+
+
+# Migrations
+
+@migration(1, "Initial user and cycle_data tables")
+def initial_schema(connection):
+    create_table(connection, User)
+    create_table(connection, CycleData)
+
+
+@migration(2, "Unique (user_id, period_start) index on cycle_data")
+def cycle_history_index(connection):
+    # Every authenticated read filters cycle_data by user_id; the composite index serves those and "latest first"
+    if has_index(connection, 'cycle_data', 'ix_cycle_data_user_period_start'):
+        return
+    # Older databases could hold the same period twice; keep the most recent write
+    connection.execute(text(
+        'DELETE FROM cycle_data WHERE id NOT IN '
+        '(SELECT MAX(id) FROM cycle_data GROUP BY user_id, period_start)'
+    ))
+    for index in CycleData.__table__.indexes:
+        index.create(connection, checkfirst=True)
+
+
+@migration(3, "cycle_stats table")
+def cycle_stats_table(connection):
+    create_table(connection, CycleStats)
+
+
+@migration(4, "Backfill cycle_stats for existing histories", batched=True)
+def backfill_cycle_stats(backfill):
+    cycles = CycleData.__table__
+    stats_table = CycleStats.__table__
+
+    def missing(after, limit):
+        return select(cycles.c.user_id).distinct().where(
+            cycles.c.user_id > after,
+            ~select(stats_table.c.user_id).where(stats_table.c.user_id == cycles.c.user_id).exists(),
+        ).order_by(cycles.c.user_id).limit(limit)
+
+    # Rows are computed on detached CycleStats objects and inserted with DO NOTHING, so a
+    # concurrent writer that creates a user's stats first wins
+    insert = sqlite_insert(stats_table).on_conflict_do_nothing(index_elements=['user_id'])
+    for user_ids in backfill.batches(missing):
+        history = db.session.execute(
+            select(cycles.c.user_id, cycles.c.period_start, cycles.c.period_end)
+            .where(cycles.c.user_id.in_(user_ids))
+            .order_by(cycles.c.user_id, cycles.c.period_start)
+        )
+        summaries = {}
+        for user_id, period_start, period_end in history:
+            stats = summaries.get(user_id)
+            if stats is None:
+                stats = summaries[user_id] = CycleStats(user_id=user_id, cycle_count=0, length_count=0)
+            stats.add_period(period_start, period_end)
+        db.session.execute(insert, [
+            {column.name: getattr(stats, column.name) for column in stats_table.columns}
+            for stats in summaries.values()
+        ])
+
+
+@migration(5, "phase_reminder outbox and its pending-reminder index")
+def phase_reminder_table(connection):
+    create_table(connection, PhaseReminder)
+    # Senders scan for undelivered reminders; a partial index keeps that scan small as the outbox grows
+    connection.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_phase_reminder_unsent ON phase_reminder (remind_on) WHERE sent_at IS NULL'
+    ))
+
+
+@migration(6, "calendar_token table")
+def calendar_token_table(connection):
+    create_table(connection, CalendarToken)
+
+
+@migration(7, "phase_interval table")
+def phase_interval_table(connection):
+    create_table(connection, PhaseInterval)
+
+
+@migration(8, "Backfill phase_interval timelines", batched=True)
+def backfill_phase_timelines(backfill):
+    stats_table = CycleStats.__table__
+    intervals = PhaseInterval.__table__
+
+    def missing(after, limit):
+        return select(stats_table.c.user_id).where(
+            stats_table.c.user_id > after,
+            stats_table.c.last_period_start.isnot(None),
+            ~select(intervals.c.user_id).where(intervals.c.user_id == stats_table.c.user_id).exists(),
+        ).order_by(stats_table.c.user_id).limit(limit)
+
+    # Only users without any intervals are selected, so each batch is one multi-row insert
+    for user_ids in backfill.batches(missing):
+        db.session.execute(intervals.insert(), [
+            {'user_id': stats.user_id, 'starts_on': starts_on, 'ends_on': ends_on, 'phase': phase, 'rule': rule}
+            for stats in CycleStats.query.filter(CycleStats.user_id.in_(user_ids))
+            for starts_on, ends_on, phase, rule in phase_timeline(
+                stats.last_period_start, stats.last_period_end, stats.expected_cycle_length)
+        ])
+
+
+@migration(9, "refresh_token table")
+def refresh_token_table(connection):
+    create_table(connection, RefreshToken)
+
+
+@migration(10, "recent_lengths column on cycle_stats")
+def cycle_stats_recent_lengths(connection):
+    if any(column['name'] == 'recent_lengths' for column in inspect(connection).get_columns('cycle_stats')):
+        return
+    connection.execute(text('ALTER TABLE cycle_stats ADD COLUMN recent_lengths JSON'))
+
+
+@migration(11, "Exact median over recent lengths, and the timelines it changes", batched=True)
+def backfill_recent_lengths(backfill):
+    cycles = CycleData.__table__
+    stats_table = CycleStats.__table__
+    intervals = PhaseInterval.__table__
+
+    def missing(after, limit):
+        return select(stats_table.c.user_id).where(
+            stats_table.c.user_id > after,
+            stats_table.c.length_count > 0,
+            stats_table.c.recent_lengths.is_(None),
+        ).order_by(stats_table.c.user_id).limit(limit)
+
+    # The streaming median these rows hold may be far off; recompute each summary from the history
+    update = stats_table.update().where(stats_table.c.user_id == bindparam('stats_user_id'))
+    for user_ids in backfill.batches(missing):
+        history = db.session.execute(
+            select(cycles.c.user_id, cycles.c.period_start, cycles.c.period_end)
+            .where(cycles.c.user_id.in_(user_ids))
+            .order_by(cycles.c.user_id, cycles.c.period_start)
+        )
+        summaries = {}
+        for user_id, period_start, period_end in history:
+            stats = summaries.get(user_id)
+            if stats is None:
+                stats = summaries[user_id] = CycleStats(user_id=user_id, cycle_count=0, length_count=0)
+            stats.add_period(period_start, period_end)
+
+        db.session.execute(update, [
+            dict({column.name: getattr(stats, column.name) for column in stats_table.columns
+                  if column.name != 'user_id'}, stats_user_id=stats.user_id)
+            for stats in summaries.values()
+        ])
+        db.session.execute(intervals.delete().where(intervals.c.user_id.in_(list(summaries))))
+        db.session.execute(intervals.insert(), [
+            {'user_id': stats.user_id, 'starts_on': starts_on, 'ends_on': ends_on, 'phase': phase, 'rule': rule}
+            for stats in summaries.values()
+            for starts_on, ends_on, phase, rule in phase_timeline(
+                stats.last_period_start, stats.last_period_end, stats.expected_cycle_length)
+        ])
+
+
+# Runner
+
+def applied_versions():
+    create_table(db.engine, SchemaVersion)
+    return {version for version, in db.session.query(SchemaVersion.version)}
+
+
+def _record(connection, step):
+    connection.execute(
+        sqlite_insert(SchemaVersion.__table__).on_conflict_do_nothing(index_elements=['version']),
+        {'version': step.version, 'description': step.description, 'applied_at': datetime.utcnow()},
+    )
+
+
+@contextmanager
+def migration_lock(app):
+    """Hold the exclusive lock beside a file database; other processes block until it is released."""
+    uri = app.config['SQLALCHEMY_DATABASE_URI']
+    if fcntl is None or not is_sqlite_file(uri):
+        yield
+        return
+    with open(sqlite_path(app, uri) + '.migrate.lock', 'a') as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def migrate(target=None, batch_size=None, pause=None):
+    """Apply pending migrations up to ``target`` (default: all); returns the versions applied.
+
+    Needs an app context; batch settings default to ``MIGRATION_BATCH_SIZE``
+    and ``MIGRATION_BATCH_PAUSE`` from the app config.
+    """
+    from flask import current_app
+
+    config = current_app.config
+    backfill = Backfill(
+        batch_size or config.get('MIGRATION_BATCH_SIZE', 1000),
+        config.get('MIGRATION_BATCH_PAUSE', 0.0) if pause is None else pause,
+    )
+
+    with migration_lock(current_app):
+        done = applied_versions()
+        db.session.commit()
+        applied = []
+        for step in MIGRATIONS:
+            if step.version in done or (target is not None and step.version > target):
+                continue
+            if step.batched:
+                step.func(backfill)
+                db.session.commit()
+                with db.engine.begin() as connection:
+                    _record(connection, step)
+            else:
+                with db.engine.begin() as connection:
+                    connection.exec_driver_sql('BEGIN IMMEDIATE')
+                    step.func(connection)
+                    _record(connection, step)
+            applied.append(step.version)
+    return applied
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--status', action='store_true', help='list migrations and whether each is applied')
+    parser.add_argument('--target', type=int, help='stop after this version')
+    parser.add_argument('--batch-size', type=int, help='users per backfill transaction')
+    parser.add_argument('--pause', type=float, help='seconds to sleep between backfill batches')
+    args = parser.parse_args()
+
+    # Migrate here, with these settings, rather than when the app is imported
+    os.environ['PHASE_MIGRATE_ON_STARTUP'] = '0'
+    from app import app
+
+    with app.app_context():
+        if args.status:
+            done = applied_versions()
+            for step in MIGRATIONS:
+                print(f"{'applied' if step.version in done else 'pending':8s} {step.version:4d}  {step.description}")
+            return
+        applied = migrate(args.target, args.batch_size, args.pause)
+    print(f"Applied {len(applied)} migration(s){': ' + ', '.join(map(str, applied)) if applied else ''}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,9 @@
+from statistics import median
+
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from phase_engine import phase_timeline
 
 db = SQLAlchemy()
 
@@ -11,12 +16,218 @@ class User(db.Model):
     height = db.Column(db.Float, nullable=False)
     weight = db.Column(db.Float, nullable=False)
 
-    # Relationship with CycleData
-    cycle_data = db.relationship('CycleData', backref='user', uselist=False)
+    # Relationship with CycleData: full history, newest first
+    cycles = db.relationship('CycleData', backref='user', lazy='dynamic',
+                             order_by='CycleData.period_start.desc()')
 
 
 class CycleData(db.Model):
+    # One row per recorded period; (user_id, period_start) serves "latest" and "last N" as index range scans
+    __table_args__ = (
+        db.Index('ix_cycle_data_user_period_start', 'user_id', 'period_start', unique=True),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     period_start = db.Column(db.Date, nullable=False)
-    period_end = db.Column(db.Date, nullable=False)
\ No newline at end of file
+    period_end = db.Column(db.Date, nullable=False)
+
+
+class CycleStats(db.Model):
+    # Running summary of a user's cycle lengths (days between consecutive period starts)
+    DEFAULT_CYCLE_LENGTH = 28
+    EWMA_ALPHA = 0.3
+    RECENT_LENGTHS = 12  # Window the median and MAD are taken over
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    cycle_count = db.Column(db.Integer, nullable=False, default=0)
+    last_period_start = db.Column(db.Date)
+    last_period_end = db.Column(db.Date)
+
+    length_count = db.Column(db.Integer, nullable=False, default=0)
+    mean_length = db.Column(db.Float)
+    m2_length = db.Column(db.Float)  # Welford sum of squared deviations
+    ewma_length = db.Column(db.Float)
+    median_length = db.Column(db.Float)  # Median of recent_lengths
+    mad_length = db.Column(db.Float)  # Median absolute deviation of recent_lengths
+    recent_lengths = db.Column(db.JSON(none_as_null=True))  # Last RECENT_LENGTHS lengths, oldest first
+
+    @property
+    def variance_length(self):
+        if not self.length_count or self.length_count < 2:
+            return None
+        return self.m2_length / (self.length_count - 1)
+
+    @property
+    def average_cycle_length(self):
+        if not self.length_count:
+            return self.DEFAULT_CYCLE_LENGTH
+        return int(self.mean_length)
+
+    @property
+    def expected_cycle_length(self):
+        # The median of recent lengths resists one-off long gaps (e.g. a missed log) and follows lasting changes;
+        # with fewer than three lengths it cannot tell an outlier apart, so use the mean
+        if not self.length_count:
+            return self.DEFAULT_CYCLE_LENGTH
+        if self.length_count < 3:
+            return int(round(self.mean_length))
+        return int(round(self.median_length))
+
+    def add_period(self, period_start, period_end):
+        # O(1) update for a period recorded after every period already seen
+        if self.last_period_start is not None:
+            self.add_length((period_start - self.last_period_start).days)
+        self.cycle_count = (self.cycle_count or 0) + 1
+        self.last_period_start = period_start
+        self.last_period_end = period_end
+
+    def add_length(self, length):
+        count = (self.length_count or 0) + 1
+        self.length_count = count
+
+        # A bounded window keeps the row small while the median and MAD stay exact
+        recent = (list(self.recent_lengths or ()) + [length])[-self.RECENT_LENGTHS:]
+        self.recent_lengths = recent
+        self.median_length = float(median(recent))
+        self.mad_length = float(median(abs(value - self.median_length) for value in recent))
+
+        if count == 1:
+            self.mean_length = float(length)
+            self.m2_length = 0.0
+            self.ewma_length = float(length)
+            return
+
+        delta = length - self.mean_length
+        self.mean_length += delta / count
+        self.m2_length += delta * (length - self.mean_length)
+        self.ewma_length += self.EWMA_ALPHA * (length - self.ewma_length)
+
+
+class PhaseInterval(db.Model):
+    # Materialized /menstrual-phase answers for the latest cycle, rewritten whenever it or the expected length changes
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    starts_on = db.Column(db.Date, primary_key=True)
+    ends_on = db.Column(db.Date)  # Exclusive; NULL for the open-ended last interval
+    phase = db.Column(db.String(64), nullable=False)
+    rule = db.Column(db.String(16), nullable=False)  # phase_engine.RECORDED or the prediction rule used
+
+
+class PhaseReminder(db.Model):
+    # Outbox of phase-change reminders; one row per user and transition day, however often the job runs
+    __table_args__ = (
+        db.Index('ix_phase_reminder_user_remind_on', 'user_id', 'remind_on', unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    remind_on = db.Column(db.Date, nullable=False)  # Day the new phase starts
+    phase = db.Column(db.String(64), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+    sent_at = db.Column(db.DateTime)  # Set by whatever delivers the reminder
+
+
+class CalendarToken(db.Model):
+    # Long-lived secret for the .ics feed URL; only its SHA-256 is stored, and issuing a new one revokes the old
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    token_hash = db.Column(db.String(64), unique=True, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+
+
+class RefreshToken(db.Model):
+    # One row per issued refresh token (see refresh_tokens.py); a login starts a family, each refresh extends it
+    __table_args__ = (
+        db.Index('ix_refresh_token_family', 'family'),
+        db.Index('ix_refresh_token_user_id', 'user_id'),
+    )
+
+    jti = db.Column(db.String(36), primary_key=True)
+    family = db.Column(db.String(36), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime)  # NULL when refresh tokens are configured not to expire
+    used_at = db.Column(db.DateTime)  # Set when exchanged; a second exchange is a replay
+    revoked_at = db.Column(db.DateTime)
+
+
+class SchemaVersion(db.Model):
+    # One row per applied migration (see migrations.py)
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    description = db.Column(db.String(200), nullable=False)
+    applied_at = db.Column(db.DateTime, nullable=False)
+
+
+# Cycle History Helpers
+def cycle_upsert():
+    # INSERT ... ON CONFLICT for cycle rows; re-recording a start date corrects its end date
+    statement = sqlite_insert(CycleData.__table__)
+    return statement.on_conflict_do_update(
+        index_elements=['user_id', 'period_start'],
+        set_={'period_end': statement.excluded.period_end}
+    )
+
+
+def record_cycle(user_id, period_start, period_end):
+    # Append a cycle in a single statement
+    db.session.execute(cycle_upsert(), {
+        'user_id': user_id, 'period_start': period_start, 'period_end': period_end
+    })
+    update_cycle_stats(user_id, period_start, period_end)
+
+
+def update_cycle_stats(user_id, period_start, period_end):
+    stats = CycleStats.query.get(user_id)
+    if stats is None:
+        stats = CycleStats(user_id=user_id, cycle_count=0, length_count=0)
+        db.session.add(stats)
+
+    timeline_inputs = (stats.last_period_start, stats.last_period_end, stats.expected_cycle_length)
+    if stats.last_period_start is None or period_start > stats.last_period_start:
+        stats.add_period(period_start, period_end)
+    elif period_start == stats.last_period_start:
+        stats.last_period_end = period_end
+    else:
+        # A period earlier than the latest one changes every interval after it
+        return rebuild_cycle_stats(user_id, stats)
+
+    if (stats.last_period_start, stats.last_period_end, stats.expected_cycle_length) != timeline_inputs:
+        refresh_phase_timeline(user_id, stats)
+    return stats
+
+
+def rebuild_cycle_stats(user_id, stats=None):
+    # Recompute from the full history; only needed for out-of-order writes and backfills
+    if stats is None:
+        stats = CycleStats.query.get(user_id)
+        if stats is None:
+            stats = CycleStats(user_id=user_id)
+            db.session.add(stats)
+
+    db.session.flush()
+    stats.cycle_count = 0
+    stats.length_count = 0
+    stats.recent_lengths = None
+    stats.last_period_start = None
+    stats.last_period_end = None
+    history = CycleData.query.filter_by(user_id=user_id).order_by(CycleData.period_start)
+    for cycle in history.with_entities(CycleData.period_start, CycleData.period_end):
+        stats.add_period(cycle.period_start, cycle.period_end)
+    refresh_phase_timeline(user_id, stats)
+    return stats
+
+
+def refresh_phase_timeline(user_id, stats):
+    # Runs in the caller's transaction, so readers see the new cycle and its timeline together
+    PhaseInterval.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+    if stats.last_period_start is None:
+        return
+    timeline = phase_timeline(stats.last_period_start, stats.last_period_end, stats.expected_cycle_length)
+    db.session.execute(PhaseInterval.__table__.insert(), [
+        {'user_id': user_id, 'starts_on': starts_on, 'ends_on': ends_on, 'phase': phase, 'rule': rule}
+        for starts_on, ends_on, phase, rule in timeline
+    ])
+
+
+def load_phase_timeline(session, user_id):
+    rows = session.query(PhaseInterval.starts_on, PhaseInterval.ends_on, PhaseInterval.phase, PhaseInterval.rule)
+    return tuple(tuple(row) for row in rows.filter_by(user_id=user_id).order_by(PhaseInterval.starts_on))
@@ -0,0 +1,51 @@
+"""Pre-serialized JSON payloads for responses that never change at runtime.
+
+A ``Payload`` is encoded once, gzip-compressed once and tagged with a strong
+ETag derived from its bytes. ``payload_response`` then serves it with no
+per-request serialization, answering ``If-None-Match`` with 304 and picking
+the gzip variant when the client accepts it.
+"""
+import gzip
+import hashlib
+import json
+
+from flask import Response, request
+
+
+class Payload:
+    __slots__ = ("body", "gzipped", "etag", "gzip_etag")
+
+    def __init__(self, document):
+        # Same encoding choices as Flask's jsonify outside debug mode
+        self.body = json.dumps(document, sort_keys=True, separators=(",", ":")).encode("utf-8")
+        self.gzipped = gzip.compress(self.body, compresslevel=9, mtime=0)
+        self.etag = hashlib.sha256(self.body).hexdigest()[:32]
+        # Strong ETags identify exact bytes, so the encoded variant gets its own
+        self.gzip_etag = self.etag + "-gz"
+
+
+def payload_response(payload, status=200, conditional=True):
+    """Build a response for ``payload`` honouring conditional and gzip requests.
+
+    With ``conditional=False`` the body is always sent, which suits routes
+    that perform a write before answering.
+    """
+    use_gzip = "gzip" in request.accept_encodings
+    etag = payload.gzip_etag if use_gzip else payload.etag
+
+    if conditional and (request.if_none_match.contains(payload.etag)
+                        or request.if_none_match.contains(payload.gzip_etag)):
+        response = Response(status=304)
+    else:
+        response = Response(payload.gzipped if use_gzip else payload.body, status=status, mimetype="application/json")
+        if use_gzip:
+            response.headers["Content-Encoding"] = "gzip"
+
+    response.set_etag(etag)
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def build_payloads(documents):
+    """Serialize a ``{key: document}`` mapping into ``{key: Payload}``."""
+    return {key: Payload(document) for key, document in documents.items()}
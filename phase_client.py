@@ -0,0 +1,249 @@
+"""Backend HTTP client for the Streamlit frontend.
+
+Each Streamlit user session gets one ``requests.Session`` with a pooled,
+keep-alive connection adapter, so calls stop paying TCP setup every time.
+Phase lookups are memoized with ``st.cache_data`` keyed on the user, the
+period dates and the day asked about, so a rerun that changes none of those
+costs no backend call. ``invalidate_phase_cache`` bumps a per-user version
+that is part of the key; call it after anything that changes cycle data.
+
+Selected-date lookups need no backend at all: ``select_date_phase`` runs the
+server's phase rules from ``phase_engine`` against the recommendation
+catalogue, which is fetched once per session. The server stays authoritative
+for writes and for today's phase, which may fall back to a prediction.
+
+Sessions stay signed in without the password: ``store_tokens`` keeps the
+access and refresh tokens from /login, and an access token about to expire,
+or one the server rejects with 401, is silently replaced through
+/token/refresh before the call is sent or retried.
+
+Phase endpoints are called with ``?view=compact``, so they answer with the
+phase key and catalogue version only; ``expand_phase_body`` fills in the
+recommendation text from the cached catalogue, refetching it if the server's
+version has moved on.
+"""
+import base64
+import json
+import time
+from datetime import date
+
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+
+from phase_engine import selected_date_phase
+from recommendations import expand_document, phase_document
+
+# Backend URL
+BASE_URL = "http://129.133.72.121:8080"
+
+# Seconds a memoized phase response stays valid
+PHASE_CACHE_TTL = 300
+
+# Refresh the access token this many seconds before it expires
+TOKEN_REFRESH_MARGIN = 30
+
+RequestException = requests.exceptions.RequestException
+
+
+class _Uncacheable(Exception):
+    # Raised inside the memoized call so error responses are not cached
+    def __init__(self, status_code, body):
+        super().__init__(status_code)
+        self.status_code = status_code
+        self.body = body
+
+
+def session():
+    """The current user session's pooled HTTP session."""
+    if "http_session" not in st.session_state:
+        http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=4)
+        http.mount("http://", adapter)
+        http.mount("https://", adapter)
+        st.session_state["http_session"] = http
+    return st.session_state["http_session"]
+
+
+def _token_expiry(token):
+    # The exp claim, read without verification; the server checks the signature
+    try:
+        payload = token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return float(claims["exp"])
+    except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+def store_tokens(body):
+    """Keep the tokens from a /login or /token/refresh response body."""
+    st.session_state["access_token"] = body["access_token"]
+    st.session_state["access_token_expires"] = _token_expiry(body["access_token"])
+    if "refresh_token" in body:
+        st.session_state["refresh_token"] = body["refresh_token"]
+
+
+def clear_tokens():
+    for key in ("access_token", "access_token_expires", "refresh_token"):
+        st.session_state[key] = None
+
+
+def refresh_tokens():
+    """Replace the access token using the refresh token; ``False`` if the user has to log in again."""
+    refresh_token = st.session_state.get("refresh_token")
+    if not refresh_token:
+        return False
+    try:
+        response = session().post(f"{BASE_URL}/token/refresh", headers={"Authorization": f"Bearer {refresh_token}"})
+    except RequestException:
+        return False
+    if response.status_code != 200:
+        if response.status_code in (401, 422):
+            # Expired, revoked or replayed: it will never work again
+            st.session_state["refresh_token"] = None
+        return False
+    store_tokens(response.json())
+    return True
+
+
+def logout():
+    """Revoke the session's refresh token on the server and forget both tokens."""
+    refresh_token = st.session_state.get("refresh_token")
+    if refresh_token:
+        try:
+            session().post(f"{BASE_URL}/logout", headers={"Authorization": f"Bearer {refresh_token}"})
+        except RequestException:
+            pass
+    clear_tokens()
+
+
+def auth_headers():
+    expires = st.session_state.get("access_token_expires")
+    if expires is not None and expires - time.time() < TOKEN_REFRESH_MARGIN:
+        refresh_tokens()
+    return {"Authorization": f"Bearer {st.session_state['access_token']}"}
+
+
+def _send(method, endpoint, authenticated, **kwargs):
+    url = f"{BASE_URL}/{endpoint}"
+    if not authenticated:
+        return session().request(method, url, **kwargs)
+    response = session().request(method, url, headers=auth_headers(), **kwargs)
+    if response.status_code == 401 and refresh_tokens():
+        response = session().request(method, url, headers=auth_headers(), **kwargs)
+    return response
+
+
+def post(endpoint, payload=None, authenticated=True):
+    return _send("POST", endpoint, authenticated, json=payload)
+
+
+def get(endpoint, authenticated=True):
+    return _send("GET", endpoint, authenticated)
+
+
+def _json_body(response):
+    try:
+        return response.json()
+    except ValueError:
+        return {"error": response.text}
+
+
+@st.cache_data(ttl=PHASE_CACHE_TTL, show_spinner=False)
+def _fetch_phase(user_key, cache_version, endpoint, period_start, period_end, day, _http, _headers):
+    payload = {"period_start": period_start, "period_end": period_end}
+    if endpoint == "select-date":
+        payload["selected_date"] = day
+    response = _http.post(f"{BASE_URL}/{endpoint}?view=compact", json=payload, headers=_headers)
+    if response.status_code != 200:
+        raise _Uncacheable(response.status_code, _json_body(response))
+    return response.status_code, response.json()
+
+
+def fetch_phase(period_start, period_end, selected_date=None):
+    """Return ``(status_code, body)`` for today's phase, or ``selected_date``'s if given.
+
+    ``period_start``/``period_end``/``selected_date`` are ``date`` objects.
+    """
+    if selected_date is None:
+        # /menstrual-phase answers for the server's today, so today is part of the key
+        endpoint, day = "menstrual-phase", date.today()
+    else:
+        endpoint, day = "select-date", selected_date
+
+    for attempt in range(2):
+        headers = auth_headers()
+        try:
+            status_code, body = _fetch_phase(
+                st.session_state["access_token"],
+                st.session_state.get("phase_cache_version", 0),
+                endpoint,
+                period_start.strftime("%Y-%m-%d"),
+                period_end.strftime("%Y-%m-%d"),
+                day.strftime("%Y-%m-%d"),
+                session(),
+                headers,
+            )
+        except _Uncacheable as e:
+            if e.status_code == 401 and not attempt and refresh_tokens():
+                continue
+            return e.status_code, e.body
+        return status_code, expand_phase_body(body)
+
+
+def store_catalogue(document):
+    """Keep a /catalogue response body for this session."""
+    st.session_state["catalogue"] = document["recommendations"]
+    st.session_state["catalogue_version"] = document.get("version")
+
+
+def fetch_catalogue(version=None):
+    """The recommendation catalogue, fetched on first use in each session; ``None`` if unavailable.
+
+    With ``version``, a cached catalogue of any other version is replaced.
+    """
+    cached_version = st.session_state.get("catalogue_version")
+    if st.session_state.get("catalogue") is None or (version is not None and version != cached_version):
+        try:
+            response = get("catalogue", authenticated=False)
+        except RequestException:
+            return None
+        if response.status_code != 200:
+            return None
+        store_catalogue(response.json())
+    return st.session_state["catalogue"]
+
+
+def expand_phase_body(body):
+    """Fill the recommendation text into a compact phase response from the cached catalogue."""
+    if not isinstance(body, dict):
+        return body
+    if "catalogue_version" in body:
+        catalogue = fetch_catalogue(body["catalogue_version"])
+        return expand_document(body, catalogue) if catalogue is not None else body
+    nested = body.get("phase")
+    if isinstance(nested, dict) and "catalogue_version" in nested:
+        return dict(body, phase=expand_phase_body(nested))
+    return body
+
+
+def select_date_phase(period_start, period_end, selected_date):
+    """Local equivalent of POST /select-date; returns ``(status_code, body)``."""
+    catalogue = fetch_catalogue()
+    if catalogue is None:
+        return fetch_phase(period_start, period_end, selected_date)
+
+    phase = selected_date_phase(period_start, period_end, selected_date, date.today())
+    if phase is None:
+        return 200, {
+            "error": "Cannot determine today's phase. Selected date phase cannot be predicted.",
+            "phase": "Unknown",
+        }
+    if phase not in catalogue:
+        return 200, {"phase": {"phase": phase, "message": "We don't have detailed recommendations for this phase."}}
+    return 200, {"phase": phase_document(phase, catalogue)}
+
+
+def invalidate_phase_cache():
+    """Forget this user's memoized phase responses."""
+    st.session_state["phase_cache_version"] = st.session_state.get("phase_cache_version", 0) + 1
@@ -0,0 +1,172 @@
+"""Table-driven menstrual phase engine.
+
+Every phase question in the app reduces to "which phase is day N of a cycle
+whose period lasts M days and whose cycle lasts C days?". The answer for all
+N is precomputed once per (M, C) pair, so each lookup is a single index into
+a cached tuple instead of building a set of ``timedelta`` boundaries per call.
+"""
+from bisect import bisect_right
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+
+import numpy as np
+
+MENSTRUAL_PHASE = "Menstrual Phase"
+FOLLICULAR_PHASE = "Follicular Phase"
+OVULATION_PHASE = "Ovulation Phase"
+LUTEAL_PHASE = "Luteal Phase"
+UNKNOWN_PHASE = "Unknown Phase (possibly irregular cycle)"
+
+# Index order used by the lookup tables
+PHASES = (MENSTRUAL_PHASE, FOLLICULAR_PHASE, OVULATION_PHASE, LUTEAL_PHASE)
+
+DEFAULT_CYCLE_LENGTH = 28
+FOLLICULAR_LENGTH = 6
+OVULATION_LENGTH = 5
+
+
+def parse_date(value):
+    """Return ``value`` as a ``date``; accepts dates, datetimes and YYYY-MM-DD strings."""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(value)
+
+
+def menstrual_length_of(period_start, period_end):
+    """Number of period days, counting both the start and end date."""
+    return (parse_date(period_end) - parse_date(period_start)).days + 1
+
+
+@lru_cache(maxsize=1024)
+def phase_table(menstrual_length, cycle_length=DEFAULT_CYCLE_LENGTH):
+    """Phase index (into ``PHASES``) for every day of a cycle."""
+    if cycle_length < 1:
+        raise ValueError("cycle_length must be positive")
+    menstrual_length = min(max(menstrual_length, 1), cycle_length)
+    follicular_end = menstrual_length + FOLLICULAR_LENGTH
+    ovulation_end = follicular_end + OVULATION_LENGTH
+
+    table = []
+    for day in range(cycle_length):
+        if day < menstrual_length:
+            table.append(0)
+        elif day < follicular_end:
+            table.append(1)
+        elif day < ovulation_end:
+            table.append(2)
+        else:
+            table.append(3)
+    return tuple(table)
+
+
+@lru_cache(maxsize=1024)
+def phase_array(menstrual_length, cycle_length=DEFAULT_CYCLE_LENGTH):
+    """``phase_table`` as a read-only NumPy array for vectorized lookups."""
+    table = np.array(phase_table(menstrual_length, cycle_length), dtype=np.int8)
+    table.setflags(write=False)
+    return table
+
+
+def phase_index(days_since_start, menstrual_length, cycle_length=DEFAULT_CYCLE_LENGTH, wrap=True):
+    """Phase index for a day offset from the period start.
+
+    With ``wrap`` the offset is folded into the cycle, so past and future
+    cycles repeat the same pattern; without it, offsets outside the first
+    cycle return ``None``.
+    """
+    if wrap:
+        days_since_start %= cycle_length
+    elif not 0 <= days_since_start < cycle_length:
+        return None
+    return phase_table(menstrual_length, cycle_length)[days_since_start]
+
+
+def phase_on(period_start, period_end, day, cycle_length=DEFAULT_CYCLE_LENGTH, wrap=True):
+    """Phase name for ``day`` given one period's start and end dates."""
+    period_start = parse_date(period_start)
+    index = phase_index(
+        (parse_date(day) - period_start).days,
+        menstrual_length_of(period_start, period_end),
+        cycle_length,
+        wrap,
+    )
+    return UNKNOWN_PHASE if index is None else PHASES[index]
+
+
+def selected_date_phase(period_start, period_end, selected_date, today):
+    """Phase for ``selected_date`` by the /select-date rules.
+
+    The answer is only given while ``today`` falls inside the cycle starting
+    at ``period_start``; otherwise ``None`` is returned.
+    """
+    if phase_on(period_start, period_end, today, wrap=False) == UNKNOWN_PHASE:
+        return None
+    return phase_on(period_start, period_end, selected_date)
+
+
+def phase_indices(days, period_start, period_end, cycle_length=DEFAULT_CYCLE_LENGTH):
+    """Vectorized ``phase_on`` for a ``datetime64[D]`` array; returns phase indices."""
+    period_start = parse_date(period_start)
+    table = phase_array(menstrual_length_of(period_start, period_end), cycle_length)
+    offsets = (days - np.datetime64(period_start, 'D')).astype(np.int64) % cycle_length
+    return table[offsets]
+
+
+# Late-cycle prediction: which rule of the /menstrual-phase prediction produced a phase
+RECORDED = "recorded"  # Inside the latest recorded cycle; no prediction needed
+SLIGHTLY_LATE = "slightly_late"  # Within a week of the predicted next period
+VERY_LATE = "very_late"  # A month or more past the predicted next period
+LATE = "late"  # Anywhere else; mapped onto the predicted cycle
+
+
+def predicted_phase_on(period_start, period_end, cycle_length, day):
+    """``(phase, rule)`` predicted for ``day`` from the latest cycle and the expected cycle length."""
+    period_start, period_end, day = parse_date(period_start), parse_date(period_end), parse_date(day)
+    next_period_start = period_end + timedelta(days=cycle_length)
+    next_period_end = next_period_start + (period_end - period_start)
+
+    if next_period_start - timedelta(days=7) <= day <= next_period_start + timedelta(days=7):
+        return FOLLICULAR_PHASE, SLIGHTLY_LATE
+    if day >= next_period_start + timedelta(days=30):
+        return MENSTRUAL_PHASE, VERY_LATE
+    return phase_on(next_period_start, next_period_end, day, cycle_length=cycle_length), LATE
+
+
+def phase_timeline(period_start, period_end, cycle_length):
+    """Every /menstrual-phase answer from ``period_start`` on, as ``(starts_on, ends_on, phase, rule)`` runs.
+
+    ``ends_on`` is exclusive, and ``None`` for the last run, which lasts
+    indefinitely. Dates before ``period_start`` are not covered.
+    """
+    period_start, period_end = parse_date(period_start), parse_date(period_end)
+    runs = []
+
+    def extend(day, phase, rule):
+        if runs and runs[-1][2:] == [phase, rule]:
+            runs[-1][1] = day + timedelta(days=1)
+        else:
+            runs.append([day, day + timedelta(days=1), phase, rule])
+
+    # The latest cycle itself is read against the default length, as determine_phase does
+    table = phase_table(menstrual_length_of(period_start, period_end))
+    for offset, index in enumerate(table):
+        extend(period_start + timedelta(days=offset), PHASES[index], RECORDED)
+
+    day = period_start + timedelta(days=len(table))
+    very_late_from = period_end + timedelta(days=cycle_length + 30)
+    while day < very_late_from:
+        extend(day, *predicted_phase_on(period_start, period_end, cycle_length, day))
+        day += timedelta(days=1)
+    runs.append([very_late_from, None, MENSTRUAL_PHASE, VERY_LATE])
+    return [tuple(run) for run in runs]
+
+
+def timeline_lookup(timeline, day):
+    """The run of a ``phase_timeline`` (sorted by start) covering ``day``, or ``None``."""
+    position = bisect_right(timeline, day, key=lambda run: run[0]) - 1
+    if position < 0:
+        return None
+    run = timeline[position]
+    return run if run[1] is None or day < run[1] else None
@@ -0,0 +1,189 @@
+"""Cache of verified JWT identities and the profile fields routes read.
+
+Every protected route used to verify the token's HMAC and then query the
+database for the same user and cycle rows. ``PrincipalCache`` keeps two
+bounded LRU maps:
+
+* token -> (user id, expiry), so a token already verified by this process
+  is not decoded again until it expires;
+* user id -> ``Principal``, the user's hot profile fields and latest cycle,
+  dropped by ``invalidate`` whenever the user or their cycle data is written
+  and otherwise expiring after ``PRINCIPAL_CACHE_TTL`` seconds (other worker
+  processes cannot see this process's invalidations).
+
+Routes use ``principal_required`` in place of ``jwt_required()`` and read
+the result with ``current_principal()``.
+"""
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, g, has_app_context, jsonify, request
+from flask_jwt_extended import get_jwt, verify_jwt_in_request
+
+
+class Principal:
+    __slots__ = ("user_id", "email", "name", "age", "height", "weight",
+                 "period_start", "period_end", "average_cycle_length", "timeline", "loaded_at")
+
+    def __init__(self, user_id, email, name, age, height, weight,
+                 period_start=None, period_end=None, average_cycle_length=28, timeline=()):
+        self.user_id = user_id
+        self.email = email
+        self.name = name
+        self.age = age
+        self.height = height
+        self.weight = weight
+        self.period_start = period_start
+        self.period_end = period_end
+        self.average_cycle_length = average_cycle_length
+        self.timeline = timeline  # Materialized phase intervals for the latest cycle (see models.PhaseInterval)
+        self.loaded_at = time.monotonic()
+
+    @property
+    def has_cycle(self):
+        return self.period_start is not None
+
+
+class _LRU:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    def get(self, key):
+        value = self._data.get(key)
+        if value is not None:
+            self._data.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key):
+        self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class PrincipalCache:
+    def __init__(self, app=None, loader=None):
+        self.maxsize = 4096
+        self.ttl = 30.0
+        self.loader = loader
+        self._lock = threading.Lock()
+        self._tokens = _LRU(self.maxsize)
+        self._principals = _LRU(self.maxsize)
+        self._sequence = 0  # Bumped by every invalidate
+        self._invalidated = {}  # user_id -> sequence of the user's latest invalidation
+        self._floor = 0  # Loads begun before this are treated as stale (set when _invalidated is cleared)
+        self.hits = 0
+        self.misses = 0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.maxsize = app.config.setdefault('PRINCIPAL_CACHE_SIZE', 4096)
+        self.ttl = app.config.setdefault('PRINCIPAL_CACHE_TTL', 30.0)
+        self._tokens = _LRU(self.maxsize)
+        self._principals = _LRU(self.maxsize)
+        app.extensions['principal_cache'] = self
+
+    def user_loader(self, loader):
+        """Register ``loader(user_id) -> Principal or None`` used on cache misses."""
+        self.loader = loader
+        return loader
+
+    def identity_for(self, token):
+        """User id for an already verified, unexpired token, else ``None``."""
+        with self._lock:
+            entry = self._tokens.get(token)
+            if entry is None:
+                return None
+            user_id, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                self._tokens.pop(token)
+                return None
+            return user_id
+
+    def remember_token(self, token, user_id, expires_at):
+        with self._lock:
+            self._tokens.put(token, (user_id, expires_at))
+
+    def forget_token(self, token):
+        with self._lock:
+            self._tokens.pop(token)
+
+    def principal(self, user_id):
+        with self._lock:
+            principal = self._principals.get(user_id)
+            if principal is not None and time.monotonic() - principal.loaded_at < self.ttl:
+                self.hits += 1
+                return principal
+            self.misses += 1
+            started = self._sequence
+
+        principal = self.loader(user_id)
+        if principal is not None:
+            with self._lock:
+                # A write invalidated while this was loading may not be in it; leave the next read to load again
+                if started >= self._floor and self._invalidated.get(user_id, 0) <= started:
+                    self._principals.put(user_id, principal)
+        return principal
+
+    def invalidate(self, user_id):
+        """Drop the cached profile after a write to the user or their cycles."""
+        with self._lock:
+            self._principals.pop(user_id)
+            self._sequence += 1
+            if len(self._invalidated) >= self.maxsize:
+                self._invalidated.clear()
+                self._floor = self._sequence
+            self._invalidated[user_id] = self._sequence
+        # /batch sub-requests share the app context, and with it g; later ones must reload too
+        if has_app_context():
+            principal = g.get('principal')
+            if principal is not None and principal.user_id == user_id:
+                g.pop('principal')
+
+
+def _bearer_token():
+    header = request.headers.get('Authorization', '')
+    scheme, _, token = header.partition(' ')
+    return token.strip() if scheme == 'Bearer' else None
+
+
+def load_principal():
+    """Verify the request's access token (or reuse a cached verification) and load its principal."""
+    cache = current_app.extensions['principal_cache']
+    token = _bearer_token()
+    user_id = cache.identity_for(token) if token else None
+
+    if user_id is None:
+        # Raises the usual flask_jwt_extended errors, handled by JWTManager
+        verify_jwt_in_request()
+        claims = get_jwt()
+        user_id = claims['sub']
+        cache.remember_token(token, user_id, claims.get('exp'))
+
+    return cache.principal(user_id)
+
+
+def principal_required(fn):
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        if 'principal' not in g:
+            g.principal = load_principal()
+        if g.principal is None:
+            return jsonify({"error": "User not found"}), 404
+        return fn(*args, **kwargs)
+    return wrapper
+
+
+def current_principal():
+    return g.principal
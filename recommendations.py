@@ -0,0 +1,193 @@
+import hashlib
+import json
+
+# Recommendations
+recommendations = {
+    "Menstrual Phase": {
+        "Food": {
+            "Iron-rich Foods": {
+                "description": "To replenish iron lost during menstruation and prevent anemia.",
+                "items": ["Leafy greens like spinach and kale", "Lean meats such as beef or turkey", "Legumes like lentils and chickpeas"]
+            },
+            "B Vitamin-rich Foods": {
+                "description": "To support energy levels and mood.",
+                "items": ["Whole grains like quinoa or whole wheat bread", "Eggs", "Dairy products like milk and cheese"]
+            },
+            "Omega-3 Fatty Acids": {
+                "description": "To help with menstrual cramping and inflammation.",
+                "items": ["Fatty fish like salmon or mackerel", "Nuts, especially walnuts", "Seeds like chia seeds and flaxseeds"]
+            },
+            "Magnesium-rich Foods": {
+                "description": "To help with menstrual cramping and sleep.",
+                "items": ["Dark chocolate", "Avocado", "Bananas"]
+            },
+            "Fiber-rich Foods": {
+                "description": "To support digestive health.",
+                "items": ["Whole grains", "Vegetables like broccoli and carrots", "Fruits like berries and apples"]
+            }
+        },
+        "Exercise": {
+            "description": "You have less energy, so this is the time for low-intensity activities, such as walking, stretching, or Pilates. You may not feel like exercising at all, and that’s OK.",
+            "activities": ["Walking", "Stretching", "Pilates"]
+        }
+    },
+    "Luteal Phase": {
+        "Food": {
+            "Healthy Fats & Vitamin B6": {
+                "description": "These nutrients help support overall hormonal balance and healthy skin.",
+                "food_sources": ["Avocado", "Wild salmon", "Walnuts"]
+            },
+            "Serotonin-Boosting Foods": {
+                "description": "These foods help to improve mood by increasing serotonin levels in the body.",
+                "food_sources": ["Quinoa", "Buckwheat"]
+            },
+            "Support for Progesterone Levels": {
+                "description": "These foods help promote healthy progesterone levels, which support the luteal phase.",
+                "food_sources": ["Sesame seeds", "Sunflower seeds"]
+            },
+            "Magnesium-Rich Foods": {
+                "description": "Magnesium helps to regulate mood and prevent cramping.",
+                "food_sources": ["Spinach", "Bananas", "Dark chocolate"]
+            },
+            "General Mood and Skin Health": {
+                "description": "These foods help with overall mood and skin health during this phase.",
+                "food_sources": ["Red meat", "Carrots", "Sweet potato", "Lentils", "Oats"]
+            }
+        },
+        "Exercise": {
+            "description": "Take advantage of your peak energy levels with high-intensity workouts",
+            "activities": ["Kickboxing", "Cycling", "Sprints"]
+        },
+        "Lifestyle Tip": {
+            "description": "Remember to reduce intake of caffeine, alcohol, added salt, and carbonated drinks to minimize stress on the liver during this phase."
+        }
+    },
+    "Follicular Phase": {
+        "Food": {
+            "Hormonal Balance": {
+                "description": "Supports overall hormonal balance and prepares the body for ovulation.",
+                "food_sources": [
+                    "Fresh vegetables (artichokes, broccoli, carrots, parsley, green peas, string beans, zucchini)",
+                    "Fresh fruits (berries, citrus fruits, apples)",
+                    "Lean proteins (poultry, fish, legumes, tofu)",
+                    "Healthy fats (avocados, nuts, seeds, olive oil)"
+                ]
+            },
+            "Energy Levels": {
+                "description": "Boosts energy and supports daily activities.",
+                "food_sources": [
+                    "Whole grains (quinoa, brown rice, whole wheat)",
+                    "Lean proteins (poultry, fish, legumes, tofu)"
+                ]
+            },
+            "Digestive Health": {
+                "description": "Supports a healthy gut and digestion.",
+                "food_sources": [
+                    "Fermented foods (kimchi, sauerkraut, kefir)",
+                    "Fiber-rich foods (squash, green peas, sweet potatoes)",
+                    "Sprouted grains and seeds"
+                ]
+            },
+            "Iron": {
+                "description": "Replenishes iron levels after menstruation.",
+                "food_sources": [
+                    "Lean meats",
+                    "Plant-based sources (legumes, tofu)",
+                    "Dark leafy greens",
+                    "Fortified cereals"
+                ]
+            },
+            "Zinc": {
+                "description": "Supports immune function and cellular repair.",
+                "food_sources": [
+                    "Shellfish (oysters, crab)",
+                    "Legumes (chickpeas, lentils)",
+                    "Seeds (pumpkin, sesame)",
+                    "Whole grains (quinoa, oats)"
+                ]
+            },
+            "Vitamin D": {
+                "description": "Promotes calcium absorption and supports bone health.",
+                "food_sources": [
+                    "Fatty fish (salmon, mackerel)",
+                    "Fortified foods (milk, orange juice)",
+                    "Egg yolks"
+                ]
+            }
+        },
+        "Exercise": {
+            "description": "As your energy levels increase, start adding in cardio-based workouts.",
+            "activities": ["Running", "Swimming", "Biking"]
+        }
+    },
+    "Ovulation Phase": {
+        "Food": {
+            "Healthy Fats": {
+                "description": "Supports hormone production and overall health.",
+                "food_sources": ["Organic salmon", "Sardines", "Organic eggs", "Almonds"]
+            },
+            "Vitamin B6": {
+                "description": "Essential for hormonal balance and neurotransmitter function.",
+                "food_sources": ["Sunflower seeds", "Sesame seeds", "Organic red meat"]
+            },
+            "Folate": {
+                "description": "Supports cellular repair and DNA synthesis.",
+                "food_sources": [
+                    "Leafy green vegetables (spinach, kale)",
+                    "Peas",
+                    "Kidney beans",
+                    "High-quality folate supplement"
+                ]
+            },
+            "Choline": {
+                "description": "Supports brain function and liver health.",
+                "food_sources": ["Organic eggs", "Seafood (oysters)"]
+            },
+            "Liver-Supporting Foods": {
+                "description": "Supports detoxification and hormone metabolism.",
+                "food_sources": ["Pumpkin", "Ginger"]
+            },
+            "Anti-Inflammatory Foods": {
+                "description": "Reduces inflammation and supports overall health.",
+                "food_sources": ["Berries", "Dark chocolate", "Garlic", "Vegetables", "Fatty fish"]
+            }
+        },
+        "Exercise": {
+            "description": "Take advantage of your peak energy levels with high-intensity workouts.",
+            "activities": ["Kickboxing", "Cycling HIIT", "Sprints"]
+        }
+    }
+}
+
+
+def phase_document(phase, catalogue=None):
+    # Response shape shared by the phase endpoints and the client's local rendering
+    phase_data = (recommendations if catalogue is None else catalogue)[phase]
+    return {
+        "phase": phase,
+        "food_recommendations": phase_data.get("Food", {}),
+        "exercise_recommendations": phase_data.get("Exercise", {}),
+        "lifestyle_tip": phase_data.get("Lifestyle Tip", {})
+    }
+
+
+def catalogue_version(catalogue=None):
+    # Content hash of the catalogue; changes whenever any recommendation text does
+    document = json.dumps(recommendations if catalogue is None else catalogue, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(document.encode("utf-8")).hexdigest()[:16]
+
+
+CATALOGUE_VERSION = catalogue_version()
+
+
+def compact_document(phase):
+    # Stands in for phase_document when the client renders from its cached catalogue
+    return {"phase": phase, "catalogue_version": CATALOGUE_VERSION}
+
+
+def expand_document(document, catalogue):
+    """Replace a compact phase document with the full one from ``catalogue``, keeping any extra fields."""
+    expanded = {key: value for key, value in document.items() if key != "catalogue_version"}
+    if document["phase"] in catalogue:
+        expanded.update(phase_document(document["phase"], catalogue))
+    return expanded
@@ -0,0 +1,86 @@
+"""Rotating refresh tokens.
+
+Access tokens are short-lived, and logging in again to replace one costs a
+full bcrypt check. ``/login`` therefore also issues a refresh token: a JWT
+signed with the same HMAC key, so checking one is as cheap as checking an
+access token, whose ``jti`` is recorded in ``RefreshToken``. ``/token/refresh``
+exchanges it for a new access token and a new refresh token.
+
+Each refresh token can be exchanged once. The tokens descending from one
+login form a family; presenting a token that was already exchanged means
+two parties hold it, so the whole family is revoked and the user has to log
+in again. ``/logout`` revokes the family too.
+"""
+from datetime import datetime, timezone
+
+from flask_jwt_extended import create_refresh_token, decode_token
+
+from models import db, RefreshToken
+
+
+class RefreshTokenInvalid(Exception):
+    """The refresh token is unknown, expired, revoked or already used."""
+
+
+def issue_refresh_token(user_id, family=None):
+    """New refresh token for ``user_id``; without ``family`` it starts a new one. Caller commits."""
+    token = create_refresh_token(identity=user_id)
+    claims = decode_token(token)
+    now = datetime.utcnow()
+    expires_at = claims.get('exp')
+
+    if family is None:
+        family = claims['jti']
+        # Logins are rare next to refreshes; tidy up the user's expired tokens here
+        RefreshToken.query.filter(
+            RefreshToken.user_id == user_id, RefreshToken.expires_at < now
+        ).delete(synchronize_session=False)
+
+    db.session.add(RefreshToken(
+        jti=claims['jti'],
+        family=family,
+        user_id=user_id,
+        created_at=now,
+        expires_at=_utc(expires_at) if expires_at is not None else None,
+    ))
+    return token
+
+
+def rotate_refresh_token(claims):
+    """Exchange the verified refresh token ``claims`` for ``(user_id, new refresh token)``. Caller commits.
+
+    Raises ``RefreshTokenInvalid``; when the token was already exchanged its
+    family has been revoked, which the caller should commit as well.
+    """
+    now = datetime.utcnow()
+    consumed = RefreshToken.query.filter(
+        RefreshToken.jti == claims['jti'], RefreshToken.used_at.is_(None), RefreshToken.revoked_at.is_(None)
+    ).update({'used_at': now}, synchronize_session=False)
+
+    entry = RefreshToken.query.get(claims['jti'])
+    if entry is None or entry.user_id != claims['sub']:
+        raise RefreshTokenInvalid("Unknown refresh token")
+    if not consumed:
+        if entry.revoked_at is None:
+            # Replayed: whoever holds the other copy must not be able to continue either
+            revoke_family(entry.family, now)
+        raise RefreshTokenInvalid("Refresh token has already been used or revoked")
+    return entry.user_id, issue_refresh_token(entry.user_id, entry.family)
+
+
+def revoke_refresh_token(claims):
+    """Revoke the family of the verified refresh token ``claims`` (logout). Caller commits."""
+    entry = RefreshToken.query.get(claims['jti'])
+    if entry is not None and entry.user_id == claims['sub']:
+        revoke_family(entry.family)
+
+
+def revoke_family(family, now=None):
+    RefreshToken.query.filter(
+        RefreshToken.family == family, RefreshToken.revoked_at.is_(None)
+    ).update({'revoked_at': now or datetime.utcnow()}, synchronize_session=False)
+
+
+def _utc(timestamp):
+    # Naive UTC, like the other DateTime columns
+    return datetime.fromtimestamp(timestamp, timezone.utc).replace(tzinfo=None)
@@ -0,0 +1,103 @@
+"""Batch job: queue reminders for users whose phase changes soon.
+
+Transitions are read from the materialized ``PhaseInterval`` timelines -
+the runs ``/menstrual-phase`` answers from - so reminders follow the same
+rules as the app, late-cycle predictions included, rather than projecting
+the latest cycle forward on their own. A transition is a run whose phase
+differs from the run before it; runs that differ only by rule (a recorded
+luteal phase continuing as a predicted one) are not.
+
+Users are scanned in keyset-paginated chunks of ``CycleStats`` ids, so
+memory stays bounded by the chunk size. Every transition within ``horizon``
+days is written to the ``PhaseReminder`` outbox with ``INSERT ... ON
+CONFLICT DO NOTHING`` on (user, day), so reruns and overlapping runs never
+queue a reminder twice. A sender picks up rows with no ``sent_at``.
+
+    python reminders.py [--date YYYY-MM-DD] [--horizon 1] [--chunk-size 20000]
+"""
+import argparse
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import and_, func, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from models import db, CycleStats, PhaseInterval, PhaseReminder
+
+DEFAULT_CHUNK_SIZE = 20000
+
+
+def iter_user_ranges(session, chunk_size):
+    """Yield ``(after_id, last_id, count)`` for chunks of users with a recorded cycle."""
+    table = CycleStats.__table__
+    ids = select(table.c.user_id).where(table.c.last_period_start.isnot(None)).order_by(table.c.user_id)
+
+    last_id = 0
+    while True:
+        rows = session.execute(ids.where(table.c.user_id > last_id).limit(chunk_size)).all()
+        if not rows:
+            return
+        yield last_id, rows[-1][0], len(rows)
+        last_id = rows[-1][0]
+
+
+def due_reminders(session, after_id, last_id, today, horizon):
+    """Outbox rows for phase changes from tomorrow through ``horizon`` days ahead, for users in the id range."""
+    intervals = PhaseInterval.__table__
+    # Runs starting after the window are never needed, but the window function must still see the run before it
+    runs = select(
+        intervals.c.user_id, intervals.c.starts_on, intervals.c.phase,
+        func.lag(intervals.c.phase).over(partition_by=intervals.c.user_id, order_by=intervals.c.starts_on)
+        .label('previous'),
+    ).where(
+        intervals.c.user_id > after_id, intervals.c.user_id <= last_id,
+        intervals.c.starts_on <= today + timedelta(days=horizon),
+    ).subquery()
+
+    transitions = select(runs.c.user_id, runs.c.starts_on, runs.c.phase).where(and_(
+        runs.c.starts_on > today, runs.c.previous.isnot(None), runs.c.previous != runs.c.phase,
+    ))
+    created_at = datetime.utcnow()
+    return [
+        {'user_id': user_id, 'remind_on': starts_on, 'phase': phase, 'created_at': created_at}
+        for user_id, starts_on, phase in session.execute(transitions)
+    ]
+
+
+def schedule_reminders(today=None, horizon=1, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Queue reminders for transitions in the next ``horizon`` days; returns counts.
+
+    Runs inside an app context and commits after each chunk.
+    """
+    today = today or date.today()
+    outbox = sqlite_insert(PhaseReminder.__table__).on_conflict_do_nothing(
+        index_elements=['user_id', 'remind_on']
+    )
+
+    report = {'users': 0, 'due': 0, 'queued': 0}
+    for after_id, last_id, count in iter_user_ranges(db.session, chunk_size):
+        reminders = due_reminders(db.session, after_id, last_id, today, horizon)
+        if reminders:
+            result = db.session.execute(outbox, reminders)
+            report['queued'] += max(result.rowcount, 0)
+        db.session.commit()
+        report['users'] += count
+        report['due'] += len(reminders)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--date', type=date.fromisoformat, help='run as if today were this date')
+    parser.add_argument('--horizon', type=int, default=1, help='days ahead to look for transitions')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    from app import app
+
+    with app.app_context():
+        report = schedule_reminders(args.date, args.horizon, args.chunk_size)
+    print(f"Scanned {report['users']} users: {report['due']} due, {report['queued']} newly queued")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""SQLite engine configuration.
+
+``configure_storage`` fills in the database URI and engine options before
+``db.init_app``; ``Storage.init_app`` then tunes each connection as it is
+opened and, for file databases, sets up a second, read-only engine that
+GET endpoints use through ``read_session`` so reads never queue behind
+writers for a pooled connection. ``snapshot`` gives a session whose queries
+all run in one read transaction, for reads that must agree with each other.
+
+Profiles (``STORAGE_PROFILE``):
+
+* ``production`` - WAL journal, ``synchronous=NORMAL``, memory-mapped I/O, a
+  busy timeout and pooled connections.
+* ``baseline`` - SQLite defaults (rollback journal, no pooling, no read-only
+  engine); kept so the two can be compared.
+
+Settings can also come from the environment: ``PHASE_DATABASE_URI``,
+``PHASE_STORAGE_PROFILE``, ``PHASE_DB_POOL_SIZE``, ``PHASE_DB_READ_POOL_SIZE``,
+``PHASE_DB_BUSY_TIMEOUT_MS`` and ``PHASE_DB_MMAP_SIZE``.
+"""
+import os
+from contextlib import contextmanager
+
+from flask import g
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import QueuePool
+
+PRODUCTION = 'production'
+BASELINE = 'baseline'
+
+DEFAULTS = {
+    'SQLALCHEMY_DATABASE_URI': ('PHASE_DATABASE_URI', str, 'sqlite:///app.db'),
+    'STORAGE_PROFILE': ('PHASE_STORAGE_PROFILE', str, PRODUCTION),
+    'STORAGE_POOL_SIZE': ('PHASE_DB_POOL_SIZE', int, 5),
+    'STORAGE_READ_POOL_SIZE': ('PHASE_DB_READ_POOL_SIZE', int, 10),
+    'STORAGE_BUSY_TIMEOUT_MS': ('PHASE_DB_BUSY_TIMEOUT_MS', int, 5000),
+    'STORAGE_MMAP_SIZE': ('PHASE_DB_MMAP_SIZE', int, 256 * 1024 * 1024),
+}
+
+
+def configure_storage(app):
+    """Fill in storage settings and SQLAlchemy engine options; call before ``db.init_app``."""
+    for key, (env_name, cast, default) in DEFAULTS.items():
+        if env_name in os.environ:
+            app.config[key] = cast(os.environ[env_name])
+        else:
+            app.config.setdefault(key, default)
+
+    if app.config['STORAGE_PROFILE'] == PRODUCTION and is_sqlite_file(app.config['SQLALCHEMY_DATABASE_URI']):
+        options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+        options.setdefault('poolclass', QueuePool)
+        options.setdefault('pool_size', app.config['STORAGE_POOL_SIZE'])
+        options.setdefault('max_overflow', app.config['STORAGE_POOL_SIZE'] * 2)
+        connect_args = options.setdefault('connect_args', {})
+        # Pooled connections move between request threads
+        connect_args.setdefault('check_same_thread', False)
+        connect_args.setdefault('timeout', app.config['STORAGE_BUSY_TIMEOUT_MS'] / 1000)
+
+
+def is_sqlite_file(uri):
+    url = make_url(uri)
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+
+
+def sqlite_path(app, uri):
+    # Flask-SQLAlchemy resolves relative SQLite paths against the app root
+    database = make_url(uri).database
+    return database if os.path.isabs(database) else os.path.join(app.root_path, database)
+
+
+class Storage:
+    def __init__(self, app=None, db=None):
+        self.read_engine = None
+        self._read_sessions = None
+        self._file_database = False
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        app.extensions['storage'] = self
+        self._db = db
+        uri = app.config['SQLALCHEMY_DATABASE_URI']
+        self._file_database = is_sqlite_file(uri)
+        if app.config.get('STORAGE_PROFILE') != PRODUCTION or not is_sqlite_file(uri):
+            return
+
+        busy_timeout = app.config['STORAGE_BUSY_TIMEOUT_MS']
+        mmap_size = app.config['STORAGE_MMAP_SIZE']
+
+        with app.app_context():
+            write_engine = db.get_engine()
+
+        @event.listens_for(write_engine, 'connect')
+        def tune_write_connection(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute('PRAGMA synchronous=NORMAL')
+            cursor.execute(f'PRAGMA busy_timeout={busy_timeout:d}')
+            cursor.execute(f'PRAGMA mmap_size={mmap_size:d}')
+            cursor.close()
+
+        path = sqlite_path(app, uri)
+        self.read_engine = create_engine(
+            f'sqlite:///file:{path}?mode=ro&uri=true',
+            poolclass=QueuePool,
+            pool_size=app.config['STORAGE_READ_POOL_SIZE'],
+            max_overflow=app.config['STORAGE_READ_POOL_SIZE'] * 2,
+            connect_args={'check_same_thread': False, 'timeout': busy_timeout / 1000},
+        )
+
+        @event.listens_for(self.read_engine, 'connect')
+        def tune_read_connection(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute('PRAGMA query_only=1')
+            cursor.execute(f'PRAGMA busy_timeout={busy_timeout:d}')
+            cursor.execute(f'PRAGMA mmap_size={mmap_size:d}')
+            cursor.close()
+
+        self._read_sessions = sessionmaker(bind=self.read_engine)
+
+        @app.teardown_appcontext
+        def close_read_session(exception=None):
+            session = g.pop('read_session', None)
+            if session is not None:
+                session.close()
+
+    def read_session(self):
+        """Session for read-only queries; the normal session when no read-only engine is configured."""
+        if self._read_sessions is None:
+            return self._db.session
+        if 'read_session' not in g:
+            g.read_session = self._read_sessions()
+        return g.read_session
+
+    @contextmanager
+    def snapshot(self):
+        """Read-only session whose queries all see the same state of the database."""
+        if not self._file_database:
+            # An in-memory database has a single connection, so there is nothing to diverge from
+            yield self._db.session
+            return
+        with (self.read_engine or self._db.engine).connect() as connection:
+            # pysqlite only opens a transaction before a write; without one each SELECT reads its own snapshot
+            connection.exec_driver_sql('BEGIN')
+            session = Session(bind=connection)
+            try:
+                yield session
+            finally:
+                session.close()
@@ -1,11 +1,8 @@
 import streamlit as st
-import requests
 from datetime import datetime, timedelta
 import time
 from datetime import date
-
-# Backend URL
-BASE_URL = "http://129.133.72.121:8080"
+import phase_client
 
 # Initialize Session State
 if "access_token" not in st.session_state:
@@ -15,37 +12,27 @@ if "page" not in st.session_state:
     
 # Helper function to fetch current phase and recommendations
 def fetch_current_phase(selected_date=None):
-    headers = {"Authorization": f"Bearer {st.session_state['access_token']}"}
-    payload = {
-        "period_start": st.session_state.get("period_start"),
-        "period_end": st.session_state.get("period_end"),
-    }
+    period_start = st.session_state.get("period_start")
+    period_end = st.session_state.get("period_end")
     if selected_date:
-        payload["selected_date"] = selected_date.strftime("%Y-%m-%d")
-        endpoint = "select-date"
+        # Computed locally from the catalogue; no backend call
+        status_code, phase_data = phase_client.select_date_phase(period_start, period_end, selected_date)
     else:
-        endpoint = "menstrual-phase"
-
-    response = requests.post(
-        f"{BASE_URL}/{endpoint}",
-        json=payload,
-        headers=headers,
-    )
-    if response.status_code == 200:
-        phase_data = response.json()
+        status_code, phase_data = phase_client.fetch_phase(period_start, period_end)
+    if status_code == 200:
+        if selected_date:
+            phase_data = phase_data.get("phase", {})
         return phase_data.get("phase"), phase_data.get("food_recommendations"), phase_data.get("exercise_recommendations"), phase_data.get("lifestyle_tip")
     else:
         return "Unknown", {}, {}, {}
 
 # Helper Function to Handle Authentication
 def authenticate(action, payload):
-    url = f"{BASE_URL}/{action}"
-    headers = {"Content-Type": "application/json"}
     try:
-        response = requests.post(url, json=payload, headers=headers)
+        response = phase_client.post(action, payload, authenticated=False)
         response.raise_for_status()
         return response.json()
-    except requests.exceptions.RequestException as e:
+    except phase_client.RequestException as e:
         print(f"Error: {e}")
         return None
 
@@ -77,7 +64,7 @@ def main():
     elif st.session_state["page"] == "record_page":
         record_page()
     elif st.session_state["page"] == "logout":
-        st.session_state["access_token"] = None
+        phase_client.logout()
         st.write("You have been logged out.")
         st.button("Back to Dashboard", on_click=set_page, args=["dashboard_page"])
 
@@ -189,8 +176,8 @@ def login_page():
                 payload = {"email": login_email, "password": login_password}
                 result = authenticate("login", payload)
                 if result and "access_token" in result:
-                    st.session_state["access_token"] = result["access_token"]
-                    if fetch_cycle_data():  # Fetch and store cycle data
+                    phase_client.store_tokens(result)
+                    if load_dashboard():  # Fetch cycle data and today's phase in one batch
                         set_success_and_navigate("Login successful!", "main")
                     else:
                         st.error("Login successful, but failed to load your cycle data. Please update it on the dashboard.")
@@ -267,16 +254,15 @@ def signup_page():
                         st.error("Sign-up successful, but login failed. Please log in manually.")
                         return
                     
-                    # Save access token
-                    st.session_state["access_token"] = login_result["access_token"]
+                    # Save access and refresh tokens
+                    phase_client.store_tokens(login_result)
 
                     # Step 3: Save Cycle Data
-                    headers = {"Authorization": f"Bearer {st.session_state['access_token']}"}
                     cycle_payload = {
                         "period_start": signup_start_date.strftime("%Y-%m-%d"),
                         "period_end": signup_end_date.strftime("%Y-%m-%d"),
                     }
-                    cycle_result = requests.post(f"{BASE_URL}/cycle-data", json=cycle_payload, headers=headers)
+                    cycle_result = phase_client.post("cycle-data", cycle_payload)
                     if cycle_result.status_code != 200:
                         st.error("Sign-up successful, but failed to save cycle data. Please add it manually.")
                         return
@@ -412,34 +398,24 @@ def add_dashboard_css():
     
 def run_select_date_function(selected_date):
     """Call the backend select-date function."""
-    headers = {"Authorization": f"Bearer {st.session_state['access_token']}"}
-    payload = {
-        "selected_date": selected_date.strftime("%Y-%m-%d"),
-        "period_start": st.session_state.get("period_start"),
-        "period_end": st.session_state.get("period_end"),
-    }
     try:
-        st.write("Payload being sent to the backend:", payload)  # Debugging log
-        response = requests.post(
-            f"{BASE_URL}/select-date",
-            json=payload,
-            headers=headers,
+        status_code, phase_data = phase_client.select_date_phase(
+            st.session_state.get("period_start"),
+            st.session_state.get("period_end"),
+            selected_date,
         )
-        st.write("Backend response status:", response.status_code)  # Debugging log
-        st.write("Backend response text:", response.text)  # Debugging log
-        if response.status_code == 200:
-            return response.json()  # Return the phase response
+        if status_code == 200:
+            return phase_data  # Return the phase response
         else:
-            st.error(response.json().get("error", "Failed to fetch phase."))
+            st.error(phase_data.get("error", "Failed to fetch phase."))
             return None
     except Exception as e:
         st.error(f"Error fetching phase: {e}")
         return None
     
 def fetch_cycle_data():
-    headers = {"Authorization": f"Bearer {st.session_state['access_token']}"}
     try:
-        response = requests.get(f"{BASE_URL}/cycle-data", headers=headers)
+        response = phase_client.get("cycle-data")
         if response.status_code == 200:
             cycle_data = response.json()
             st.session_state["period_start"] = datetime.strptime(cycle_data["period_start"], "%Y-%m-%d").date()
@@ -452,6 +428,36 @@ def fetch_cycle_data():
         st.error(f"Error fetching cycle data: {e}")
         return False
     
+def load_dashboard():
+    """Fetch cycle data, today's phase and the recommendation catalogue in a single /batch round trip."""
+    batch = {
+        "requests": [
+            {"route": "/cycle-data", "method": "GET"},
+            {"route": "/menstrual-phase?view=compact", "method": "POST", "body": {}},
+            {"route": "/catalogue", "method": "GET"},
+        ]
+    }
+    try:
+        response = phase_client.post("batch", batch)
+        if response.status_code != 200:
+            return fetch_cycle_data()
+
+        cycle_result, phase_result, catalogue_result = response.json()["responses"]
+        if catalogue_result["status"] == 200:
+            phase_client.store_catalogue(catalogue_result["body"])
+        if cycle_result["status"] != 200:
+            st.warning("Failed to fetch cycle data. Please update your data.")
+            return False
+
+        cycle_data = cycle_result["body"]
+        st.session_state["period_start"] = datetime.strptime(cycle_data["period_start"], "%Y-%m-%d").date()
+        st.session_state["period_end"] = datetime.strptime(cycle_data["period_end"], "%Y-%m-%d").date()
+        st.session_state["initial_phase"] = (phase_result["status"], phase_client.expand_phase_body(phase_result["body"]))
+        return True
+    except Exception as e:
+        st.error(f"Error loading dashboard: {e}")
+        return False
+    
 def set_selected_date(delta_days):
     """Callback to update the selected date by delta days."""
     st.session_state.selected_date += timedelta(days=delta_days)
@@ -508,20 +514,19 @@ def dashboard_page():
     with col3:
         st.button("▶", on_click=set_selected_date, args=[1], key="next_day")
 
-    # Fetch menstrual phase automatically
-    headers = {"Authorization": f"Bearer {st.session_state['access_token']}"}
+    # Fetch menstrual phase automatically (the first render after login reuses the batched result;
+    # later reruns are served from the client cache until the inputs change)
     try:
-        response = requests.post(
-            f"{BASE_URL}/menstrual-phase",
-            json={
-                "period_start": st.session_state.get("period_start").strftime("%Y-%m-%d"),
-                "period_end": st.session_state.get("period_end").strftime("%Y-%m-%d"),
-            },
-            headers=headers,
-        )
+        initial_phase = st.session_state.pop("initial_phase", None)
+        if initial_phase is not None:
+            status_code, phase_data = initial_phase
+        else:
+            status_code, phase_data = phase_client.fetch_phase(
+                st.session_state.get("period_start"),
+                st.session_state.get("period_end"),
+            )
 
-        if response.status_code == 200:
-            phase_data = response.json()
+        if status_code == 200:
             current_phase = phase_data.get("phase", "Unknown")
 
             # Display phase and message
@@ -567,7 +572,7 @@ def dashboard_page():
             if not food_recommendations and not exercise_recommendations and not lifestyle_tip:
                 st.warning("No recommendations available for this phase.")
         else:
-            st.error(response.json().get("error", "Failed to fetch phase details."))
+            st.error(phase_data.get("error", "Failed to fetch phase details."))
     except Exception as e:
         st.error(f"Error retrieving phase details: {e}")
 
@@ -582,18 +587,14 @@ def dashboard_page():
         
 def update_phase_for_selected_date(selected_date):
     try:
-        response = requests.post(
-            f"{BASE_URL}/select-date",
-            json={
-                "period_start": st.session_state.get("period_start").strftime("%Y-%m-%d"),
-                "period_end": st.session_state.get("period_end").strftime("%Y-%m-%d"),
-                "selected_date": selected_date.strftime("%Y-%m-%d"),
-            },
-            headers={"Authorization": f"Bearer {st.session_state['access_token']}"},
+        status_code, phase_data = phase_client.select_date_phase(
+            st.session_state.get("period_start"),
+            st.session_state.get("period_end"),
+            selected_date,
         )
 
-        if response.status_code == 200:
-            result = response.json().get("phase", {})
+        if status_code == 200:
+            result = phase_data.get("phase", {})
             phase = result.get("phase", "Unknown")
             food_recommendations = result.get("food_recommendations", {})
             exercise_recommendations = result.get("exercise_recommendations", {})
@@ -637,7 +638,7 @@ def update_phase_for_selected_date(selected_date):
                 st.warning("No recommendations available for this phase.")
 
         else:
-            st.error(response.json().get("error", "Failed to fetch phase for the selected date."))
+            st.error(phase_data.get("error", "Failed to fetch phase for the selected date."))
     except Exception as e:
         st.error(f"Error fetching selected date phase: {e}")
 
@@ -669,21 +670,25 @@ def save_record(age, height, weight, period_start, period_end):
     notification_placeholder.success("Information recorded successfully!")
     try:
         # Call the backend to save the record and get the updated phase information
-        response = requests.post(
-            f"{BASE_URL}/record",
-            json={
+        response = phase_client.post(
+            "record?view=compact",
+            {
                 "age": age,
                 "height": height,
                 "weight": weight,
                 "period_start": period_start.strftime("%Y-%m-%d"),
                 "period_end": period_end.strftime("%Y-%m-%d"),
             },
-            headers={"Authorization": f"Bearer {st.session_state['access_token']}"},
         )
 
         if response.status_code == 200:
+            # The cycle changed: use the new dates and drop memoized phases
+            st.session_state["period_start"] = period_start
+            st.session_state["period_end"] = period_end
+            phase_client.invalidate_phase_cache()
+
             # Extract the updated recommendations and phase
-            result = response.json()
+            result = phase_client.expand_phase_body(response.json())
             phase = result.get("phase", "Unknown")
             message = result.get("message", "")
             food_recommendations = result.get("food_recommendations", {})
@@ -0,0 +1,39 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# The app configures itself from the environment on import: point it at a scratch database, hash inline and cheaply
+DATA_DIR = tempfile.mkdtemp(prefix='phase-tests-')
+os.environ['PHASE_DATABASE_URI'] = f"sqlite:///{os.path.join(DATA_DIR, 'app.db')}"
+os.environ['BCRYPT_POOL_SIZE'] = '0'
+os.environ['BCRYPT_LOG_ROUNDS'] = '4'
+os.environ.pop('PHASE_ADMISSION_STORE', None)
+os.environ.pop('PHASE_METRICS_DIR', None)
+
+
+@pytest.fixture(scope='session')
+def app():
+    import app as phase_app
+    return phase_app.app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def login(client):
+    """Sign up ``email`` (once) and log in; returns the login response body."""
+    def login(email, password='correct horse'):
+        client.post('/signup', json={'email': email, 'password': password, 'name': 'Test',
+                                     'age': 30, 'height': 165.0, 'weight': 60.0})
+        response = client.post('/login', json={'email': email, 'password': password})
+        assert response.status_code == 200, response.get_json()
+        return response.get_json()
+    return login
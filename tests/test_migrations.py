@@ -0,0 +1,81 @@
+"""Migration runner: one process migrates at a time, and a failed DDL step leaves nothing behind."""
+import fcntl
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import time
+
+import pytest
+from sqlalchemy import inspect, text
+
+from conftest import ROOT
+
+from migrations import MIGRATIONS, applied_versions, migrate, migration
+
+MIGRATE_SCRIPT = (
+    "import json\n"
+    "from app import app\n"
+    "from migrations import migrate\n"
+    "with app.app_context():\n"
+    "    print(json.dumps(migrate()))\n"
+)
+
+
+def start_migration(database):
+    env = dict(os.environ, PHASE_DATABASE_URI=f'sqlite:///{database}', PHASE_MIGRATE_ON_STARTUP='0')
+    return subprocess.Popen([sys.executable, '-c', MIGRATE_SCRIPT], cwd=ROOT, env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+
+
+def finish(process):
+    stdout, stderr = process.communicate(timeout=60)
+    assert process.returncode == 0, stderr
+    return json.loads(stdout.strip().splitlines()[-1])
+
+
+def test_concurrent_workers_apply_each_migration_once(tmp_path):
+    database = tmp_path / 'concurrent.db'
+    applied = [finish(process) for process in [start_migration(database) for _ in range(4)]]
+
+    every_version = [step.version for step in MIGRATIONS]
+    # One worker did all the work; the others found nothing left once they got the lock
+    assert sorted(map(sorted, applied)) == [[], [], [], every_version]
+    recorded = sqlite3.connect(database).execute('SELECT version FROM schema_version ORDER BY version').fetchall()
+    assert [version for version, in recorded] == every_version
+
+
+def test_migrate_waits_for_the_lock(tmp_path):
+    database = tmp_path / 'locked.db'
+    with open(f'{database}.migrate.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        process = start_migration(database)
+        time.sleep(1.0)
+        assert process.poll() is None, "migrate() ran while another process held the lock"
+        fcntl.flock(lock, fcntl.LOCK_UN)
+    assert finish(process) == [step.version for step in MIGRATIONS]
+
+
+@pytest.fixture
+def broken_migration():
+    version = MIGRATIONS[-1].version + 1000
+
+    @migration(version, "Creates a table, then fails")
+    def broken(connection):
+        connection.execute(text('CREATE TABLE half_migrated (id INTEGER PRIMARY KEY)'))
+        raise RuntimeError("migration failed")
+
+    yield version
+    MIGRATIONS.remove(next(step for step in MIGRATIONS if step.version == version))
+
+
+def test_failed_ddl_step_rolls_back_with_its_version(app, broken_migration):
+    from models import db
+
+    with app.app_context():
+        with pytest.raises(RuntimeError):
+            migrate()
+        assert 'half_migrated' not in inspect(db.engine).get_table_names()
+        assert broken_migration not in applied_versions()
+        db.session.remove()
@@ -0,0 +1,52 @@
+"""Refresh token rotation, replay detection and logout revocation."""
+
+
+def refresh(client, token):
+    return client.post('/token/refresh', headers={'Authorization': f'Bearer {token}'})
+
+
+def test_refresh_rotates_tokens(client, login):
+    tokens = login('rotate@example.com')
+
+    response = refresh(client, tokens['refresh_token'])
+    assert response.status_code == 200
+    rotated = response.get_json()
+    assert rotated['refresh_token'] != tokens['refresh_token']
+    assert client.get('/cycle-data', headers={'Authorization': f"Bearer {rotated['access_token']}"}).status_code \
+        in (200, 404)
+
+    # The new refresh token is good for exactly one more exchange
+    assert refresh(client, rotated['refresh_token']).status_code == 200
+
+
+def test_replayed_refresh_token_revokes_the_family(client, login):
+    tokens = login('replay@example.com')
+    rotated = refresh(client, tokens['refresh_token']).get_json()
+
+    # Presenting the already exchanged token means two parties hold it
+    assert refresh(client, tokens['refresh_token']).status_code == 401
+    # ... so the legitimate successor stops working too
+    assert refresh(client, rotated['refresh_token']).status_code == 401
+
+
+def test_replay_leaves_other_logins_alone(client, login):
+    first = login('sessions@example.com')
+    second = login('sessions@example.com')
+
+    refresh(client, first['refresh_token'])
+    assert refresh(client, first['refresh_token']).status_code == 401
+    assert refresh(client, second['refresh_token']).status_code == 200
+
+
+def test_logout_revokes_the_family(client, login):
+    tokens = login('logout@example.com')
+    rotated = refresh(client, tokens['refresh_token']).get_json()
+
+    response = client.post('/logout', headers={'Authorization': f"Bearer {rotated['refresh_token']}"})
+    assert response.status_code == 200
+    assert refresh(client, rotated['refresh_token']).status_code == 401
+
+
+def test_access_token_is_not_a_refresh_token(client, login):
+    tokens = login('access@example.com')
+    assert refresh(client, tokens['access_token']).status_code in (401, 422)